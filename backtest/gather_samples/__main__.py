@@ -11,11 +11,11 @@ import web3
 import web3.types
 import web3._utils.filters
 import psycopg2.extensions
-from backtest.gather_samples.analyses import get_arbitrage_if_exists
+from backtest.gather_samples.analyses import get_arbitrage_from_receipt_if_exists
 from backtest.gather_samples.database import insert_arbs, setup_db
 
 from backtest.utils import ERC20_TRANSFER_TOPIC_HEX, ERC20_TRANSFER_TOPIC, CancellationToken, connect_db
-from utils import setup_logging, erc20
+from utils import RetryingProvider, get_transaction_receipts, setup_logging, erc20
 from utils.throttler import BlockThrottle
 
 l = logging.getLogger(__name__)
@@ -64,13 +64,7 @@ def main():
             }
         ))
 
-        w3 = web3.Web3(web3.WebsocketProvider(
-            erigon_host,
-            websocket_timeout=60 * 5,
-            websocket_kwargs={
-                'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-            },
-        ))
+        w3 = web3.Web3(RetryingProvider([erigon_host]))
         
         # Now that we are using HTTPProvider, there are a lot of noisy debug messages.
         set_http_debug = os.getenv('SET_HTTP_DEBUG', 'false').lower() == 'true'
@@ -400,15 +394,17 @@ def process_batch(
     l.debug(f'Have {len(tx_to_parsed_txns)} transactions to investigate')
 
     # Process each transaction
+    tx_hashes = list(tx_to_parsed_txns.keys())
+    receipts = get_transaction_receipts(w3, tx_hashes)
+
     arbs = []
     processed_already = set()
-    for tx_hash, txns in tx_to_parsed_txns.items():
+    for tx_hash, receipt in zip(tx_hashes, receipts):
+        txns = tx_to_parsed_txns[tx_hash]
         assert tx_hash not in processed_already
         processed_already.add(tx_hash)
         if len(txns) >= 3:
-            arb = get_arbitrage_if_exists(
-                w3, tx_hash, txns
-            )
+            arb = get_arbitrage_from_receipt_if_exists(receipt, txns)
             if arb is not None:
                 arbs.append(arb)
     
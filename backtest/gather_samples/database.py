@@ -7,6 +7,7 @@ import web3
 from backtest.gather_samples.models import Arbitrage
 from backtest.gather_samples.tokens import Token, get_token, get_cached_token
 import cachetools
+import utils.memory
 
 l = logging.getLogger(__name__)
 
@@ -145,6 +146,8 @@ def get_and_insert_tokens(
 
 
 _exchange_cache = cachetools.LRUCache(maxsize=10_000)
+utils.memory.register_cache('exchange_cache', lambda: _exchange_cache)
+
 def get_exchange_ids(curr: psycopg2.extensions.cursor, addresses: typing.List[str]) -> typing.List[int]:
     ret = [None] * len(addresses)
 
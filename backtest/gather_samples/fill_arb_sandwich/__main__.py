@@ -15,7 +15,7 @@ from backtest.gather_samples.analyses import get_addr_to_movements, get_arbitrag
 from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
 from backtest.gather_samples.models import *
 
-from utils import setup_logging, erc20
+from utils import connect_web3, setup_logging, erc20
 
 l = logging.getLogger(__name__)
 
@@ -51,15 +51,7 @@ def main():
         reset_db(curr)
         return
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-
-    w3 = web3.Web3(web3.WebsocketProvider(
-        web3_host,
-        websocket_timeout=60 * 5,
-        websocket_kwargs={
-            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-        },
-    ))
+    w3 = connect_web3()
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
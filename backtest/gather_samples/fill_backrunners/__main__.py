@@ -24,7 +24,7 @@ import numpy as np
 
 import backtest.gather_samples.analyses
 from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
-from utils import get_abi, setup_logging
+from utils import connect_web3, get_abi, get_fork_url, setup_logging
 from utils import erc20
 
 l = logging.getLogger(__name__)
@@ -114,14 +114,7 @@ def main():
 
     # return
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-    w3 = web3.Web3(web3.WebsocketProvider(
-        web3_host,
-        websocket_timeout=60 * 5,
-        websocket_kwargs={
-            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-        },
-    ))
+    w3 = connect_web3()
     
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -312,7 +305,7 @@ def open_ganache() -> typing.Tuple[subprocess.Popen, web3.Web3]:
     my_pid = os.getpid()
     ganache_port = 34451 + (my_pid % 10_000)
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
+    web3_host = get_fork_url()
     p = subprocess.Popen(
         [
             'node',
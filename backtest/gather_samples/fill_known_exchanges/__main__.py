@@ -19,6 +19,7 @@ import web3.contract
 import web3._utils.filters
 
 from backtest.utils import connect_db
+from utils.log_archive import get_log_archive
 
 from .scrapers.balancer import BalancerScraper
 from .scrapers.balancerv2 import BalancerV2Scraper
@@ -112,6 +113,8 @@ def main():
 
     l.debug(f'Watching {len(all_addresses):,} addresses')
 
+    archive = get_log_archive()
+
     t_start = time.time()
     batch_size = 5_000
     for i in itertools.count():
@@ -132,12 +135,15 @@ def main():
 
         l.debug(f'Polling {this_start_block:,} to {this_end_block:,}')
 
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'address': list(all_addresses),
-            'fromBlock': this_start_block,
-            'toBlock':   this_end_block,
-        })
-        logs = f.get_all_entries()
+        if archive is not None and archive.covers(this_start_block, this_end_block, all_addresses):
+            logs = archive.get_logs(this_start_block, this_end_block, all_addresses)
+        else:
+            f: web3._utils.filters.Filter = w3.eth.filter({
+                'address': list(all_addresses),
+                'fromBlock': this_start_block,
+                'toBlock':   this_end_block,
+            })
+            logs = f.get_all_entries()
 
         for s in scrapers:
             s.scrape(curr, w3, logs)
@@ -19,7 +19,7 @@ import web3.contract
 import web3._utils.filters
 from backtest.utils import connect_db
 
-from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, setup_logging
+from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, iter_transaction_receipts, setup_logging
 
 ROLLING_WINDOW_SIZE_BLOCKS = 60 * 60 // 13 # about 1 hour
 
@@ -143,7 +143,12 @@ def estimate_gas(curr: psycopg2.extensions.cursor, id_: int, n_workers: int):
     t_last_update = time.time()
     rolling_windows = collections.defaultdict(lambda: collections.deque())
 
-    for id_, block_number, gas_price, coinbase_xfer, txn_hash, has_uniswap_v2, has_uniswap_v3, has_sushiswap, has_shibaswap, has_balancer_v1, has_balancer_v2, all_known, n_exchanges, is_flashbots in list(curr):
+    rows = list(curr)
+
+    # receipts are only needed where there was a coinbase transfer; fetch those in batches, in row order
+    coinbase_xfer_receipts = iter_transaction_receipts(w3, [row[4].tobytes() for row in rows if row[3] > 0])
+
+    for id_, block_number, gas_price, coinbase_xfer, txn_hash, has_uniswap_v2, has_uniswap_v3, has_sushiswap, has_shibaswap, has_balancer_v1, has_balancer_v2, all_known, n_exchanges, is_flashbots in rows:
 
         if block_number > last_block_number:
             # push update
@@ -186,7 +191,8 @@ def estimate_gas(curr: psycopg2.extensions.cursor, id_: int, n_workers: int):
             coinbase_xfer = int(coinbase_xfer)
             # must get transaction to compute effective gas price
             l.debug(f'getting transaction for {id_} {txn_hash.hex()} to re-compute gas price')
-            receipt = w3.eth.get_transaction_receipt(txn_hash)
+            receipt = next(coinbase_xfer_receipts)
+            assert bytes(receipt['transactionHash']) == txn_hash
             gas_used = receipt['gasUsed']
 
             gas_price = (gas_used * receipt['effectiveGasPrice'] + coinbase_xfer) // gas_used
@@ -19,7 +19,7 @@ import web3.contract
 import web3._utils.filters
 from backtest.utils import ERC20_TRANSFER_TOPIC, connect_db
 
-from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, setup_logging, erc20
+from utils import BALANCER_VAULT_ADDRESS, connect_web3, get_abi, iter_transaction_receipts, setup_logging, erc20
 
 ROLLING_WINDOW_SIZE_BLOCKS = 60 * 60 // 13 # about 1 hour
 
@@ -70,9 +70,9 @@ def main():
         )
         n_to_process = curr.rowcount
         n_broken = 0
-        for i, (id_, txn_hash) in enumerate(curr):
-            txn_hash: bytes = txn_hash.tobytes()
-            receipt = w3.eth.get_transaction_receipt(txn_hash)
+        rows = [(id_, txn_hash.tobytes()) for id_, txn_hash in curr]
+        receipts = iter_transaction_receipts(w3, [txn_hash for _, txn_hash in rows])
+        for i, ((id_, txn_hash), receipt) in enumerate(zip(rows, receipts)):
 
             if last_update + 10 < time.time() and i > 0:
                 last_update = time.time()
@@ -15,7 +15,7 @@ import web3.contract
 import web3._utils.filters
 from backtest.utils import connect_db
 
-from utils import get_abi, setup_logging
+from utils import connect_web3, get_abi, iter_transaction_receipts, setup_logging
 
 
 l = logging.getLogger(__name__)
@@ -41,15 +41,7 @@ def main():
     db = connect_db()
     curr = db.cursor()
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
-
-    w3 = web3.Web3(web3.WebsocketProvider(
-        web3_host,
-        websocket_timeout=60 * 5,
-        websocket_kwargs={
-            'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-        },
-    ))
+    w3 = connect_web3()
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -120,9 +112,13 @@ def scrape_v4(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int,
     l.debug(f'have {curr.rowcount} transactions to look through for zeroex v4')
     all_arb_ids: typing.List[int] = [x for (x,) in curr]
 
+    curr.execute('SELECT id, txn_hash FROM sample_arbitrages WHERE id = ANY(%s)', (all_arb_ids,))
+    arb_txn_hashes: typing.Dict[int, bytes] = {id_: txn_hash.tobytes() for id_, txn_hash in curr}
+    receipts = iter_transaction_receipts(w3, [arb_txn_hashes[arb_id] for arb_id in all_arb_ids])
+
     start_time = time.time()
 
-    for i, arb_id in enumerate(all_arb_ids):
+    for i, (arb_id, receipt) in enumerate(zip(all_arb_ids, receipts)):
         if i % 100 == 1:
             # status update
             elapsed = time.time() - start_time
@@ -134,14 +130,11 @@ def scrape_v4(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: int,
             curr.connection.commit()
 
 
-        curr.execute('SELECT txn_hash FROM sample_arbitrages WHERE id = %s', (arb_id,))
-        (txn_hash,) = curr.fetchone()
-        txn_hash = txn_hash.tobytes()
+        txn_hash = arb_txn_hashes[arb_id]
         l.debug(f'processing https://etherscan.io/tx/0x{txn_hash.hex()}')
 
         zerox_exchanges = set()
 
-        receipt = w3.eth.get_transaction_receipt(txn_hash)
         for log in receipt['logs']:
             if log['address'] == zerox_proxy.address:
                 
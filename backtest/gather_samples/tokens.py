@@ -5,6 +5,7 @@ import typing
 import logging
 
 from backtest.utils import erc20
+import utils.memory
 
 l = logging.getLogger(__name__)
 
@@ -16,6 +17,8 @@ class Token(typing.NamedTuple):
 
 
 _token_cache: typing.Dict[str, Token] = {}
+utils.memory.register_cache('token_cache', lambda: _token_cache)
+
 def get_cached_token(address: str) -> typing.Optional[Token]:
     return _token_cache.get(address, None)
 
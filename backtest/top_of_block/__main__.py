@@ -23,6 +23,7 @@ import backtest.top_of_block.generate_sample
 import backtest.top_of_block.fill_top_arbitrages
 import backtest.top_of_block.fill_closure
 import backtest.top_of_block.profile_seek_candidates
+import backtest.top_of_block.archive_logs
 
 from utils import connect_web3, setup_logging
 
@@ -67,6 +68,9 @@ def main():
     cmd, handler = backtest.top_of_block.profile_seek_candidates.add_args(subparser)
     handlers[cmd] = handler
 
+    cmd, handler = backtest.top_of_block.archive_logs.add_args(subparser)
+    handlers[cmd] = handler
+
     args = parser.parse_args()
 
     if args.worker_name is None:
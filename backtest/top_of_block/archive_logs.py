@@ -0,0 +1,54 @@
+"""
+Extracts logs into the local log archive (see utils.log_archive), which
+the other scans read from instead of the node when it covers their range.
+"""
+import argparse
+import os
+import typing
+import web3
+import logging
+
+from backtest.utils import connect_db
+from utils import BALANCER_VAULT_ADDRESS
+from utils.log_archive import LogArchive, log_archive_dir
+
+l = logging.getLogger(__name__)
+
+
+def add_args(subparser: argparse._SubParsersAction) -> typing.Tuple[str, typing.Callable[[web3.Web3, argparse.Namespace], None]]:
+    parser_name = 'archive-logs'
+    parser: argparse.ArgumentParser = subparser.add_parser(parser_name)
+
+    parser.add_argument('--start-block', type=int, required=True)
+    parser.add_argument('--end-block', type=int, required=True, help='Inclusive; clamped to the latest finalized block')
+    parser.add_argument('--exchanges-only', action='store_true', help='When creating the archive, keep only logs from known exchanges')
+
+    return parser_name, archive_logs
+
+
+def archive_logs(w3: web3.Web3, args: argparse.Namespace):
+    assert args.start_block <= args.end_block
+
+    directory = log_archive_dir()
+    assert directory != '', 'log archive is disabled'
+    os.makedirs(directory, exist_ok=True)
+
+    addresses = None
+    if args.exchanges_only and not os.path.exists(os.path.join(directory, 'meta.json')):
+        db = connect_db()
+        curr = db.cursor()
+        addresses = load_exchange_addresses(curr)
+        l.info(f'Creating log archive for {len(addresses):,} exchanges')
+
+    archive = LogArchive(directory, addresses=addresses)
+    archive.extract(w3, args.start_block, args.end_block)
+
+    l.info('Done archiving logs')
+
+
+def load_exchange_addresses(curr) -> typing.Set[str]:
+    ret = set([BALANCER_VAULT_ADDRESS])
+    for table in ['uniswap_v2_exchanges', 'uniswap_v3_exchanges', 'sushiv2_swap_exchanges', 'shibaswap_exchanges', 'balancer_exchanges', 'balancer_v2_exchanges']:
+        curr.execute(f'SELECT address FROM {table}')
+        ret.update(web3.Web3.toChecksumAddress(a.tobytes()) for (a,) in curr)
+    return ret
@@ -52,5 +52,6 @@ assert os.path.isfile(univ3_fname)
 FNAME_EXCHANGES_WITH_BALANCES = '/mnt/goldphish/exchanges_prefilter.csv'
 
 # profit must be enough to pay for 130k gas @ 20 gwei (both overly optimistic)
-MIN_PROFIT_PREFILTER = (130_000) * (20 * (10 ** 9))
+MIN_PROFIT_PREFILTER_GAS = 130_000
+MIN_PROFIT_PREFILTER = (MIN_PROFIT_PREFILTER_GAS) * (20 * (10 ** 9))
 
@@ -16,7 +16,7 @@ import find_circuit
 from backtest.top_of_block.common import TraceMode, WrappedFoundArbitrage, load_exchanges, load_naughty_tokens, shoot
 from backtest.top_of_block.constants import UNISWAP_V2_SYNC_TOPIC, univ2
 
-from utils import WETH_ADDRESS, decode_trace_calls, get_abi, pretty_print_trace
+from utils import WETH_ADDRESS, decode_trace_calls, get_abi, get_bloom_index, pretty_print_trace
 
 l = logging.getLogger(__name__)
 
@@ -439,6 +439,20 @@ def diagnose_output_mismatch(
 
 def get_last_uniswap_v2_sync(w3: web3.Web3, address: str, on_or_before: int) -> web3.types.LogReceipt:
     # get the last Sync() event emitted from this address
+    bloom_index = get_bloom_index(w3)
+    if bloom_index is not None:
+        # only fetch logs for blocks whose bloom says they might have one
+        for block_number in bloom_index.iter_candidates_backward(on_or_before, [address], [UNISWAP_V2_SYNC_TOPIC], not_before=10_000_000):
+            logs = w3.eth.get_logs({
+                'address': address,
+                'topics': ['0x' + UNISWAP_V2_SYNC_TOPIC.hex()],
+                'fromBlock': block_number,
+                'toBlock': block_number,
+            })
+            if len(logs) > 0:
+                return logs[-1]
+        raise Exception(f'No Sync() found for {address}')
+
     batch_size_blocks = 200
     for i in itertools.count(0):
         start_block = on_or_before - (i + 1) * batch_size_blocks + 1
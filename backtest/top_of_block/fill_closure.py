@@ -17,7 +17,8 @@ from backtest.top_of_block.relay import InferredTokenTransferFeeCalculator, load
 from backtest.utils import connect_db
 from find_circuit.find import PricingCircuit, detect_arbitrages_bisection
 from pricers.base import BaseExchangePricer, NotEnoughLiquidityException
-from utils import BALANCER_VAULT_ADDRESS, get_block_timestamp
+from utils import BALANCER_VAULT_ADDRESS, get_block_timestamp, get_bloom_index
+from utils.log_archive import get_log_archive
 
 l = logging.getLogger(__name__)
 
@@ -190,11 +191,26 @@ def check_campaign_termination(w3: web3.Web3, curr: psycopg2.extensions.cursor,
     #
     # we need to find all transactions that had logs emitted in the terminal block
     #
-    f: web3._utils.filters.Filter = w3.eth.filter({
-        'fromBlock': terminal_block,
-        'toBlock': terminal_block,
-    })
-    logs = f.get_all_entries()
+    archive = get_log_archive()
+    bloom_index = get_bloom_index(w3)
+    relevant_addresses = set(exchanges + [BALANCER_VAULT_ADDRESS])
+    if archive is not None and archive.covers(terminal_block, terminal_block, relevant_addresses):
+        logs = archive.get_logs(terminal_block, terminal_block, relevant_addresses)
+    elif bloom_index is not None:
+        # skip the fetch entirely if the bloom rules the block out
+        logs = []
+        if len(bloom_index.candidate_blocks(terminal_block, terminal_block, relevant_addresses)) > 0:
+            logs = w3.eth.get_logs({
+                'address': sorted(relevant_addresses),
+                'fromBlock': terminal_block,
+                'toBlock': terminal_block,
+            })
+    else:
+        f: web3._utils.filters.Filter = w3.eth.filter({
+            'fromBlock': terminal_block,
+            'toBlock': terminal_block,
+        })
+        logs = f.get_all_entries()
     l.debug(f'Have {len(logs):,} logs in block {terminal_block:,}')
 
     # filter to relevant logs
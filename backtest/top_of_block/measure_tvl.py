@@ -28,6 +28,7 @@ from pricers.pricer_pool import PricerPool
 from pricers.uniswap_v2 import UniswapV2Pricer
 from pricers.uniswap_v3 import UniswapV3Pricer
 from utils import BALANCER_VAULT_ADDRESS, WETH_ADDRESS
+from utils.log_archive import get_log_archive
 
 l = logging.getLogger(__name__)
 
@@ -165,50 +166,7 @@ def process_work(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: i
         if batch_start_block > end_block:
             break
 
-        l.debug('start get logs')
-
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'address': list(pool._uniswap_v2_pools.keys()),
-            'topics': [['0x' + x.hex() for x in UniswapV2Pricer.RELEVANT_LOGS]],
-            'fromBlock': batch_start_block,
-            'toBlock': batch_end_block,
-        })
-
-        logs = f.get_all_entries()
-
-        l.debug('got uniswap v2 logs')
-
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'address': list(pool._uniswap_v3_pools.keys()),
-            'topics': [['0x' + x.hex() for x in UniswapV3Pricer.RELEVANT_LOGS]],
-            'fromBlock': batch_start_block,
-            'toBlock': batch_end_block,
-        })
-
-        logs.extend(f.get_all_entries())
-
-        l.debug('got uniswap v3 logs')
-
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'address': list(pool._balancer_v1_pools.keys()),
-            'topics': [['0x' + x.hex() for x in BalancerPricer.RELEVANT_LOGS]],
-            'fromBlock': batch_start_block,
-            'toBlock': batch_end_block,
-        })
-
-        logs.extend(f.get_all_entries())
-
-        l.debug('got balancer v1 logs')
-
-        f: web3._utils.filters.Filter = w3.eth.filter({
-            'address': list(pool._balancer_v2_pools.keys()) + [BALANCER_VAULT_ADDRESS],
-            'fromBlock': batch_start_block,
-            'toBlock': batch_end_block,
-        })
-
-        logs.extend(f.get_all_entries())
-
-        l.debug('got balancer v2 logs')
+        logs = get_logs(w3, pool, batch_start_block, batch_end_block)
 
         logs = sorted(logs, key=lambda x: (x['blockNumber'], x['logIndex']))
 
@@ -299,6 +257,84 @@ def process_work(w3: web3.Web3, curr: psycopg2.extensions.cursor, start_block: i
         maxs_updated.clear()
 
 
+def get_logs(w3: web3.Web3, pool: PricerPool, batch_start_block: int, batch_end_block: int) -> typing.List[web3.types.LogReceipt]:
+    """
+    Get the logs relevant to the pool's pricers in [batch_start_block, batch_end_block],
+    from the local log archive if it covers them, otherwise from the node.
+    """
+    uniswap_v2_topics = set(UniswapV2Pricer.RELEVANT_LOGS)
+    uniswap_v3_topics = set(UniswapV3Pricer.RELEVANT_LOGS)
+    balancer_v1_topics = set(BalancerPricer.RELEVANT_LOGS)
+
+    archive = get_log_archive()
+    addresses = pool.monitored_addresses()
+    if archive is not None and archive.covers(batch_start_block, batch_end_block, addresses):
+        logs = []
+        for log in archive.get_logs(batch_start_block, batch_end_block, addresses):
+            address = log['address']
+            topic = log['topics'][0] if len(log['topics']) > 0 else None
+            if address in pool._uniswap_v2_pools:
+                if topic in uniswap_v2_topics:
+                    logs.append(log)
+            elif address in pool._uniswap_v3_pools:
+                if topic in uniswap_v3_topics:
+                    logs.append(log)
+            elif address in pool._balancer_v1_pools:
+                if topic in balancer_v1_topics:
+                    logs.append(log)
+            elif address in pool._balancer_v2_pools or address == BALANCER_VAULT_ADDRESS:
+                logs.append(log)
+        l.debug('got logs from archive')
+        return logs
+
+    l.debug('start get logs')
+
+    f: web3._utils.filters.Filter = w3.eth.filter({
+        'address': list(pool._uniswap_v2_pools.keys()),
+        'topics': [['0x' + x.hex() for x in UniswapV2Pricer.RELEVANT_LOGS]],
+        'fromBlock': batch_start_block,
+        'toBlock': batch_end_block,
+    })
+
+    logs = f.get_all_entries()
+
+    l.debug('got uniswap v2 logs')
+
+    f: web3._utils.filters.Filter = w3.eth.filter({
+        'address': list(pool._uniswap_v3_pools.keys()),
+        'topics': [['0x' + x.hex() for x in UniswapV3Pricer.RELEVANT_LOGS]],
+        'fromBlock': batch_start_block,
+        'toBlock': batch_end_block,
+    })
+
+    logs.extend(f.get_all_entries())
+
+    l.debug('got uniswap v3 logs')
+
+    f: web3._utils.filters.Filter = w3.eth.filter({
+        'address': list(pool._balancer_v1_pools.keys()),
+        'topics': [['0x' + x.hex() for x in BalancerPricer.RELEVANT_LOGS]],
+        'fromBlock': batch_start_block,
+        'toBlock': batch_end_block,
+    })
+
+    logs.extend(f.get_all_entries())
+
+    l.debug('got balancer v1 logs')
+
+    f: web3._utils.filters.Filter = w3.eth.filter({
+        'address': list(pool._balancer_v2_pools.keys()) + [BALANCER_VAULT_ADDRESS],
+        'fromBlock': batch_start_block,
+        'toBlock': batch_end_block,
+    })
+
+    logs.extend(f.get_all_entries())
+
+    l.debug('got balancer v2 logs')
+
+    return logs
+
+
 def scan_start(curr: psycopg2.extensions.cursor) -> int:
     return 13_000_000
 
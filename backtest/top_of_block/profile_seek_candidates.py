@@ -26,7 +26,7 @@ import tempfile
 from backtest.top_of_block.common import load_pool
 from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER
 from backtest.utils import connect_db
-from find_circuit.find import find_upper_bound
+from find_circuit.find import find_upper_bound, orientations_to_search
 from find_circuit.find import DEFAULT_FEE_TRANSFER_CALCULATOR, FeeTransferCalculator, FoundArbitrage, PricingCircuit
 import pricers
 import find_circuit
@@ -363,154 +363,148 @@ def detect_arbitrages_linear(
 
     t_start = time.time()
 
-    # for each rotation
-    for _ in range(len(pc._circuit) if try_all_directions else 1):
+    # for each rotation and direction
+    for oriented in orientations_to_search(pc, only_weth_pivot, try_all_directions):
         def run_exc(i):
             amt_in = math.ceil(i)
-            price_ratio = pc.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+            price_ratio = oriented.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
             return price_ratio - 1
 
-        # try each direction
-        for _ in range(2 if try_all_directions else 1):
-
-            if not (only_weth_pivot and pc.pivot_token != WETH_ADDRESS):
-                # quickly try pushing 100 tokens -- if unprofitable, fail
+        # quickly try pushing 100 tokens -- if unprofitable, fail
 
+        try:
+            for quick_test_amount_in_zeros in range(5, 25): # start quick test at about 10^-10 dollars (July '22)
+                quick_test_amount_in = 10 ** quick_test_amount_in_zeros
                 try:
-                    for quick_test_amount_in_zeros in range(5, 25): # start quick test at about 10^-10 dollars (July '22)
-                        quick_test_amount_in = 10 ** quick_test_amount_in_zeros
-                        try:
-                            quick_test_pr = pc.sample_new_price_ratio(quick_test_amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                            break
-                        except TooLittleInput:
-                            # try the next largest amount
-                            continue
-                    else:
-                        # exhausted quick_test_amount_in options -- probably there's no way to pump enough liquidity
-                        # to this exchange just yet
-                        continue
-                except NotEnoughLiquidityException:
-                    # not profitable most likely
+                    quick_test_pr = oriented.sample_new_price_ratio(quick_test_amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                    break
+                except TooLittleInput:
+                    # try the next largest amount
                     continue
+            else:
+                # exhausted quick_test_amount_in options -- probably there's no way to pump enough liquidity
+                # to this exchange just yet
+                continue
+        except NotEnoughLiquidityException:
+            # not profitable most likely
+            continue
+
+        if quick_test_pr > 1:
+            # this may be profitable
+
+            # search for crossing-point where liquidity does not run out
+            lower_bound = quick_test_amount_in
+            upper_bound = (100_000 * (10 ** 18)) # a shit-ton of ether
 
-                if quick_test_pr > 1:
-                    # this may be profitable
-
-                    # search for crossing-point where liquidity does not run out
-                    lower_bound = quick_test_amount_in
-                    upper_bound = (100_000 * (10 ** 18)) # a shit-ton of ether
-
-                    upper_bound = find_upper_bound(pc, lower_bound, upper_bound, block_identifier, fee_transfer_calculator, timestamp=timestamp)
-
-                    out_lower_bound = pc.sample(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                    out_upper_bound = pc.sample(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-
-                    if out_upper_bound < 100:
-                        # haven't managed to get anything out with the most money we can pump through, abandon
-                        continue
-
-                    if out_lower_bound < 100:
-                        # search for crossing-point where (some) positive tokens come out of lower bound
-                        lower_bound_search_upper = upper_bound
-                        while lower_bound < lower_bound_search_upper - 1000:
-                            midpoint = (lower_bound + lower_bound_search_upper) // 2
-                            midpoint_out = pc.sample(midpoint, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                            if midpoint_out < 100:
-                                lower_bound = midpoint
-                                out_lower_bound = midpoint_out
-                            else:
-                                lower_bound_search_upper = midpoint
-                        lower_bound = lower_bound_search_upper
-
-                    assert lower_bound <= upper_bound, f'expect {lower_bound} <= {upper_bound}'
-
-                    # NOTE: it may be the case here that out_lower_bound - lower_bound < 0
-                    # i.e, the lower bound is not profitable. This can occur if there is significant
-                    # input required to get the first units of output produced -- those are essentially a flat
-                    # fee which pushes the pricing "parabola" downward
-
-                    mp_lower_bound = pc.sample_new_price_ratio(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                    mp_upper_bound = pc.sample_new_price_ratio(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-
-                    if mp_lower_bound < 1:
-                        amount_in = lower_bound
-                    elif mp_upper_bound > 1:
-                        amount_in = upper_bound
+            upper_bound = find_upper_bound(oriented, lower_bound, upper_bound, block_identifier, fee_transfer_calculator, timestamp=timestamp)
+
+            out_lower_bound = oriented.sample(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+            out_upper_bound = oriented.sample(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+
+            if out_upper_bound < 100:
+                # haven't managed to get anything out with the most money we can pump through, abandon
+                continue
+
+            if out_lower_bound < 100:
+                # search for crossing-point where (some) positive tokens come out of lower bound
+                lower_bound_search_upper = upper_bound
+                while lower_bound < lower_bound_search_upper - 1000:
+                    midpoint = (lower_bound + lower_bound_search_upper) // 2
+                    midpoint_out = oriented.sample(midpoint, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                    if midpoint_out < 100:
+                        lower_bound = midpoint
+                        out_lower_bound = midpoint_out
                     else:
-                        if mp_lower_bound <= mp_upper_bound:
-                            # about to fail, dump info
-                            for p, (t_in, t_out) in zip(pc.circuit, pc.directions):
-                                l.critical(type(p).__name__, p.address, t_in, t_out)
-                            with open('/mnt/goldphish/pts.txt', mode='w') as fout:
-                                for amt_in in np.linspace(lower_bound, upper_bound, 200):
-                                    amt_in = int(np.ceil(amt_in))
-                                    profit = pc.sample(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amt_in
-                                    price = pc.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, debug=True, fee_transfer_calculator=fee_transfer_calculator)
-                                    fout.write(f'{amt_in},{profit},{price}\n')
-                            l.critical(f'lower_bound {lower_bound}')
-                            l.critical(f'upper_bound {upper_bound}')
-                            l.critical(f'mp_lower_bound {mp_lower_bound}')
-                            l.critical(f'mp_upper_bound {mp_upper_bound}')
-                        assert mp_lower_bound > mp_upper_bound
-                        assert 1 < mp_lower_bound
-
-                        # gradually increase to see where profit starts falling
-
-                        last_profit = out_lower_bound
-                        amount_in = lower_bound
-                        while True:
-                            next_in = amount_in + SMIDGE
-                            if next_in > upper_bound:
-                                l.warning('Exceeded upper bound (unusual)!!!!!')
-                                break
-
-                            try:
-                                profit = pc.sample(next_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - next_in
-                            except ValueError:
-                                l.exception('what is this')
-                                break
-
-                            if profit < last_profit:
-                                break
-                            amount_in = next_in
-                            last_profit = profit
-
-                    expected_profit = pc.sample(amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amount_in
-
-                    # quickly reduce input amount (optimizes for rounding)
-                    input_reduction = 0
-                    first_token_in, first_token_out = pc.directions[0]
-                    first_out_normal, _ = pc.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in, block_identifier=block_identifier)
-
-                    for i in range(0, 21):
-                        attempting_reduction = 10 ** i
-                        if attempting_reduction >= amount_in:
-                            break
-
-                        try:
-                            out_reduced, _ = pc.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in - attempting_reduction, block_identifier=block_identifier)
-                        except NotEnoughLiquidityException:
-                            l.critical(f'Ran out of liquidity while sampling {amount_in - attempting_reduction} on {pc.circuit[0].address}')
-                            raise
-
-                        if first_out_normal == out_reduced:
-                            input_reduction = attempting_reduction
-                        else:
-                            break
-
-                    amount_in -= input_reduction
-                    expected_profit += input_reduction
-
-                    if expected_profit > 0:
-                        to_add = FoundArbitrage(
-                            amount_in   = amount_in,
-                            directions  = pc.directions,
-                            circuit     = pc.circuit,
-                            pivot_token = pc.pivot_token,
-                            profit      = expected_profit,
-                        )
-                        ret.append(to_add)
-            pc.flip()
-        pc.rotate()
+                        lower_bound_search_upper = midpoint
+                lower_bound = lower_bound_search_upper
+
+            assert lower_bound <= upper_bound, f'expect {lower_bound} <= {upper_bound}'
+
+            # NOTE: it may be the case here that out_lower_bound - lower_bound < 0
+            # i.e, the lower bound is not profitable. This can occur if there is significant
+            # input required to get the first units of output produced -- those are essentially a flat
+            # fee which pushes the pricing "parabola" downward
+
+            mp_lower_bound = oriented.sample_new_price_ratio(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+            mp_upper_bound = oriented.sample_new_price_ratio(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+
+            if mp_lower_bound < 1:
+                amount_in = lower_bound
+            elif mp_upper_bound > 1:
+                amount_in = upper_bound
+            else:
+                if mp_lower_bound <= mp_upper_bound:
+                    # about to fail, dump info
+                    for p, (t_in, t_out) in zip(oriented.circuit, oriented.directions):
+                        l.critical(type(p).__name__, p.address, t_in, t_out)
+                    with open('/mnt/goldphish/pts.txt', mode='w') as fout:
+                        for amt_in in np.linspace(lower_bound, upper_bound, 200):
+                            amt_in = int(np.ceil(amt_in))
+                            profit = oriented.sample(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amt_in
+                            price = oriented.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, debug=True, fee_transfer_calculator=fee_transfer_calculator)
+                            fout.write(f'{amt_in},{profit},{price}\n')
+                    l.critical(f'lower_bound {lower_bound}')
+                    l.critical(f'upper_bound {upper_bound}')
+                    l.critical(f'mp_lower_bound {mp_lower_bound}')
+                    l.critical(f'mp_upper_bound {mp_upper_bound}')
+                assert mp_lower_bound > mp_upper_bound
+                assert 1 < mp_lower_bound
+
+                # gradually increase to see where profit starts falling
+
+                last_profit = out_lower_bound
+                amount_in = lower_bound
+                while True:
+                    next_in = amount_in + SMIDGE
+                    if next_in > upper_bound:
+                        l.warning('Exceeded upper bound (unusual)!!!!!')
+                        break
+
+                    try:
+                        profit = oriented.sample(next_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - next_in
+                    except ValueError:
+                        l.exception('what is this')
+                        break
+
+                    if profit < last_profit:
+                        break
+                    amount_in = next_in
+                    last_profit = profit
+
+            expected_profit = oriented.sample(amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amount_in
+
+            # quickly reduce input amount (optimizes for rounding)
+            input_reduction = 0
+            first_token_in, first_token_out = oriented.directions[0]
+            first_out_normal, _ = oriented.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in, block_identifier=block_identifier)
+
+            for i in range(0, 21):
+                attempting_reduction = 10 ** i
+                if attempting_reduction >= amount_in:
+                    break
+
+                try:
+                    out_reduced, _ = oriented.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in - attempting_reduction, block_identifier=block_identifier)
+                except NotEnoughLiquidityException:
+                    l.critical(f'Ran out of liquidity while sampling {amount_in - attempting_reduction} on {oriented.circuit[0].address}')
+                    raise
+
+                if first_out_normal == out_reduced:
+                    input_reduction = attempting_reduction
+                else:
+                    break
+
+            amount_in -= input_reduction
+            expected_profit += input_reduction
+
+            if expected_profit > 0:
+                to_add = FoundArbitrage(
+                    amount_in   = amount_in,
+                    directions  = oriented.directions,
+                    circuit     = oriented.circuit,
+                    pivot_token = oriented.pivot_token,
+                    profit      = expected_profit,
+                )
+                ret.append(to_add)
 
     return ret
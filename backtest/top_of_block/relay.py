@@ -40,7 +40,7 @@ from pricers.uniswap_v3 import UniswapV3Pricer
 from shooter.composer import construct_arbitrage
 from shooter.encoder import serialize
 
-from utils import BALANCER_VAULT_ADDRESS, DAI_ADDRESS, TETHER_ADDRESS, USDC_ADDRESS, WBTC_ADDRESS, WETH_ADDRESS, connect_web3, decode_trace_calls, get_abi, get_block_timestamp, parse_ganache_call_trace, pretty_print_trace
+from utils import BALANCER_VAULT_ADDRESS, DAI_ADDRESS, TETHER_ADDRESS, USDC_ADDRESS, WBTC_ADDRESS, WETH_ADDRESS, connect_web3, decode_trace_calls, get_fork_url, get_abi, get_block_timestamp, parse_ganache_call_trace, pretty_print_trace
 from utils.profiling import inc_measurement, maybe_log, profile
 
 
@@ -202,7 +202,7 @@ def process_reservation(
     ):
     fee_calculator.sync(curr, block_number)
 
-    timestamp_to_use = w3.eth.get_block(block_number + 1)['timestamp']
+    timestamp_to_use = get_block_timestamp(w3, block_number + 1)
 
     candidates = get_candidates_in_block(curr, block_number)
 
@@ -833,7 +833,7 @@ def open_ganache(
     ganache_port = slice_start + port_slice
     _port[worker_id] = (port_slice + 1) % N_PORTS_PER_SLICE
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
+    web3_host = get_fork_url()
     p = subprocess.Popen(
         [
             'node',
@@ -1825,7 +1825,7 @@ def relay_top_arbs_in_range(
         # some setup
         l.debug(f'Processing block {block_number:,}')
         failed_relays: typing.List[typing.Tuple[int, str]] = []
-        timestamp_to_use = w3.eth.get_block(block_number + 1)['timestamp']
+        timestamp_to_use = get_block_timestamp(w3, block_number + 1)
 
         # construct the query
         # we need to decide whether to include new campaigns as we see existing ones to completion
@@ -32,7 +32,7 @@ from pricers.uniswap_v3 import UniswapV3Pricer
 from find_circuit import PricingCircuit
 from find_circuit.find import FoundArbitrage, detect_arbitrages_bisection
 from shooter.encoder import BalancerV1Swap, BalancerV2Swap, UniswapV2Swap, UniswapV3Swap, serialize
-from utils import BALANCER_VAULT_ADDRESS, WETH_ADDRESS, decode_trace_calls, get_abi, pretty_print_trace
+from utils import BALANCER_VAULT_ADDRESS, WETH_ADDRESS, decode_trace_calls, get_abi, get_fork_url, pretty_print_trace
 from eth_account import Account
 from eth_account.signers.local import LocalAccount
 
@@ -672,7 +672,7 @@ def open_ganache(block_number: int) -> typing.Tuple[subprocess.Popen, web3.Web3,
     ganache_port = 34451 + (my_pid % 500) + _port
     _port += 1
 
-    web3_host = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
+    web3_host = get_fork_url()
     p = subprocess.Popen(
         [
             'node',
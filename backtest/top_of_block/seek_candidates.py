@@ -1,10 +1,13 @@
 import argparse
 import collections
+import functools
 import signal
 import itertools
 import logging
 import os
+import queue
 import sys
+import threading
 import time
 import typing
 import backoff
@@ -17,13 +20,17 @@ import psycopg2.extensions
 import tempfile
 
 from backtest.top_of_block.common import load_pool
-from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER
+from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER, MIN_PROFIT_PREFILTER_GAS
 from backtest.utils import connect_db
 import pricers
 import find_circuit
 import find_circuit.monitor
 from pricers.pricer_pool import PricerPool
 from utils import get_block_timestamp
+from utils.log_archive import get_log_archive
+from utils.throttler import BlockThrottle
+import utils.memory
+import utils.metrics
 import utils.profiling
 
 
@@ -31,6 +38,9 @@ l = logging.getLogger(__name__)
 
 LOG_BATCH_SIZE = 100
 
+# circuits in the catalog take about 40 bytes each, so this is about 800MiB
+DEFAULT_MAX_CATALOG_CIRCUITS = 20_000_000
+
 DEBUG = False
 
 TMP_REMOVE_ME_FOR_FIXUP_ONLY = False
@@ -42,6 +52,11 @@ def add_args(subparser: argparse._SubParsersAction) -> typing.Tuple[str, typing.
 
     parser.add_argument('--setup-db', action='store_true', help='Setup the database (run before mass scan)')
     parser.add_argument('--fixup-queue', action='store_true', help='Fix the queue in the event that a worker had a spurious shutdown')
+    parser.add_argument('--gas-oracle-prefilter', action='store_true', help='Prefilter with the cheapest naive gas price estimate at each block rather than a fixed 20 gwei')
+    parser.add_argument('--time-budget', type=float, default=None, help='Per-block time budget (seconds) for arbitrage detection; the most promising circuits are searched first')
+    parser.add_argument('--max-circuit-length', type=int, default=3, help='Also search for circuits up to this length using negative-cycle detection (default: 3, ie disabled)')
+    parser.add_argument('--no-circuit-catalog', action='store_true', help='Enumerate circuits for each modified pair, and check liquidity thresholds by querying, rather than precomputing a catalog of circuits and a threshold index')
+    parser.add_argument('--max-catalog-circuits', type=int, default=DEFAULT_MAX_CATALOG_CIRCUITS, help=f'Fall back to enumerating circuits when the catalog would hold more than this many (default: {DEFAULT_MAX_CATALOG_CIRCUITS:,}, about 40 bytes each)')
 
     return parser_name, seek_candidates
 
@@ -74,6 +89,19 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
     if not os.path.isdir(storage_dir):
         os.mkdir(storage_dir)
 
+    if args.gas_oracle_prefilter:
+        # imported here to avoid a circular import
+        from backtest.top_of_block.fill_arb_duration import get_gas_oracle
+        curr.execute('SELECT MIN(block_number_start), MAX(block_number_end) FROM candidate_arbitrage_reservations')
+        min_block, max_block = curr.fetchone()
+        # only the cheapest estimate of each niche is used; keep it as arrays, to interpolate whole reservations at once
+        gas_oracle = {
+            niche: (np.array(block_numbers), np.array(pts[0]))
+            for niche, (block_numbers, pts) in get_gas_oracle(curr, min_block, max_block).items()
+        }
+    else:
+        gas_oracle = None
+
     cancel_requested = False
     def set_cancel_requested(_, __):
         nonlocal cancel_requested
@@ -82,7 +110,6 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
 
     signal.signal(signal.SIGHUP, set_cancel_requested)
 
-    batch_size_blocks = 100 # batch size for getting logs
     with tempfile.TemporaryDirectory(dir=storage_dir) as tmpdir:
         while not cancel_requested:
             l.debug(f'getting new reservation')
@@ -93,6 +120,8 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
 
             reservation_id, reservation_start, reservation_end = maybe_rez
 
+            min_gas_prices = None if gas_oracle is None else get_min_gas_prices(gas_oracle, reservation_start, reservation_end)
+
             # occasionaly database will disconnect while loading the pool
             # (dunno why) -- if that happens, just back off a bit, reconnect,
             # and try again
@@ -114,21 +143,54 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
 
             pricer = get_pricer_with_retry()
             pricer.warm(reservation_start)
+            if args.no_circuit_catalog:
+                circuit_catalog = None
+                threshold_index = None
+            else:
+                # both are rebuilt with each reservation's pool, and freed with it
+                circuit_catalog = find_circuit.CircuitCatalog(pricer)
+                if len(circuit_catalog) > args.max_catalog_circuits:
+                    l.warning(f'Circuit catalog has {len(circuit_catalog):,} circuits (more than {args.max_catalog_circuits:,}), enumerating circuits instead')
+                    pricer.remove_listener(circuit_catalog)
+                    circuit_catalog = None
+                threshold_index = find_circuit.monitor.ThresholdIndex(pricer)
+
+            if args.max_circuit_length > 3:
+                # 2- and 3-length circuits are already proposed exhaustively
+                cycle_graph = find_circuit.LogPriceGraph(
+                    pricer,
+                    max_cycle_length = args.max_circuit_length,
+                    min_cycle_length = 4,
+                    edge_filter = find_circuit.monitor.meets_thresholds if threshold_index is None else threshold_index.meets_thresholds,
+                )
+            else:
+                cycle_graph = None
 
-            curr_block = reservation_start
-            while curr_block <= reservation_end:
-                this_end_block = min(curr_block + batch_size_blocks - 1, reservation_end)
-                for block_number, logs in get_relevant_logs(w3, pricer, curr_block, this_end_block):
+            # logs for the next batch are fetched while this one is processed
+            log_prefetcher = LogPrefetcher(w3, pricer, reservation_start, reservation_end)
+            last_block = None
+            try:
+                for block_number, logs in log_prefetcher:
 
                     if cancel_requested:
                         l.debug('shutting down main loop')
                         break
 
+                    utils.profiling.set_context(block_number=block_number)
+                    utils.profiling.inc_count('seek_candidates.blocks')
                     update = pricer.observe_block(block_number, logs)
                     utils.profiling.maybe_log()
+                    utils.memory.maybe_report()
                     while True:
                         try:
-                            process_candidates(w3, pricer, block_number, update, curr)
+                            process_candidates(
+                                w3, pricer, block_number, update, curr,
+                                min_profit=get_min_profit(block_number, min_gas_prices),
+                                time_budget_seconds=args.time_budget,
+                                cycle_graph=cycle_graph,
+                                circuit_catalog=circuit_catalog,
+                                threshold_index=threshold_index,
+                            )
                             if not DEBUG:
                                 with utils.profiling.profile('db.update'):
                                     curr.execute(
@@ -145,16 +207,14 @@ def seek_candidates(w3: web3.Web3, args: argparse.Namespace):
                                 time.sleep(30)
                             else:
                                 raise e
-
-                if cancel_requested:
-                    break
-
-                curr_block = this_end_block + 1
+                    last_block = block_number
+            finally:
+                log_prefetcher.stop()
 
             # mark reservation as completed
             if not DEBUG:
                 if not cancel_requested:
-                    assert this_end_block == reservation_end
+                    assert last_block == reservation_end
                     l.debug(f'Completed reservation id={reservation_id:,}')
                     curr.execute(
                         'UPDATE candidate_arbitrage_reservations SET completed_on = NOW()::timestamp WHERE id = %s',
@@ -598,18 +658,28 @@ def get_reservation(curr: psycopg2.extensions.cursor, worker_name: str) -> typin
     return id_, start, end
 
 
-def get_relevant_logs(
+def _fetch_relevant_logs(
         w3: web3.Web3,
         pool: PricerPool,
         batch_start_block: int,
         batch_end_block: int
-    ) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
+    ) -> typing.Dict[int, typing.List[web3.types.LogReceipt]]:
     """
-    Get logs relevant to the given pricer pool's pricers.
+    Get logs relevant to the given pricer pool's pricers, by block number.
     """
-
     assert batch_start_block <= batch_end_block
 
+    important_addresses = pool.monitored_addresses()
+
+    archive = get_log_archive()
+    if archive is not None and archive.covers(batch_start_block, batch_end_block, important_addresses):
+        with utils.profiling.profile('get_logs.archive'):
+            gather = collections.defaultdict(lambda: [])
+            for block_number, logs in archive.iter_blocks(batch_start_block, batch_end_block, important_addresses):
+                if len(logs) > 0:
+                    gather[block_number] = logs
+            return gather
+
     l.debug(f'start get logs from {batch_start_block:,} to {batch_end_block:,}')
 
     with utils.profiling.profile('get_logs'):
@@ -617,47 +687,216 @@ def get_relevant_logs(
         # NOTE: turns out geth's log filtering is slower than
         # just returning all logs and filtering in python; this
         # is why we use the latter strategy
-        f: web3._utils.filters.Filter = w3.eth.filter({
+        #
+        # (eth_getLogs rather than an installed filter, which would be
+        # stateful, so could not be spread across nodes or cached)
+        logs = w3.eth.get_logs({
             'fromBlock': batch_start_block,
             'toBlock': batch_end_block,
         })
 
-        logs = f.get_all_entries()
-
         l.debug(f'got {len(logs):,} logs this batch')
 
-    important_addresses = pool.monitored_addresses()
-    logs = list(x for x in logs if x['address'] in important_addresses)
-
     gather = collections.defaultdict(lambda: [])
     for log in logs:
-        gather[log['blockNumber']].append(log)
+        if log['address'] in important_addresses:
+            gather[log['blockNumber']].append(log)
+    return gather
+
+
+def get_relevant_logs(
+        w3: web3.Web3,
+        pool: PricerPool,
+        batch_start_block: int,
+        batch_end_block: int
+    ) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
+    """
+    Get logs relevant to the given pricer pool's pricers.
+    """
+    gather = _fetch_relevant_logs(w3, pool, batch_start_block, batch_end_block)
 
     for i in range(batch_start_block, batch_end_block + 1):
         yield (i, gather[i])
 
 
-def process_candidates(
+class LogPrefetcher:
+    """
+    Streams the relevant logs of each block in [start_block, end_block] (as get_relevant_logs),
+    fetching in a background thread up to `max_batches_ahead` batches ahead of the consumer.
+
+    Batch size adapts (by AIMD) so that each fetch takes about `target_seconds`.
+    """
+
+    def __init__(
+            self,
+            w3: web3.Web3,
+            pool: PricerPool,
+            start_block: int,
+            end_block: int,
+            target_seconds: float = 5,
+            max_batches_ahead: int = 2,
+        ) -> None:
+        assert start_block <= end_block
+        self._w3 = w3
+        self._pool = pool
+        self.start_block = start_block
+        self.end_block = end_block
+        self._throttle = BlockThrottle(
+            setpoint = target_seconds,
+            initial = LOG_BATCH_SIZE,
+            additive_increase = 10,
+        )
+        self._queue = queue.Queue(maxsize=max_batches_ahead)
+        utils.metrics.register_gauge('log_prefetch_queue_depth', self._queue.qsize)
+        self._stop_requested = False
+        self._thread = threading.Thread(target=self._fetch_forever, name='log-prefetcher', daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
+        while True:
+            with utils.profiling.profile('get_logs.wait'):
+                item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                return
+            batch_start_block, batch_end_block, gather = item
+            for i in range(batch_start_block, batch_end_block + 1):
+                yield (i, gather[i])
+
+    def stop(self):
+        self._stop_requested = True
+        # unblock the fetcher if it is waiting on a full queue
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _fetch_forever(self):
+        try:
+            batch_start_block = self.start_block
+            while batch_start_block <= self.end_block and not self._stop_requested:
+                n_blocks = self._throttle.val_int_clamp(1, 10_000)
+                batch_end_block = min(batch_start_block + n_blocks - 1, self.end_block)
+
+                t_start = time.time()
+                gather = _fetch_relevant_logs(self._w3, self._pool, batch_start_block, batch_end_block)
+                self._throttle.observe(time.time() - t_start)
+
+                self._queue.put((batch_start_block, batch_end_block, gather))
+                batch_start_block = batch_end_block + 1
+            self._queue.put(None)
+        except Exception as e:
+            l.exception('Error prefetching logs')
+            self._queue.put(e)
+
+
+class MinGasPrices(typing.NamedTuple):
+    """
+    The cheapest estimated gas price across all niches, for each block from start_block on
+    """
+    start_block: int
+    prices: np.ndarray
+
+
+def get_min_gas_prices(gas_oracle: typing.Dict[str, typing.Tuple[np.ndarray, np.ndarray]], start_block: int, end_block: int) -> MinGasPrices:
+    """
+    Interpolate each niche's minimum gas price (block numbers and prices, from fill_arb_duration.get_gas_oracle)
+    over the blocks from start_block to end_block (inclusive), and take the cheapest at each block
+    """
+    block_numbers = np.arange(start_block, end_block + 1)
+    prices = None
+    for niche_blocks, niche_prices in gas_oracle.values():
+        interpolated = np.interp(block_numbers, niche_blocks, niche_prices)
+        prices = interpolated if prices is None else np.minimum(prices, interpolated)
+    return MinGasPrices(start_block, prices.astype(np.int64))
+
+
+def get_min_profit(block_number: int, min_gas_prices: typing.Optional[MinGasPrices]) -> int:
+    """
+    Minimum profit (wei) for a candidate to be kept; when the gas prices (see get_min_gas_prices)
+    are given, uses the cheapest estimated gas price across all niches at this block.
+    """
+    if min_gas_prices is None:
+        return MIN_PROFIT_PREFILTER
+
+    gas_price = int(min_gas_prices.prices[block_number - min_gas_prices.start_block])
+    return MIN_PROFIT_PREFILTER_GAS * gas_price
+
+
+def find_candidates(
         w3: web3.Web3,
         pool: pricers.PricerPool,
         block_number: int,
         updated_exchanges: typing.Dict[typing.Tuple[str, str], typing.List[str]],
-        curr: psycopg2.extensions.cursor
-    ):
+        min_profit: int = MIN_PROFIT_PREFILTER,
+        time_budget_seconds: typing.Optional[float] = None,
+        cycle_graph: typing.Optional[find_circuit.LogPriceGraph] = None,
+        circuit_catalog: typing.Optional[find_circuit.CircuitCatalog] = None,
+        threshold_index: typing.Optional['find_circuit.monitor.ThresholdIndex'] = None,
+    ) -> typing.Iterator[find_circuit.FoundArbitrage]:
+    """
+    Yields the arbitrages (which make at least min_profit) found among the exchanges updated in this block.
+    """
     l.debug(f'{len(updated_exchanges)} exchanges updated in block {block_number:,}')
 
     next_block_ts = get_block_timestamp(w3, block_number + 1)
 
     n_ignored = 0
-    n_found = 0
-    max_profit_no_fee = -1
-    for p in find_circuit.profitable_circuits(updated_exchanges, pool, block_number, timestamp=next_block_ts, only_weth_pivot=True):
-        if p.profit < MIN_PROFIT_PREFILTER:
+    # anything that cannot possibly reach min_profit is not worth optimizing
+    detection_func = functools.partial(find_circuit.find.detect_arbitrages_bisection, min_profit=min_profit)
+
+    for p in find_circuit.profitable_circuits(
+                updated_exchanges,
+                pool,
+                block_number,
+                timestamp=next_block_ts,
+                only_weth_pivot=True,
+                detection_func=detection_func,
+                cycle_graph=cycle_graph,
+                circuit_catalog=circuit_catalog,
+                threshold_index=threshold_index,
+                time_budget_seconds=time_budget_seconds,
+            ):
+        if p.profit < min_profit:
             n_ignored += 1
             continue
+        yield p
+
+    if n_ignored > 0:
+        l.debug(f'Ignored {n_ignored} arbitrages due to not meeting profit threshold in block {block_number:,}')
 
+
+def process_candidates(
+        w3: web3.Web3,
+        pool: pricers.PricerPool,
+        block_number: int,
+        updated_exchanges: typing.Dict[typing.Tuple[str, str], typing.List[str]],
+        curr: psycopg2.extensions.cursor,
+        min_profit: int = MIN_PROFIT_PREFILTER,
+        time_budget_seconds: typing.Optional[float] = None,
+        cycle_graph: typing.Optional[find_circuit.LogPriceGraph] = None,
+        circuit_catalog: typing.Optional[find_circuit.CircuitCatalog] = None,
+        threshold_index: typing.Optional['find_circuit.monitor.ThresholdIndex'] = None,
+    ):
+    n_found = 0
+    max_profit_no_fee = -1
+
+    for p in find_candidates(
+                w3,
+                pool,
+                block_number,
+                updated_exchanges,
+                min_profit=min_profit,
+                time_budget_seconds=time_budget_seconds,
+                cycle_graph=cycle_graph,
+                circuit_catalog=circuit_catalog,
+                threshold_index=threshold_index,
+            ):
         if False:
             # this is for debugging
+            next_block_ts = get_block_timestamp(w3, block_number + 1)
             exchange_outs = {}
             amount = p.amount_in
             for exc, (token_in, token_out) in zip(p.circuit, p.directions):
@@ -728,8 +967,6 @@ def process_candidates(
         
         max_profit_no_fee = max(max_profit_no_fee, p.profit)
 
-    if n_ignored > 0:
-        l.debug(f'Ignored {n_ignored} arbitrages due to not meeting profit threshold in block {block_number:,}')
     if n_found > 0:
         l.info(f'Found {n_found} candidate arbitrages in block {block_number:,}')
 
@@ -15,7 +15,7 @@ from eth_account.signers.local import LocalAccount
 
 l = logging.getLogger(__name__)
 
-from utils import erc20
+from utils import erc20, get_fork_url
 
 ERC20_TRANSFER_TOPIC = event_abi_to_log_topic(erc20.events.Transfer().abi)
 ERC20_TRANSFER_TOPIC_HEX = '0x' + ERC20_TRANSFER_TOPIC.hex()
@@ -106,7 +106,7 @@ class GanacheContextManager:
         if unlock is not None:
             extra_args = ['--wallet.unlockedAccounts', ','.join(unlock)]
 
-        fork_url = os.getenv('WEB3_HOST', 'ws://172.17.0.1:8546')
+        fork_url = get_fork_url()
 
         self.p = subprocess.Popen(
             [
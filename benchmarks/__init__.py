@@ -0,0 +1,16 @@
+"""
+Offline benchmarks.
+
+Fixtures are recordings of the JSON-RPC traffic of a fixed workload (see
+utils/rpc_recording.py), made once against an archive node; benchmarks replay them
+in-process with ReplayProvider, so they need neither a node nor a database.
+
+    python3 -m benchmarks.record_fixtures --block-number 13600000    # once, needs a node and the db
+    python3 -m benchmarks.bench_pricers --compare benchmarks/results/baseline.json
+
+    python3 -m benchmarks.bench_seek_candidates record --start-block 13600000 --end-block 13600099    # once
+    python3 -m benchmarks.bench_seek_candidates run
+
+    python3 -m benchmarks.bench_detectors record --start-block 13600000 --end-block 13610000    # once
+    python3 -m benchmarks.bench_detectors run --detectors bisection linear
+"""
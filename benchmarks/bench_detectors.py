@@ -0,0 +1,424 @@
+"""
+benchmarks/bench_detectors.py
+
+Quality-vs-cost harness for arbitrage detection strategies (the detection_func of
+find_circuit.profitable_circuits). Every detector is run over a corpus of stored
+circuits, whose pool states are served from a recording, and is scored on calls to
+sample (and sample_new_price_ratio), pricer queries, wall time, profit found
+relative to a brute-force optimum, and failures; one table per circuit type.
+
+    # once, needs a node (WEB3_HOST) and the database; circuits come from candidate_arbitrages
+    python3 -m benchmarks.bench_detectors record --start-block 13600000 --end-block 13610000
+    # any time after, offline; the first detector is the reference the others are judged against
+    python3 -m benchmarks.bench_detectors run --detectors bisection linear
+
+A detector is adopted only if, for every circuit type, it is faster than the reference
+and no worse: it finds at least as much of the optimum, with no more misses or errors.
+"""
+import argparse
+import datetime
+import glob
+import importlib
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import typing
+import logging
+
+import numpy as np
+import tabulate
+import web3
+
+import find_circuit.find
+from find_circuit.find import FoundArbitrage, PricingCircuit
+from pricers.base import BaseExchangePricer
+from utils import RetryingProvider, WETH_ADDRESS, get_block_timestamp
+from utils.rpc_recording import ReplayProvider, RPCRecorder
+from .bench_pricers import DEFAULT_RESULT_DIR, git_commit
+from .fixtures import DEFAULT_FIXTURE_DIR, make_pricer, pricer_spec
+
+l = logging.getLogger(__name__)
+
+DETECTORS = {
+    'bisection': 'find_circuit.find:detect_arbitrages_bisection',
+    'linear': 'backtest.top_of_block.profile_seek_candidates:detect_arbitrages_linear',
+}
+
+KINDS = ('uniswap_v2', 'mixed_v3', 'balancer')
+
+# the brute-force search evaluates profit on a geometric grid of this many amounts
+# (in wei of WETH) and then refines around the best one
+BRUTE_FORCE_GRID = 1_000
+BRUTE_FORCE_MIN_IN = 10 ** 3
+BRUTE_FORCE_MAX_IN = 100_000 * (10 ** 18)
+
+# a detector misses a circuit when it finds less than this fraction of the optimum
+MISS_FRACTION = 0.999
+
+
+class Case(typing.NamedTuple):
+    kind: str
+    block_number: int
+    timestamp: int
+    legs: typing.List[typing.Tuple[str, typing.Dict[str, typing.Any]]]
+    directions: typing.List[typing.Tuple[str, str]]
+    optimum: int
+
+
+class CountingCircuit(PricingCircuit):
+    """
+    PricingCircuit that counts calls to sample and sample_new_price_ratio, including
+    calls on its orientations
+    """
+    n_samples: int
+    _root: 'CountingCircuit'
+
+    def __init__(self, _circuit: typing.Sequence[BaseExchangePricer], _directions: typing.Sequence[typing.Tuple[str, str]]) -> None:
+        super().__init__(_circuit, _directions)
+        self.n_samples = 0
+        self._root = self
+
+    def _oriented(self, circuit, directions) -> 'CountingCircuit':
+        ret = CountingCircuit(circuit, directions)
+        ret._root = self._root
+        return ret
+
+    def sample(self, *args, **kwargs) -> int:
+        self._root.n_samples += 1
+        return super().sample(*args, **kwargs)
+
+    def sample_new_price_ratio(self, *args, **kwargs) -> float:
+        self._root.n_samples += 1
+        return super().sample_new_price_ratio(*args, **kwargs)
+
+
+def load_detector(name: str) -> typing.Callable[..., typing.List[FoundArbitrage]]:
+    """
+    Load a detector by name (see DETECTORS) or as module.path:function
+    """
+    module_name, func_name = DETECTORS.get(name, name).split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def circuit_kind(circuit: typing.List[BaseExchangePricer]) -> str:
+    names = [type(p).__name__ for p in circuit]
+    if any(n.startswith('Balancer') for n in names):
+        return 'balancer'
+    if 'UniswapV3Pricer' in names:
+        return 'mixed_v3'
+    return 'uniswap_v2'
+
+
+def make_circuit(w3: web3.Web3, case: Case) -> CountingCircuit:
+    """
+    A circuit of fresh pricers (with no cached state)
+    """
+    return CountingCircuit(
+        [make_pricer(w3, pricer, args) for pricer, args in case.legs],
+        list(case.directions),
+    )
+
+
+def _profit(pc: PricingCircuit, amount_in: int, case: Case) -> float:
+    try:
+        return pc.sample(amount_in, case.block_number, timestamp=case.timestamp) - amount_in
+    except Exception:
+        # ran out of liquidity, too little input, etc
+        return -math.inf
+
+
+def brute_force_optimum(pc: PricingCircuit, case: Case) -> int:
+    """
+    Best profit over every WETH-pivoted orientation of the circuit, found by evaluating a
+    dense geometric grid of amounts and then ternary-searching around the best of them
+    """
+    best = 0
+    grid = sorted(set(int(x) for x in np.geomspace(float(BRUTE_FORCE_MIN_IN), float(BRUTE_FORCE_MAX_IN), BRUTE_FORCE_GRID)))
+    for oriented in pc.orientations(WETH_ADDRESS):
+        profits = [_profit(oriented, x, case) for x in grid]
+        i = int(np.argmax(profits))
+        lo = grid[max(0, i - 1)]
+        hi = grid[min(len(grid) - 1, i + 1)]
+        while hi - lo > 2:
+            m1 = lo + (hi - lo) // 3
+            m2 = hi - (hi - lo) // 3
+            if _profit(oriented, m1, case) < _profit(oriented, m2, case):
+                lo = m1
+            else:
+                hi = m2
+        best = max([best, profits[i]] + [_profit(oriented, x, case) for x in range(lo, hi + 1)])
+    return int(best)
+
+
+def run_detector(
+        detector: typing.Callable[..., typing.List[FoundArbitrage]],
+        w3: web3.Web3,
+        case: Case,
+    ) -> typing.Dict[str, typing.Any]:
+    """
+    Run the detector on a circuit once to load pool state, then measure a second run
+    on the same pricers
+    """
+    circuit = make_circuit(w3, case)
+    try:
+        detector(circuit, case.block_number, timestamp=case.timestamp, only_weth_pivot=True)
+    except Exception:
+        pass
+
+    pc = CountingCircuit(circuit.circuit, circuit.directions)
+    n_queries_before = find_circuit.find.count_model_queries
+    t_start = time.perf_counter()
+    try:
+        found = detector(pc, case.block_number, timestamp=case.timestamp, only_weth_pivot=True)
+        error = None
+    except Exception as e:
+        found = []
+        error = type(e).__name__
+    elapsed = time.perf_counter() - t_start
+
+    return {
+        'n_samples': pc.n_samples,
+        'n_model_queries': find_circuit.find.count_model_queries - n_queries_before,
+        'seconds': elapsed,
+        'profit': max([0] + [fa.profit for fa in found if fa.pivot_token == WETH_ADDRESS]),
+        'error': error,
+    }
+
+
+def summarize(cases: typing.List[Case], runs: typing.List[typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.Any]:
+    """
+    Aggregate one detector's runs over the cases of one kind
+    """
+    total_optimum = sum(c.optimum for c in cases)
+    ratios = [r['profit'] / c.optimum for c, r in zip(cases, runs) if c.optimum > 0]
+    return {
+        'n_circuits': len(cases),
+        'n_samples': sum(r['n_samples'] for r in runs),
+        'n_model_queries': sum(r['n_model_queries'] for r in runs),
+        'seconds': sum(r['seconds'] for r in runs),
+        'profit': sum(r['profit'] for r in runs),
+        'optimum': total_optimum,
+        'profit_ratio': sum(r['profit'] for r in runs) / total_optimum if total_optimum > 0 else 1.0,
+        'worst_ratio': min(ratios, default=1.0),
+        'n_misses': sum(1 for c, r in zip(cases, runs) if r['profit'] < MISS_FRACTION * c.optimum),
+        'n_errors': sum(1 for r in runs if r['error'] is not None),
+    }
+
+
+def no_worse(s: typing.Dict[str, typing.Any], reference: typing.Dict[str, typing.Any]) -> bool:
+    return s['profit'] >= reference['profit'] and s['n_misses'] <= reference['n_misses'] and s['n_errors'] <= reference['n_errors']
+
+
+def load_corpus(path: str) -> typing.Tuple[str, typing.List[Case]]:
+    with open(path) as fin:
+        d = json.load(fin)
+    cases = []
+    for c in d['cases']:
+        c['legs'] = [tuple(x) for x in c['legs']]
+        c['directions'] = [tuple(x) for x in c['directions']]
+        cases.append(Case(**c))
+    return d['name'], cases
+
+
+def record(args: argparse.Namespace):
+    # imported here so that running the benchmark does not need the database
+    import psycopg2.extensions
+    from backtest.top_of_block.common import load_pool
+    from backtest.utils import connect_db
+
+    name = args.name or f'detectors_{args.start_block}_{args.end_block}'
+    os.makedirs(args.fixture_dir, exist_ok=True)
+    prefix = os.path.join(args.fixture_dir, name)
+    if os.path.exists(prefix + '.rpc.jsonl.gz'):
+        # recordings are appended to
+        os.unlink(prefix + '.rpc.jsonl.gz')
+
+    recorder = RPCRecorder(prefix + '.rpc.jsonl.gz')
+    w3 = web3.Web3(RetryingProvider(recorder=recorder))
+
+    db = connect_db()
+    curr: psycopg2.extensions.cursor = db.cursor()
+    curr.execute(
+        '''
+        SELECT block_number, exchanges, directions
+        FROM candidate_arbitrages
+        WHERE %s <= block_number AND block_number <= %s
+        ORDER BY block_number, id
+        ''',
+        (args.start_block, args.end_block),
+    )
+    rows = curr.fetchall()
+
+    cases: typing.List[Case] = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = load_pool(w3, curr, tmpdir)
+        db.close()
+
+        n_by_kind = {k: 0 for k in KINDS}
+        for block_number, exchanges, directions in rows:
+            circuit = [pool.get_pricer_for(w3.toChecksumAddress(x.tobytes())) for x in exchanges]
+            if None in circuit:
+                # exchange no longer in the pool
+                continue
+            kind = circuit_kind(circuit)
+            if n_by_kind[kind] >= args.per_kind:
+                continue
+            n_by_kind[kind] += 1
+
+            tokens_in = [w3.toChecksumAddress(x.tobytes()) for x in directions]
+            case = Case(
+                kind = kind,
+                block_number = block_number,
+                timestamp = get_block_timestamp(w3, block_number + 1),
+                legs = [pricer_spec(p) for p in circuit],
+                directions = [(t, tokens_in[(i + 1) % len(tokens_in)]) for i, t in enumerate(tokens_in)],
+                optimum = 0,
+            )
+            case = case._replace(optimum = brute_force_optimum(make_circuit(w3, case), case))
+            cases.append(case)
+            if all(n >= args.per_kind for n in n_by_kind.values()):
+                break
+
+    l.info(f'Picked {len(cases)} circuits: ' + ', '.join(f'{n} {k}' for k, n in n_by_kind.items()))
+    save_corpus(prefix, name, cases, w3, recorder)
+
+
+def save_corpus(prefix: str, name: str, cases: typing.List[Case], w3: web3.Web3, recorder: RPCRecorder):
+    """
+    Run every detector on the cases, recording their requests through w3 (whose provider
+    records to recorder), check that the recording replays, and save the corpus
+    """
+    # run every detector as the benchmark does, so that their requests are recorded too
+    def run(w3: web3.Web3) -> typing.List[typing.Any]:
+        ret = []
+        for case in cases:
+            ret.append(brute_force_optimum(make_circuit(w3, case), case))
+            for detector in DETECTORS:
+                r = run_detector(load_detector(detector), w3, case)
+                ret.append((r['profit'], r['n_samples'], r['error']))
+        return ret
+
+    live = run(w3)
+    recorder.close()
+
+    replay = ReplayProvider([prefix + '.rpc.jsonl.gz'])
+    replayed = run(web3.Web3(replay))
+    if replay.responses.n_not_recorded > 0 or replayed != live:
+        raise Exception(f'Recording of {name} does not replay ({replay.responses.n_not_recorded} requests missing)')
+
+    with open(prefix + '.detectors.json', mode='w') as fout:
+        json.dump({
+            'name': name,
+            'recorded_at': datetime.datetime.utcnow().isoformat(),
+            'cases': [c._asdict() for c in cases],
+        }, fout, indent=2)
+    l.info(f'Recorded {name}')
+
+
+def run(args: argparse.Namespace):
+    corpora = [load_corpus(p) for p in sorted(glob.glob(os.path.join(args.fixture_dir, '*.detectors.json')))]
+    if args.only is not None:
+        corpora = [(name, cases) for name, cases in corpora if name in args.only]
+    if len(corpora) == 0:
+        l.error(f'No corpora in {args.fixture_dir}; record one with python3 -m benchmarks.bench_detectors record')
+        sys.exit(1)
+
+    detectors = {name: load_detector(name) for name in args.detectors}
+    results = {
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'detectors': {name: DETECTORS.get(name, name) for name in args.detectors},
+        'corpora': {},
+    }
+
+    for corpus_name, cases in corpora:
+        l.info(f'Running {len(cases)} circuits of {corpus_name}')
+        w3 = web3.Web3(ReplayProvider([os.path.join(args.fixture_dir, corpus_name + '.rpc.jsonl.gz')]))
+
+        runs = {name: [run_detector(detector, w3, case) for case in cases] for name, detector in detectors.items()}
+
+        summaries = {}
+        for kind in KINDS:
+            idxs = [i for i, c in enumerate(cases) if c.kind == kind]
+            if len(idxs) == 0:
+                continue
+            summaries[kind] = {
+                name: summarize([cases[i] for i in idxs], [detector_runs[i] for i in idxs])
+                for name, detector_runs in runs.items()
+            }
+        results['corpora'][corpus_name] = {'summaries': summaries, 'runs': runs}
+
+        for kind, by_detector in summaries.items():
+            tab = []
+            for name, s in by_detector.items():
+                tab.append((
+                    name,
+                    f'{s["n_samples"] / s["n_circuits"]:,.1f}',
+                    f'{s["n_model_queries"] / s["n_circuits"]:,.1f}',
+                    f'{s["seconds"] / s["n_circuits"] * 1000:,.2f}',
+                    f'{s["profit_ratio"]:.4f}',
+                    f'{s["worst_ratio"]:.4f}',
+                    f'{s["n_misses"]:,}',
+                    f'{s["n_errors"]:,}',
+                ))
+            print(tabulate.tabulate(
+                tab,
+                headers=[f'{kind} ({s["n_circuits"]:,})', 'Samples', 'Queries', 'ms', 'Profit/opt', 'Worst', 'Misses', 'Errors'],
+                disable_numparse=True,
+            ))
+            print()
+
+    # verdict against the reference (first) detector, over every corpus and kind
+    reference = args.detectors[0]
+    for name in args.detectors[1:]:
+        faster = True
+        better = True
+        for corpus in results['corpora'].values():
+            for by_detector in corpus['summaries'].values():
+                faster = faster and by_detector[name]['seconds'] < by_detector[reference]['seconds']
+                better = better and no_worse(by_detector[name], by_detector[reference])
+        verdict = 'adopt' if faster and better else 'reject'
+        l.info(f'{name} vs {reference}: {"faster" if faster else "not faster"}, {"no worse" if better else "worse"} -- {verdict}')
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULT_DIR, f'detectors_{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")}.json')
+    with open(output, mode='w') as fout:
+        json.dump(results, fout, indent=2)
+    l.info(f'Wrote results to {output}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare arbitrage detection strategies on recorded circuits, offline')
+    parser.add_argument('--fixture-dir', type=str, default=DEFAULT_FIXTURE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_record = subparsers.add_parser('record', help='Record a corpus of circuits (needs a node and the database)')
+    parser_record.add_argument('--start-block', type=int, required=True)
+    parser_record.add_argument('--end-block', type=int, required=True)
+    parser_record.add_argument('--per-kind', type=int, default=100, help='Take at most this many circuits of each type')
+    parser_record.add_argument('--name', type=str, default=None, help='Corpus name (default: detectors_<start>_<end>)')
+
+    parser_run = subparsers.add_parser('run', help='Run detectors over recorded corpora')
+    parser_run.add_argument('--detectors', type=str, nargs='+', default=list(DETECTORS), help='Detector names or module.path:function; the first is the reference')
+    parser_run.add_argument('--only', type=str, nargs='*', default=None, help='Only run corpora with these names')
+    parser_run.add_argument('--output', type=str, default=None, help='Where to write results (default: benchmarks/results/detectors_<time>.json)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    if args.command == 'record':
+        record(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+benchmarks/bench_pricers.py
+
+Pricer micro-benchmarks over recorded fixtures (see benchmarks/record_fixtures.py):
+exact-in quote throughput, exact-out quote throughput and observe_block throughput,
+with a checksum of the outputs so that speedups can be checked to not change results.
+
+    python3 -m benchmarks.bench_pricers [--fixture-dir DIR] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import typing
+import logging
+
+import tabulate
+import web3
+
+from utils.rpc_recording import ReplayProvider
+from .fixtures import DEFAULT_FIXTURE_DIR, EXACT_OUT_PRICERS, Fixture, checksum, get_observed_logs, load_fixtures, make_pricer, prime, run_exact_out, run_observe, run_quotes
+
+l = logging.getLogger(__name__)
+
+DEFAULT_RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# a result slower than the baseline by more than this fraction is flagged
+REGRESSION_THRESHOLD = 0.10
+
+
+def bench(fn: typing.Callable[[], typing.Tuple[float, typing.List[typing.Any]]], n_ops: int, min_seconds: float) -> typing.Dict[str, typing.Any]:
+    """
+    Run fn (which returns the seconds it spent on the measured part, and its outputs)
+    until at least min_seconds have been measured; the first run is a warm-up
+    """
+    _, outputs = fn()
+    n_runs = 0
+    elapsed = 0.0
+    while n_runs == 0 or elapsed < min_seconds:
+        run_elapsed, run_outputs = fn()
+        assert run_outputs == outputs, 'outputs differ between runs'
+        elapsed += run_elapsed
+        n_runs += 1
+
+    return {
+        'n_ops': n_ops * n_runs,
+        'seconds': elapsed,
+        'ops_per_second': n_ops * n_runs / elapsed,
+        'checksum': checksum(outputs),
+    }
+
+
+def bench_fixture(fixture: Fixture, fixture_dir: str, min_seconds: float) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    provider = ReplayProvider([fixture.recording_path(fixture_dir)])
+    w3 = web3.Web3(provider)
+    ret = {}
+
+    pricer = make_pricer(w3, fixture.pricer, fixture.args)
+
+    def quotes():
+        t_start = time.perf_counter()
+        outputs = run_quotes(pricer, fixture)
+        return time.perf_counter() - t_start, outputs
+    ret['quote'] = bench(quotes, len(fixture.quotes), min_seconds)
+
+    if fixture.pricer in EXACT_OUT_PRICERS:
+        def exact_out():
+            t_start = time.perf_counter()
+            outputs = run_exact_out(pricer, fixture)
+            return time.perf_counter() - t_start, outputs
+        ret['exact_out'] = bench(exact_out, len(fixture.exact_out), min_seconds)
+
+    logs = get_observed_logs(w3, fixture)
+    def observe():
+        # observing changes state, so start from a fresh pricer every time
+        fresh = make_pricer(w3, fixture.pricer, fixture.args)
+        prime(fresh, fixture)
+        t_start = time.perf_counter()
+        outputs = run_observe(fresh, fixture, logs)
+        return time.perf_counter() - t_start, outputs
+    ret['observe_block'] = bench(observe, len(logs), min_seconds)
+    ret['observe_block']['n_logs'] = sum(len(x) for x in logs)
+
+    if provider.responses.n_not_recorded > 0:
+        raise Exception(f'{provider.responses.n_not_recorded:,} requests of {fixture.name} were not recorded; re-record the fixture')
+
+    return ret
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> bool:
+    """
+    Print the change from the baseline; returns False if any output changed
+    """
+    ok = True
+    tab = []
+    for name, measurements in sorted(results['fixtures'].items()):
+        for kind, m in sorted(measurements.items()):
+            base = baseline['fixtures'].get(name, {}).get(kind, None)
+            if base is None:
+                tab.append((name, kind, f'{m["ops_per_second"]:,.1f}', '', '', 'new'))
+                continue
+            ratio = m['ops_per_second'] / base['ops_per_second']
+            note = ''
+            if m['checksum'] != base['checksum']:
+                note = 'OUTPUT CHANGED'
+                ok = False
+            elif ratio < 1 - REGRESSION_THRESHOLD:
+                note = 'slower'
+            tab.append((name, kind, f'{m["ops_per_second"]:,.1f}', f'{base["ops_per_second"]:,.1f}', f'{ratio:.2f}x', note))
+    print(tabulate.tabulate(tab, headers=['Fixture', 'Benchmark', 'Ops/s', 'Baseline ops/s', 'Speedup', ''], disable_numparse=True))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pricers against recorded fixtures, offline')
+    parser.add_argument('--fixture-dir', type=str, default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument('--only', type=str, nargs='*', default=None, help='Only run fixtures with these names')
+    parser.add_argument('--min-seconds', type=float, default=2.0, help='Measure each benchmark for at least this long')
+    parser.add_argument('--output', type=str, default=None, help='Where to write results (default: benchmarks/results/pricers_<time>.json)')
+    parser.add_argument('--compare', type=str, default=None, help='Results file to compare against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    fixtures = load_fixtures(args.fixture_dir)
+    if args.only is not None:
+        fixtures = [f for f in fixtures if f.name in args.only]
+    if len(fixtures) == 0:
+        l.error(f'No fixtures in {args.fixture_dir}; record them with python3 -m benchmarks.record_fixtures')
+        sys.exit(1)
+
+    results = {
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'min_seconds': args.min_seconds,
+        'fixtures': {},
+    }
+    for fixture in fixtures:
+        l.info(f'Benchmarking {fixture.name} ({fixture.pricer})')
+        results['fixtures'][fixture.name] = bench_fixture(fixture, args.fixture_dir, args.min_seconds)
+
+    tab = []
+    for name, measurements in sorted(results['fixtures'].items()):
+        for kind, m in sorted(measurements.items()):
+            tab.append((name, kind, f'{m["n_ops"]:,}', f'{m["ops_per_second"]:,.1f}', m['checksum']))
+    print(tabulate.tabulate(tab, headers=['Fixture', 'Benchmark', 'Ops', 'Ops/s', 'Checksum'], disable_numparse=True))
+    print()
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULT_DIR, f'pricers_{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")}.json')
+    with open(output, mode='w') as fout:
+        json.dump(results, fout, indent=2)
+    l.info(f'Wrote results to {output}')
+
+    if args.compare is not None:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+        if not compare(results, baseline):
+            l.error('Some outputs differ from the baseline')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""
+benchmarks/bench_seek_candidates.py
+
+End-to-end benchmark of seek_candidates, offline: a fixed block range is replayed through
+PricerPool.observe_block -> profitable_circuits -> candidates, serving every RPC request
+from a recording of the same range. Reports blocks/sec, circuits/sec, per-phase times and
+a checksum of the candidates found, which must match the checksum recorded.
+
+    # once, needs a node (WEB3_HOST) and the database
+    python3 -m benchmarks.bench_seek_candidates record --start-block 13600000 --end-block 13600099
+    # any time after, offline
+    python3 -m benchmarks.bench_seek_candidates run [--compare baseline.json]
+
+benchmarks/fixtures ships a short synthetic scenario, seek_candidates_smoke (see
+benchmarks/synthesize_fixtures.py), so that run works out of the box.
+"""
+import argparse
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import typing
+import logging
+
+import tabulate
+import web3
+
+import find_circuit
+import find_circuit.monitor
+from backtest.top_of_block.common import load_pool
+from backtest.top_of_block.constants import MIN_PROFIT_PREFILTER
+from backtest.top_of_block.seek_candidates import LOG_BATCH_SIZE, find_candidates, get_relevant_logs
+from backtest.utils import connect_db
+import pricers.balancer_v2.common
+from pricers.pricer_pool import PricerPool
+from utils import RetryingProvider
+from utils.rpc_cache import open_default_cache
+from utils.rpc_recording import ReplayProvider, RPCRecorder
+import utils.profiling
+from .bench_pricers import DEFAULT_RESULT_DIR, REGRESSION_THRESHOLD, git_commit
+from .fixtures import DEFAULT_FIXTURE_DIR
+
+l = logging.getLogger(__name__)
+
+# number of phases (spans) printed; all of them are in the results file
+N_PHASES_SHOWN = 15
+
+
+def save_pool(pool: PricerPool, path: str):
+    specs = []
+    for method, args in pool.exchange_specs():
+        if method == 'add_balancer_v2':
+            address, pool_id, pool_type, origin_block = args
+            args = (address, pool_id.hex(), pool_type, origin_block)
+        specs.append((method, args))
+    with gzip.open(path, mode='wt') as fout:
+        json.dump(specs, fout)
+
+
+def build_pool(w3: web3.Web3, path: str, tmpdir: str) -> PricerPool:
+    """
+    Rebuild the pool saved at path (see save_pool)
+    """
+    with gzip.open(path, mode='rt') as fin:
+        specs = json.load(fin)
+
+    pool = PricerPool(w3, tmpdir)
+    for method, args in specs:
+        if method == 'add_balancer_v2':
+            address, pool_id, pool_type, origin_block = args
+            args = (address, bytes.fromhex(pool_id), pool_type, origin_block)
+        getattr(pool, method)(*args)
+    return pool
+
+
+def run_range(w3: web3.Web3, pool: PricerPool, start_block: int, end_block: int, min_profit: int) -> typing.Dict[str, typing.Any]:
+    """
+    Search for candidates in every block of the range, as seek_candidates does (less the
+    database); returns throughput, phase timings and a checksum of the candidates
+    """
+    utils.profiling.reset()
+    n_circuits_before = utils.profiling.get_total_counts().get('propose-circuit.circuits', 0)
+    t_start = time.perf_counter()
+
+    with utils.profiling.profile('warm'):
+        pool.warm(start_block)
+        circuit_catalog = find_circuit.CircuitCatalog(pool)
+        threshold_index = find_circuit.monitor.ThresholdIndex(pool)
+
+    candidates = []
+    for batch_start_block in range(start_block, end_block + 1, LOG_BATCH_SIZE):
+        batch_end_block = min(end_block, batch_start_block + LOG_BATCH_SIZE - 1)
+        with utils.profiling.profile('logs'):
+            block_logs = list(get_relevant_logs(w3, pool, batch_start_block, batch_end_block))
+
+        for block_number, logs in block_logs:
+            utils.profiling.set_context(block_number=block_number)
+            with utils.profiling.profile('observe_block'):
+                update = pool.observe_block(block_number, logs)
+            with utils.profiling.profile('find_candidates'):
+                for fa in find_candidates(
+                        w3, pool, block_number, update,
+                        min_profit=min_profit,
+                        circuit_catalog=circuit_catalog,
+                        threshold_index=threshold_index,
+                    ):
+                    candidates.append((
+                        block_number,
+                        [p.address for p in fa.circuit],
+                        [t for t, _ in fa.directions],
+                        fa.amount_in,
+                        fa.profit,
+                    ))
+
+    elapsed = time.perf_counter() - t_start
+    n_blocks = end_block - start_block + 1
+    n_circuits = utils.profiling.get_total_counts().get('propose-circuit.circuits', 0) - n_circuits_before
+    snap = utils.profiling.snapshot()
+    spans = snap['spans']
+
+    return {
+        'n_blocks': n_blocks,
+        'n_circuits': n_circuits,
+        'n_candidates': len(candidates),
+        'seconds': elapsed,
+        'blocks_per_second': n_blocks / elapsed,
+        'circuits_per_second': n_circuits / elapsed,
+        # candidates are not necessarily found in a deterministic order
+        'checksum': hashlib.sha256(json.dumps(sorted(candidates)).encode('ascii')).hexdigest()[:16],
+        'phases': {
+            path: {k: s[k] for k in ('count', 'total_seconds', 'self_seconds')}
+            for path, s in sorted(spans.items(), key=lambda x: x[1]['total_seconds'], reverse=True)
+        },
+        # timed by the caller; these overlap the phases
+        'measurements': {
+            name: {k: m[k] for k in ('count', 'total_seconds')}
+            for name, m in sorted(snap['measurements'].items())
+        },
+    }
+
+
+def record(args: argparse.Namespace):
+    # everything must come from the node, so that it is in the recording
+    os.environ['HEADER_STORE_DIR'] = ''
+    os.environ['LOG_ARCHIVE_DIR'] = ''
+
+    name = args.name or f'seek_candidates_{args.start_block}_{args.end_block}'
+    os.makedirs(args.fixture_dir, exist_ok=True)
+    prefix = os.path.join(args.fixture_dir, name)
+    if os.path.exists(prefix + '.rpc.jsonl.gz'):
+        # recordings are appended to
+        os.unlink(prefix + '.rpc.jsonl.gz')
+
+    recorder = RPCRecorder(prefix + '.rpc.jsonl.gz')
+    w3 = web3.Web3(RetryingProvider(cache=open_default_cache(), recorder=recorder))
+
+    db = connect_db()
+    curr = db.cursor()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        save_pool(load_pool(w3, curr, tmpdir), prefix + '.pool.json.gz')
+    db.close()
+
+    save_scenario(prefix, name, args.start_block, args.end_block, w3, recorder)
+
+
+def save_scenario(prefix: str, name: str, start_block: int, end_block: int, w3: web3.Web3, recorder: RPCRecorder):
+    """
+    Run the block range on the pool saved at prefix (see save_pool), recording its requests
+    through w3 (whose provider records to recorder), check that the recording replays, and
+    save the scenario
+    """
+    # block timestamps and token decimals are cached process-wide; forget them so
+    # that the recording has every request a fresh process makes
+    utils._block_timestamp_cache.clear()
+    pricers.balancer_v2.common._sc_cache.clear()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # run on the rebuilt pool, exactly as the benchmark will
+        live = run_range(w3, build_pool(w3, prefix + '.pool.json.gz', tmpdir), start_block, end_block, MIN_PROFIT_PREFILTER)
+        recorder.close()
+
+        replay = ReplayProvider([prefix + '.rpc.jsonl.gz'])
+        w3_replay = web3.Web3(replay)
+        replayed = run_range(w3_replay, build_pool(w3_replay, prefix + '.pool.json.gz', tmpdir), start_block, end_block, MIN_PROFIT_PREFILTER)
+
+    if replay.responses.n_not_recorded > 0 or replayed['checksum'] != live['checksum']:
+        raise Exception(f'Recording does not replay ({replay.responses.n_not_recorded} requests missing, checksum {live["checksum"]} vs {replayed["checksum"]})')
+
+    with open(prefix + '.seek.json', mode='w') as fout:
+        json.dump({
+            'name': name,
+            'start_block': start_block,
+            'end_block': end_block,
+            'min_profit': MIN_PROFIT_PREFILTER,
+            'n_candidates': live['n_candidates'],
+            'checksum': live['checksum'],
+            'recorded_at': datetime.datetime.utcnow().isoformat(),
+        }, fout, indent=2)
+    l.info(f'Recorded {name}: {live["n_candidates"]} candidates in {live["n_blocks"]} blocks, checksum {live["checksum"]}')
+
+
+def run(args: argparse.Namespace):
+    scenarios = []
+    for path in sorted(glob.glob(os.path.join(args.fixture_dir, '*.seek.json'))):
+        with open(path) as fin:
+            scenarios.append(json.load(fin))
+    if args.only is not None:
+        scenarios = [s for s in scenarios if s['name'] in args.only]
+    if len(scenarios) == 0:
+        l.error(f'No scenarios in {args.fixture_dir}; record one with python3 -m benchmarks.bench_seek_candidates record')
+        sys.exit(1)
+
+    results = {
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'scenarios': {},
+    }
+    ok = True
+    for scenario in scenarios:
+        name = scenario['name']
+        prefix = os.path.join(args.fixture_dir, name)
+        l.info(f'Replaying {name} (blocks {scenario["start_block"]:,} to {scenario["end_block"]:,})')
+
+        replay = ReplayProvider([prefix + '.rpc.jsonl.gz'])
+        w3 = web3.Web3(replay)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pool = build_pool(w3, prefix + '.pool.json.gz', tmpdir)
+            result = run_range(w3, pool, scenario['start_block'], scenario['end_block'], scenario['min_profit'])
+        result['n_not_recorded'] = replay.responses.n_not_recorded
+        result['output_matches'] = result['checksum'] == scenario['checksum']
+        results['scenarios'][name] = result
+
+        if not result['output_matches']:
+            l.error(f'{name}: candidates differ from the recording (checksum {result["checksum"]}, recorded {scenario["checksum"]})')
+            ok = False
+        if result['n_not_recorded'] > 0:
+            l.warning(f'{name}: {result["n_not_recorded"]:,} requests were not in the recording')
+
+        print(tabulate.tabulate(
+            [
+                ('blocks/s', f'{result["blocks_per_second"]:,.3f}'),
+                ('circuits/s', f'{result["circuits_per_second"]:,.1f}'),
+                ('candidates', f'{result["n_candidates"]:,}'),
+                ('checksum', result['checksum'] + ('' if result['output_matches'] else ' (CHANGED)')),
+            ],
+            headers=[name, ''],
+            disable_numparse=True,
+        ))
+        print()
+        print(tabulate.tabulate(
+            [
+                (path, f'{p["count"]:,}', f'{p["total_seconds"]:,.3f}', f'{p["self_seconds"]:,.3f}')
+                for path, p in list(result['phases'].items())[:N_PHASES_SHOWN]
+            ],
+            headers=['Phase', 'Count', 'Total (s)', 'Self (s)'],
+            disable_numparse=True,
+        ))
+        print()
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_RESULT_DIR, f'seek_candidates_{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")}.json')
+    with open(output, mode='w') as fout:
+        json.dump(results, fout, indent=2)
+    l.info(f'Wrote results to {output}')
+
+    if args.compare is not None:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+        tab = []
+        for name, result in sorted(results['scenarios'].items()):
+            base = baseline['scenarios'].get(name, None)
+            if base is None:
+                continue
+            ratio = result['blocks_per_second'] / base['blocks_per_second']
+            note = 'slower' if ratio < 1 - REGRESSION_THRESHOLD else ''
+            tab.append((name, f'{result["blocks_per_second"]:,.3f}', f'{base["blocks_per_second"]:,.3f}', f'{ratio:.2f}x', note))
+        print(tabulate.tabulate(tab, headers=['Scenario', 'Blocks/s', 'Baseline blocks/s', 'Speedup', ''], disable_numparse=True))
+
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline, deterministic end-to-end benchmark of seek_candidates')
+    parser.add_argument('--fixture-dir', type=str, default=DEFAULT_FIXTURE_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_record = subparsers.add_parser('record', help='Record a scenario (needs a node and the database)')
+    parser_record.add_argument('--start-block', type=int, required=True)
+    parser_record.add_argument('--end-block', type=int, required=True)
+    parser_record.add_argument('--name', type=str, default=None, help='Scenario name (default: seek_candidates_<start>_<end>)')
+
+    parser_run = subparsers.add_parser('run', help='Replay recorded scenarios')
+    parser_run.add_argument('--only', type=str, nargs='*', default=None, help='Only replay scenarios with these names')
+    parser_run.add_argument('--output', type=str, default=None, help='Where to write results (default: benchmarks/results/seek_candidates_<time>.json)')
+    parser_run.add_argument('--compare', type=str, default=None, help='Results file to compare against')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    if args.command == 'record':
+        record(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
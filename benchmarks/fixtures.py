@@ -0,0 +1,173 @@
+"""
+benchmarks/fixtures.py
+
+Pricer fixtures: a manifest (json) describing a pool, a block, and a workload of quotes,
+exact-out quotes and blocks to observe, next to a recording of every RPC request the
+workload makes.
+
+The fixtures kept in benchmarks/fixtures are small and synthetic (made-up pool state, see
+benchmarks/synthesize_fixtures.py); record real ones with benchmarks/record_fixtures.py.
+"""
+import collections
+import glob
+import hashlib
+import json
+import os
+import typing
+import logging
+
+import web3
+import web3.types
+
+from pricers.base import BaseExchangePricer
+from pricers.uniswap_v2 import UniswapV2Pricer
+from pricers.uniswap_v3 import UniswapV3Pricer
+from pricers.balancer import BalancerPricer
+from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
+from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2LiquidityBootstrappingPoolPricer
+from utils import get_abi, BALANCER_VAULT_ADDRESS
+
+l = logging.getLogger(__name__)
+
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# pricers that model exact-out swaps
+EXACT_OUT_PRICERS = ('UniswapV2Pricer', 'UniswapV3Pricer')
+
+
+class Fixture(typing.NamedTuple):
+    name: str
+    pricer: str
+    args: typing.Dict[str, typing.Any]
+    block_number: int
+    timestamp: int
+    observe_blocks: typing.Tuple[int, int]
+    quotes: typing.List[typing.Tuple[str, str, int]]
+    exact_out: typing.List[typing.Tuple[str, str, int]]
+
+    def recording_path(self, fixture_dir: str) -> str:
+        return os.path.join(fixture_dir, f'{self.name}.rpc.jsonl.gz')
+
+    def save(self, fixture_dir: str):
+        with open(os.path.join(fixture_dir, f'{self.name}.fixture.json'), mode='w') as fout:
+            json.dump(self._asdict(), fout, indent=2)
+
+    @staticmethod
+    def load(path: str) -> 'Fixture':
+        with open(path) as fin:
+            d = json.load(fin)
+        d['observe_blocks'] = tuple(d['observe_blocks'])
+        d['quotes'] = [tuple(q) for q in d['quotes']]
+        d['exact_out'] = [tuple(q) for q in d['exact_out']]
+        return Fixture(**d)
+
+
+def load_fixtures(fixture_dir: str = DEFAULT_FIXTURE_DIR) -> typing.List[Fixture]:
+    return [Fixture.load(p) for p in sorted(glob.glob(os.path.join(fixture_dir, '*.fixture.json')))]
+
+
+def make_pricer(w3: web3.Web3, pricer: str, args: typing.Dict[str, typing.Any]) -> BaseExchangePricer:
+    if pricer == 'UniswapV2Pricer':
+        return UniswapV2Pricer(w3, args['address'], args['token0'], args['token1'])
+    if pricer == 'UniswapV3Pricer':
+        return UniswapV3Pricer(w3, args['address'], args['token0'], args['token1'], args['fee'])
+    if pricer == 'BalancerPricer':
+        return BalancerPricer(w3, args['address'])
+
+    vault = w3.eth.contract(address=BALANCER_VAULT_ADDRESS, abi=get_abi('balancer_v2/Vault.json'))
+    if pricer == 'BalancerV2WeightedPoolPricer':
+        return BalancerV2WeightedPoolPricer(w3, vault, args['address'], bytes.fromhex(args['pool_id']))
+    if pricer == 'BalancerV2LiquidityBootstrappingPoolPricer':
+        return BalancerV2LiquidityBootstrappingPoolPricer(w3, vault, args['address'], bytes.fromhex(args['pool_id']))
+    raise Exception(f'Unknown pricer {pricer}')
+
+
+def pricer_spec(pricer: BaseExchangePricer) -> typing.Tuple[str, typing.Dict[str, typing.Any]]:
+    """
+    The (pricer, args) that make_pricer takes to make a fresh copy of the given pricer
+    """
+    name = type(pricer).__name__
+    if name == 'UniswapV2Pricer':
+        return name, {'address': pricer.address, 'token0': pricer.token0, 'token1': pricer.token1}
+    if name == 'UniswapV3Pricer':
+        return name, {'address': pricer.address, 'token0': pricer.token0, 'token1': pricer.token1, 'fee': pricer.fee}
+    if name == 'BalancerPricer':
+        return name, {'address': pricer.address}
+    if name in ('BalancerV2WeightedPoolPricer', 'BalancerV2LiquidityBootstrappingPoolPricer'):
+        return name, {'address': pricer.address, 'pool_id': pricer.pool_id.hex()}
+    raise Exception(f'Unknown pricer {name}')
+
+
+def run_quotes(pricer: BaseExchangePricer, fixture: Fixture) -> typing.List[typing.Any]:
+    """
+    Quote every exact-in swap of the workload; returns the outputs (or exception names)
+    """
+    ret = []
+    for token_in, token_out, amount_in in fixture.quotes:
+        try:
+            ret.append(pricer.token_out_for_exact_in(token_in, token_out, amount_in, fixture.block_number, timestamp=fixture.timestamp))
+        except Exception as e:
+            ret.append(type(e).__name__)
+    return ret
+
+
+def run_exact_out(pricer: typing.Union[UniswapV2Pricer, UniswapV3Pricer], fixture: Fixture) -> typing.List[typing.Any]:
+    """
+    Quote the input needed for every exact-out swap of the workload
+    """
+    ret = []
+    for token_in, _, amount_out in fixture.exact_out:
+        try:
+            if token_in == pricer.token0:
+                ret.append(pricer.token1_out_to_exact_token0_in(amount_out, fixture.block_number))
+            else:
+                ret.append(pricer.token0_out_to_exact_token1_in(amount_out, fixture.block_number))
+        except Exception as e:
+            ret.append(type(e).__name__)
+    return ret
+
+
+def get_observed_logs(w3: web3.Web3, fixture: Fixture) -> typing.List[typing.List[web3.types.LogReceipt]]:
+    """
+    The logs the pricer would be shown in each block of the observed range, for blocks where there are any
+    """
+    start, end = fixture.observe_blocks
+    f = {'fromBlock': start, 'toBlock': end}
+    if 'pool_id' in fixture.args:
+        # balancer v2 pricers see vault logs about their pool
+        f['address'] = BALANCER_VAULT_ADDRESS
+        f['topics'] = [None, '0x' + fixture.args['pool_id']]
+    else:
+        f['address'] = fixture.args['address']
+    logs = w3.eth.get_logs(f)
+
+    by_block = collections.defaultdict(list)
+    for log in logs:
+        by_block[log['blockNumber']].append(log)
+    return [sorted(by_block[b], key=lambda x: x['logIndex']) for b in sorted(by_block.keys())]
+
+
+def prime(pricer: BaseExchangePricer, fixture: Fixture):
+    """
+    Load the pricer's state as of the fixture's block
+    """
+    for token in sorted(pricer.get_tokens(fixture.block_number)):
+        pricer.get_value_locked(token, fixture.block_number)
+
+
+def run_observe(pricer: BaseExchangePricer, fixture: Fixture, logs: typing.List[typing.List[web3.types.LogReceipt]]) -> typing.List[typing.Any]:
+    """
+    Observe every block of logs, then quote a swap of the workload (to capture the resulting state)
+    """
+    for block_logs in logs:
+        pricer.observe_block(block_logs)
+    last_block = fixture.observe_blocks[1]
+    token_in, token_out, amount_in = fixture.quotes[len(fixture.quotes) // 2]
+    try:
+        return [pricer.token_out_for_exact_in(token_in, token_out, amount_in, last_block, timestamp=fixture.timestamp)]
+    except Exception as e:
+        return [type(e).__name__]
+
+
+def checksum(outputs: typing.List[typing.Any]) -> str:
+    return hashlib.sha256(json.dumps(outputs).encode('ascii')).hexdigest()[:16]
@@ -0,0 +1,206 @@
+"""
+benchmarks/record_fixtures.py
+
+Records the pricer fixtures used by benchmarks/bench_pricers.py; needs an archive node
+(WEB3_HOST) and, to pick the balancer v2 pools, the database. Run once:
+
+    python3 -m benchmarks.record_fixtures --block-number 13600000
+
+Each fixture's workload is run against the node while recording, then replayed from
+the recording to check that it is complete and gives identical outputs.
+"""
+import argparse
+import collections
+import itertools
+import os
+import typing
+import logging
+
+import web3
+from eth_utils import event_abi_to_log_topic
+
+import pricers.balancer_v2.common
+from backtest.utils import connect_db
+from utils import RetryingProvider, connect_web3, get_abi, BALANCER_VAULT_ADDRESS, USDC_ADDRESS, WETH_ADDRESS
+from utils.rpc_recording import ReplayProvider, RPCRecorder
+from .fixtures import DEFAULT_FIXTURE_DIR, EXACT_OUT_PRICERS, Fixture, checksum, get_observed_logs, make_pricer, prime, run_exact_out, run_observe, run_quotes
+
+l = logging.getLogger(__name__)
+
+# well-known, deep pools; balancer v2 pools are picked from the database, by activity
+FIXED_POOLS = [
+    ('uniswap_v2_usdc_weth', 'UniswapV2Pricer', {
+        'address': '0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc',
+        'token0': USDC_ADDRESS,
+        'token1': WETH_ADDRESS,
+    }),
+    ('uniswap_v3_usdc_weth_500', 'UniswapV3Pricer', {
+        'address': '0x88e6A0c2dDD26FEEb64F039a2c41296FcB3f5640',
+        'token0': USDC_ADDRESS,
+        'token1': WETH_ADDRESS,
+        'fee': 500,
+    }),
+    ('balancer_v1_bal_weth', 'BalancerPricer', {
+        'address': '0x59A19D8c652FA0284f44113D0ff9aBa70bd46fB4',
+    }),
+]
+
+BALANCER_V2_POOL_TYPES = [
+    ('balancer_v2_weighted', 'BalancerV2WeightedPoolPricer', ['WeightedPool', 'WeightedPool2Tokens']),
+    ('balancer_v2_lbp', 'BalancerV2LiquidityBootstrappingPoolPricer', ['LiquidityBootstrappingPool', 'NoProtocolFeeLiquidityBootstrappingPool']),
+]
+
+# quote at most this many distinct tokens of a pool (balancer pools have up to 8)
+MAX_TOKENS = 3
+
+# largest swap quoted, as a fraction of the pool's balance of the input (or output) token
+MAX_FRACTION = 0.25
+MIN_FRACTION = 1e-6
+
+
+def pick_balancer_v2_pool(w3: web3.Web3, pool_types: typing.List[str], start_block: int, end_block: int) -> typing.Tuple[str, str]:
+    """
+    Pick the pool of the given types with the most swaps in the block range; returns (address, pool id hex)
+    """
+    db = connect_db()
+    curr = db.cursor()
+    curr.execute(
+        '''
+        SELECT address, pool_id
+        FROM balancer_v2_exchanges
+        WHERE pool_type = ANY (%s) AND origin_block < %s
+        ''',
+        (pool_types, start_block),
+    )
+    candidates = {pool_id.tobytes(): w3.toChecksumAddress(address.tobytes()) for address, pool_id in curr}
+    db.close()
+
+    vault = w3.eth.contract(address=BALANCER_VAULT_ADDRESS, abi=get_abi('balancer_v2/Vault.json'))
+    swap_topic = event_abi_to_log_topic(vault.events.Swap().abi)
+    logs = w3.eth.get_logs({
+        'address': BALANCER_VAULT_ADDRESS,
+        'topics': ['0x' + swap_topic.hex()],
+        'fromBlock': start_block,
+        'toBlock': end_block,
+    })
+    counts = collections.Counter(bytes(log['topics'][1]) for log in logs if bytes(log['topics'][1]) in candidates)
+    if len(counts) == 0:
+        raise Exception(f'No {pool_types} pool swapped in [{start_block:,}, {end_block:,}]; try another --block-number')
+
+    pool_id, n_swaps = counts.most_common(1)[0]
+    l.info(f'Picked {candidates[pool_id]} ({n_swaps} swaps) for {pool_types}')
+    return candidates[pool_id], pool_id.hex()
+
+
+def fractions(n: int) -> typing.List[float]:
+    ratio = (MAX_FRACTION / MIN_FRACTION) ** (1 / (n - 1))
+    return [MIN_FRACTION * ratio ** i for i in range(n)]
+
+
+def record_fixture(
+        fixture_dir: str,
+        name: str,
+        pricer_name: str,
+        args: typing.Dict[str, typing.Any],
+        block_number: int,
+        timestamp: int,
+        n_blocks: int,
+        n_amounts: int,
+        make_provider: typing.Optional[typing.Callable[[RPCRecorder], web3.providers.BaseProvider]] = None,
+    ) -> Fixture:
+    """
+    Record the fixture from the node (or from make_provider(recorder), which must
+    record every request it serves)
+    """
+    fixture = Fixture(
+        name = name,
+        pricer = pricer_name,
+        args = args,
+        block_number = block_number,
+        timestamp = timestamp,
+        observe_blocks = (block_number + 1, block_number + n_blocks),
+        quotes = [],
+        exact_out = [],
+    )
+
+    recording_path = fixture.recording_path(fixture_dir)
+    if os.path.exists(recording_path):
+        # recordings are appended to
+        os.unlink(recording_path)
+    recorder = RPCRecorder(recording_path)
+    if make_provider is None:
+        w3 = web3.Web3(RetryingProvider(recorder=recorder))
+    else:
+        w3 = web3.Web3(make_provider(recorder))
+
+    # token decimals are cached process-wide; forget them so that the recording
+    # has every request a fresh process makes
+    pricers.balancer_v2.common._sc_cache.clear()
+
+    # build the workload
+    pricer = make_pricer(w3, pricer_name, args)
+    tokens = sorted(pricer.get_tokens(block_number))[:MAX_TOKENS]
+    for token_in, token_out in itertools.permutations(tokens, 2):
+        reserve_in = pricer.get_value_locked(token_in, block_number)
+        reserve_out = pricer.get_value_locked(token_out, block_number)
+        for f in fractions(n_amounts):
+            fixture.quotes.append((token_in, token_out, max(1, int(reserve_in * f))))
+            if pricer_name in EXACT_OUT_PRICERS:
+                fixture.exact_out.append((token_in, token_out, max(1, int(reserve_out * f))))
+
+    # run it exactly as the benchmark does, so that every request is recorded
+    def run(w3: web3.Web3) -> typing.List[str]:
+        pricer = make_pricer(w3, pricer_name, args)
+        ret = [checksum(run_quotes(pricer, fixture))]
+        if pricer_name in EXACT_OUT_PRICERS:
+            ret.append(checksum(run_exact_out(pricer, fixture)))
+        logs = get_observed_logs(w3, fixture)
+        fresh = make_pricer(w3, pricer_name, args)
+        prime(fresh, fixture)
+        ret.append(checksum(run_observe(fresh, fixture, logs)))
+        return ret
+
+    live = run(w3)
+    recorder.close()
+
+    replay = ReplayProvider([recording_path])
+    replayed = run(web3.Web3(replay))
+    if replay.responses.n_not_recorded > 0 or replayed != live:
+        raise Exception(f'Recording of {name} does not replay ({replay.responses.n_not_recorded} requests missing, checksums {live} vs {replayed})')
+
+    fixture.save(fixture_dir)
+    l.info(f'Recorded {name}: {len(fixture.quotes)} quotes, {len(fixture.exact_out)} exact-out quotes')
+    return fixture
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record pricer benchmark fixtures from an archive node')
+    parser.add_argument('--fixture-dir', type=str, default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument('--block-number', type=int, default=13_600_000, help='Quote against the state as of this block')
+    parser.add_argument('--n-blocks', type=int, default=1_000, help='Observe this many blocks after block-number')
+    parser.add_argument('--n-amounts', type=int, default=32, help='Quote this many amounts per token pair')
+    parser.add_argument('--only', type=str, nargs='*', default=None, help='Only record fixtures with these names')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    os.makedirs(args.fixture_dir, exist_ok=True)
+    w3 = connect_web3()
+    timestamp = w3.eth.get_block(args.block_number + 1)['timestamp']
+    end_block = args.block_number + args.n_blocks
+
+    to_record = list(FIXED_POOLS)
+    for name, pricer_name, pool_types in BALANCER_V2_POOL_TYPES:
+        if args.only is not None and name not in args.only:
+            continue
+        address, pool_id = pick_balancer_v2_pool(w3, pool_types, args.block_number + 1, end_block)
+        to_record.append((name, pricer_name, {'address': address, 'pool_id': pool_id}))
+
+    for name, pricer_name, pricer_args in to_record:
+        if args.only is not None and name not in args.only:
+            continue
+        record_fixture(args.fixture_dir, name, pricer_name, pricer_args, args.block_number, timestamp, args.n_blocks, args.n_amounts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+"""
+benchmarks/synthesize_fixtures.py
+
+Builds the small fixture set kept in benchmarks/fixtures: one pool of each pricer type,
+a smoke corpus for bench_detectors and a short block range for bench_seek_candidates.
+The pools' state is made up (at realistic
+magnitudes) and served by SyntheticNode, which answers the same storage reads, calls
+and log queries a node would; the workloads are then recorded exactly as
+benchmarks/record_fixtures.py records them from an archive node. Needs no node:
+
+    python3 -m benchmarks.synthesize_fixtures
+
+Fixtures recorded from mainnet with record_fixtures.py are the better benchmark;
+these are here so that the benchmarks run out of the box, and as a smoke test.
+"""
+import argparse
+import concurrent.futures
+import math
+import os
+import typing
+import logging
+
+import eth_abi
+import web3
+import web3.contract
+import web3.types
+from eth_utils import event_abi_to_log_topic, keccak
+from web3.providers.base import JSONBaseProvider
+
+from pricers.balancer import TOKEN_BASE_SLOT
+from pricers.balancer_v2.liquidity_bootstrapping_pool import compress
+from pricers.uniswap_v3 import UniswapV3Pricer
+from pricers.pricer_pool import PricerPool
+from utils import get_abi, BALANCER_VAULT_ADDRESS, DAI_ADDRESS, USDC_ADDRESS, WETH_ADDRESS
+from utils.rpc_recording import RPCRecorder
+from .bench_seek_candidates import save_pool, save_scenario
+from .bench_detectors import Case, brute_force_optimum, make_circuit, save_corpus
+from .fixtures import DEFAULT_FIXTURE_DIR
+from .record_fixtures import record_fixture
+
+l = logging.getLogger(__name__)
+
+BLOCK_NUMBER = 13_600_000
+TIMESTAMP = 1_636_704_000
+N_BLOCKS = 20
+N_AMOUNTS = 16
+
+BAL_ADDRESS = '0xba100000625a3754423978a60c9317c58a424e3D'
+WBTC_ADDRESS = '0x2260FAC5E5542a773Aa44fBCfeDf7C193bc2C599'
+# stands in for the sale token of a liquidity bootstrapping pool
+LBP_TOKEN_ADDRESS = web3.Web3.toChecksumAddress(keccak(b'synthetic lbp token')[:20])
+LBP_ADDRESS = web3.Web3.toChecksumAddress(keccak(b'synthetic lbp')[:20])
+
+_w3 = web3.Web3()
+_erc20 = _w3.eth.contract(address=WETH_ADDRESS, abi=get_abi('erc20.abi.json'))
+_uv2 = _w3.eth.contract(address=b'\x00' * 20, abi=get_abi('uniswap_v2/IUniswapV2Pair.json')['abi'])
+_uv3 = _w3.eth.contract(address=b'\x00' * 20, abi=get_abi('uniswap_v3/IUniswapV3Pool.json')['abi'])
+_bpool = _w3.eth.contract(address=b'\x00' * 20, abi=get_abi('balancer_v1/bpool.abi.json'))
+_vault = _w3.eth.contract(address=BALANCER_VAULT_ADDRESS, abi=get_abi('balancer_v2/Vault.json'))
+_lbp = _w3.eth.contract(address=b'\x00' * 20, abi=get_abi('balancer_v2/LiquidityBootstrappingPool.json'))
+_weighted = _w3.eth.contract(address=b'\x00' * 20, abi=get_abi('balancer_v2/WeightedPool.json'))
+
+
+class SyntheticNode(JSONBaseProvider):
+    """
+    Serves storage, eth_call results and logs from what was put in it (the same at every
+    block; unset storage reads as zero) and blocks 13 seconds apart, recording every
+    request like RetryingProvider
+    """
+    storage: typing.Dict[typing.Tuple[str, int], int]
+    calls: typing.Dict[typing.Tuple[str, str], str]
+    logs: typing.List[dict]
+
+    def __init__(self, head_block: int, recorder: typing.Optional[RPCRecorder] = None) -> None:
+        super().__init__()
+        self.head_block = head_block
+        self.recorder = recorder
+        self.storage = {}
+        self.calls = {}
+        self.logs = []
+
+    def set_storage(self, address: str, slot: typing.Union[int, bytes], value: int):
+        if isinstance(slot, bytes):
+            slot = int.from_bytes(slot, byteorder='big', signed=False)
+        self.storage[(address.lower(), slot)] = value
+
+    def set_call(self, contract: web3.contract.Contract, address: str, fn_name: str, args: typing.List[typing.Any], outputs: typing.List[typing.Any]):
+        fn_abi = contract.get_function_by_name(fn_name).abi
+        data = contract.encodeABI(fn_name=fn_name, args=args)
+        types = [o['type'] for o in fn_abi['outputs']]
+        self.calls[(address.lower(), data.lower())] = '0x' + eth_abi.encode_abi(types, outputs).hex()
+
+    def add_log(self, contract: web3.contract.Contract, address: str, event_name: str, block_number: int, args: typing.Dict[str, typing.Any]):
+        event_abi = contract.events[event_name]().abi
+        topics = [event_abi_to_log_topic(event_abi)]
+        data_types = []
+        data_values = []
+        for inp in event_abi['inputs']:
+            if inp['indexed']:
+                topics.append(eth_abi.encode_single(inp['type'], args[inp['name']]))
+            else:
+                data_types.append(inp['type'])
+                data_values.append(args[inp['name']])
+        log_index = sum(1 for x in self.logs if int(x['blockNumber'], 16) == block_number)
+        self.logs.append({
+            'address': address,
+            'topics': ['0x' + t.hex() for t in topics],
+            'data': '0x' + eth_abi.encode_abi(data_types, data_values).hex(),
+            'blockNumber': hex(block_number),
+            'blockHash': '0x' + keccak(block_number.to_bytes(32, 'big')).hex(),
+            'transactionHash': '0x' + keccak(block_number.to_bytes(32, 'big') + log_index.to_bytes(32, 'big')).hex(),
+            'transactionIndex': hex(log_index),
+            'logIndex': hex(log_index),
+            'removed': False,
+        })
+
+    def _respond(self, method, params) -> dict:
+        if method == 'eth_getStorageAt':
+            address, slot, _ = params
+            value = self.storage.get((address.lower(), int(slot, 16)), 0)
+            return {'result': '0x' + value.to_bytes(32, byteorder='big', signed=False).hex()}
+        if method == 'eth_call':
+            result = self.calls.get((params[0]['to'].lower(), params[0]['data'].lower()), None)
+            if result is None:
+                return {'error': {'code': -32000, 'message': 'execution reverted'}}
+            return {'result': result}
+        if method == 'eth_getLogs':
+            return {'result': [log for log in self.logs if _log_matches(log, params[0])]}
+        if method == 'eth_blockNumber':
+            return {'result': hex(self.head_block)}
+        if method == 'eth_chainId':
+            return {'result': '0x1'}
+        if method == 'eth_getBlockByNumber':
+            block_number = int(params[0], 16)
+            return {'result': {
+                'number': hex(block_number),
+                'hash': '0x' + keccak(block_number.to_bytes(32, 'big')).hex(),
+                'parentHash': '0x' + keccak((block_number - 1).to_bytes(32, 'big')).hex(),
+                'timestamp': hex(TIMESTAMP + 13 * (block_number - BLOCK_NUMBER)),
+                'logsBloom': '0x' + bytes(256).hex(),
+                'gasLimit': hex(30_000_000),
+                'gasUsed': hex(15_000_000),
+                'baseFeePerGas': hex(100 * 10 ** 9),
+                'transactions': [],
+            }}
+        return {'error': {'code': -32601, 'message': f'the method {method} does not exist/is not available'}}
+
+    def isConnected(self) -> bool:
+        return True
+
+    def make_request(self, method, params) -> web3.types.RPCResponse:
+        ret = {'jsonrpc': '2.0', 'id': 0}
+        ret.update(self._respond(method, params))
+        if self.recorder is not None:
+            self.recorder.record(method, params, ret)
+        return ret
+
+    def make_request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        return [self.make_request(method, params) for method, params in requests]
+
+    def submit_request(self, method, params) -> 'concurrent.futures.Future[web3.types.RPCResponse]':
+        ret = concurrent.futures.Future()
+        ret.set_result(self.make_request(method, params))
+        return ret
+
+    def get_finalized_block(self) -> int:
+        return self.head_block
+
+    def recording(self, recorder: RPCRecorder) -> 'SyntheticNode':
+        self.recorder = recorder
+        return self
+
+
+def _log_matches(log: dict, f: dict) -> bool:
+    block_number = int(log['blockNumber'], 16)
+    if not int(f['fromBlock'], 16) <= block_number <= int(f['toBlock'], 16):
+        return False
+    if 'address' in f:
+        addresses = f['address'] if isinstance(f['address'], list) else [f['address']]
+        if log['address'].lower() not in [a.lower() for a in addresses]:
+            return False
+    for i, wanted in enumerate(f.get('topics', [])):
+        if wanted is None:
+            continue
+        wanted = wanted if isinstance(wanted, list) else [wanted]
+        if i >= len(log['topics']) or log['topics'][i].lower() not in [w.lower() for w in wanted]:
+            return False
+    return True
+
+
+def _uint(b: bytes) -> int:
+    return int.from_bytes(b, byteorder='big', signed=False)
+
+
+def _swap_blocks() -> typing.List[int]:
+    """
+    Blocks of the observed range that have swaps in them
+    """
+    return [BLOCK_NUMBER + i for i in range(1, N_BLOCKS + 1) if i % 3 != 0]
+
+
+def uniswap_v2(node: SyntheticNode, address: str, reserve0: int, reserve1: int, observe: bool = True):
+    """
+    A Uniswap v2 pair (or fork) with the given reserves; if observe, it syncs
+    after small alternating swaps in the observed range
+    """
+    node.set_storage(address, 8, (reserve1 << 112) | reserve0)
+    if not observe:
+        return
+    for i, block_number in enumerate(_swap_blocks()):
+        if i % 2 == 0:
+            amount_in = reserve0 // 5_000
+            amount_out = amount_in * 997 * reserve1 // (reserve0 * 1000 + amount_in * 997)
+            reserve0, reserve1 = reserve0 + amount_in, reserve1 - amount_out
+        else:
+            amount_in = reserve1 // 7_000
+            amount_out = amount_in * 997 * reserve0 // (reserve1 * 1000 + amount_in * 997)
+            reserve0, reserve1 = reserve0 - amount_out, reserve1 + amount_in
+        node.add_log(_uv2, address, 'Sync', block_number, {'reserve0': reserve0, 'reserve1': reserve1})
+
+
+def uniswap_v3(node: SyntheticNode, address: str, fee: int, tick_spacing: int):
+    """
+    A Uniswap v3 pool of USDC (token0) and WETH (token1) at about 4,000 USDC per WETH,
+    with nested positions of increasing liquidity around the price. In the observed
+    range it swaps within the innermost position, and one position is minted.
+    """
+    sqrt_price_x96 = math.isqrt((10 ** 18 // 4_000 // 10 ** 6) << 192)
+    tick = UniswapV3Pricer.get_tick_at_sqrt_ratio(sqrt_price_x96)
+    aligned = tick // tick_spacing * tick_spacing
+    positions = [
+        (aligned - 50_000, aligned + 50_000, 2 * 10 ** 17),
+        (aligned - 5_000, aligned + 5_000, 10 ** 18),
+        (aligned - 500, aligned + 300, 5 * 10 ** 18),
+    ]
+
+    ticks: typing.Dict[int, typing.Tuple[int, int]] = {}
+    liquidity = 0
+    balance0 = balance1 = 0
+    for lower, upper, amount in positions:
+        gross, net = ticks.get(lower, (0, 0))
+        ticks[lower] = (gross + amount, net + amount)
+        gross, net = ticks.get(upper, (0, 0))
+        ticks[upper] = (gross + amount, net - amount)
+        liquidity += amount
+        balance0 += UniswapV3Pricer.get_amount0_delta(sqrt_price_x96, UniswapV3Pricer.get_sqrt_ratio_at_tick(upper), amount, True)
+        balance1 += UniswapV3Pricer.get_amount1_delta(UniswapV3Pricer.get_sqrt_ratio_at_tick(lower), sqrt_price_x96, amount, True)
+
+    # slot0 packs sqrtPriceX96, tick, ..., and unlocked (in the top byte)
+    node.set_storage(address, 0, (1 << 240) | ((tick % (1 << 24)) << 160) | sqrt_price_x96)
+    node.set_storage(address, 4, liquidity)
+    bitmap: typing.Dict[int, int] = {}
+    for t, (gross, net) in ticks.items():
+        slot = keccak(t.to_bytes(32, 'big', signed=True) + (5).to_bytes(32, 'big'))
+        node.set_storage(address, slot, ((net % (1 << 128)) << 128) | gross)
+        # initialized is in the top byte of the tick's fourth slot
+        node.set_storage(address, _uint(slot) + 3, 1 << 248)
+        compressed = t // tick_spacing
+        bitmap[compressed >> 8] = bitmap.get(compressed >> 8, 0) | (1 << (compressed % 256))
+    for word, bits in bitmap.items():
+        node.set_storage(address, keccak(word.to_bytes(32, 'big', signed=True) + (6).to_bytes(32, 'big')), bits)
+    node.set_call(_erc20, USDC_ADDRESS, 'balanceOf', [address], [balance0])
+    node.set_call(_erc20, WETH_ADDRESS, 'balanceOf', [address], [balance1])
+
+    # small swaps back and forth, staying within the innermost position
+    for i, block_number in enumerate(_swap_blocks()):
+        new_sqrt_price_x96 = sqrt_price_x96 * (1_000_000 + (1 if i % 2 == 0 else -1) * (50 + 10 * i)) // 1_000_000
+        amount0 = UniswapV3Pricer.get_amount0_delta(sqrt_price_x96, new_sqrt_price_x96, liquidity, True)
+        amount1 = UniswapV3Pricer.get_amount1_delta(sqrt_price_x96, new_sqrt_price_x96, liquidity, True)
+        if new_sqrt_price_x96 < sqrt_price_x96:
+            amount1 = -amount1
+        else:
+            amount0 = -amount0
+        sqrt_price_x96 = new_sqrt_price_x96
+        tick = UniswapV3Pricer.get_tick_at_sqrt_ratio(sqrt_price_x96)
+        node.add_log(_uv3, address, 'Swap', block_number, {
+            'sender': USDC_ADDRESS, 'recipient': USDC_ADDRESS, 'amount0': amount0, 'amount1': amount1,
+            'sqrtPriceX96': sqrt_price_x96, 'liquidity': liquidity, 'tick': tick,
+        })
+
+    lower, upper, amount = aligned - 100, aligned + 100, 3 * 10 ** 18
+    node.add_log(_uv3, address, 'Mint', BLOCK_NUMBER + N_BLOCKS // 2, {
+        'sender': USDC_ADDRESS, 'owner': USDC_ADDRESS, 'tickLower': lower, 'tickUpper': upper, 'amount': amount,
+        'amount0': UniswapV3Pricer.get_amount0_delta(sqrt_price_x96, UniswapV3Pricer.get_sqrt_ratio_at_tick(upper), amount, True),
+        'amount1': UniswapV3Pricer.get_amount1_delta(UniswapV3Pricer.get_sqrt_ratio_at_tick(lower), sqrt_price_x96, amount, True),
+    })
+
+
+def balancer_v1(node: SyntheticNode, address: str):
+    """
+    A finalized 80/20 BAL/WETH Balancer v1 pool with a 0.15% fee, swapping in the observed range
+    """
+    tokens = [(BAL_ADDRESS, 40 * 10 ** 18, 1_280_000 * 10 ** 18), (WETH_ADDRESS, 10 * 10 ** 18, 2_000 * 10 ** 18)]
+    node.set_storage(address, 9, len(tokens))
+    for i, (token, denorm, balance) in enumerate(tokens):
+        node.set_storage(address, TOKEN_BASE_SLOT + i, int(token, 16))
+        record_slot = _uint(keccak(bytes.fromhex(token[2:]).rjust(32, b'\x00') + (0xa).to_bytes(32, 'big')))
+        node.set_storage(address, record_slot + 2, denorm)
+        node.set_storage(address, record_slot + 3, balance)
+    # _publicSwap is packed after the controller's address; finalized is the low byte of its slot
+    node.set_storage(address, 6, 1 << 160)
+    node.set_storage(address, 8, 1)
+    node.set_storage(address, 7, 15 * 10 ** 14)
+
+    (bal, _, bal_balance), (weth, _, weth_balance) = tokens
+    for i, block_number in enumerate(_swap_blocks()):
+        # amounts out at about the spot price (weighted 4:1), less the fee
+        if i % 2 == 0:
+            amount_in = weth_balance // 4_000
+            amount_out = amount_in * bal_balance // (4 * weth_balance) * 998 // 1000
+            args = {'caller': USDC_ADDRESS, 'tokenIn': weth, 'tokenOut': bal, 'tokenAmountIn': amount_in, 'tokenAmountOut': amount_out}
+        else:
+            amount_in = bal_balance // 6_000
+            amount_out = amount_in * weth_balance * 4 // bal_balance * 998 // 1000
+            args = {'caller': USDC_ADDRESS, 'tokenIn': bal, 'tokenOut': weth, 'tokenAmountIn': amount_in, 'tokenAmountOut': amount_out}
+        node.add_log(_bpool, address, 'LOG_SWAP', block_number, args)
+
+
+def _balancer_v2_vault(node: SyntheticNode, address: str, pool_id: bytes, tokens: typing.List[typing.Tuple[str, int, int]]):
+    """
+    Registers the pool's tokens (address, decimals, balance; sorted by address) with the
+    vault, and swaps a little of the first token for the second (and back) in the observed range
+    """
+    addresses = [t for t, _, _ in tokens]
+    balances = [b for _, _, b in tokens]
+    node.set_call(_vault, BALANCER_VAULT_ADDRESS, 'getPoolTokens', [pool_id], [addresses, balances, BLOCK_NUMBER - 100])
+    for token, decimals, _ in tokens:
+        node.set_call(_erc20, token, 'decimals', [], [decimals])
+
+    for i, block_number in enumerate(_swap_blocks()):
+        token_in, token_out = (addresses[0], addresses[1]) if i % 2 == 0 else (addresses[1], addresses[0])
+        balance_in, balance_out = (balances[0], balances[1]) if i % 2 == 0 else (balances[1], balances[0])
+        amount_in = balance_in // 5_000
+        amount_out = balance_out // 5_000 * 99 // 100
+        node.add_log(_vault, BALANCER_VAULT_ADDRESS, 'Swap', block_number, {
+            'poolId': pool_id, 'tokenIn': token_in, 'tokenOut': token_out, 'amountIn': amount_in, 'amountOut': amount_out,
+        })
+
+
+def balancer_v2_weighted(node: SyntheticNode, address: str, pool_id: bytes):
+    """
+    A 50/50 WBTC/WETH Balancer v2 weighted pool with a 0.25% fee
+    """
+    _balancer_v2_vault(node, address, pool_id, [(WBTC_ADDRESS, 8, 1_000 * 10 ** 8), (WETH_ADDRESS, 18, 16_000 * 10 ** 18)])
+    node.set_call(_weighted, address, 'getNormalizedWeights', [], [[5 * 10 ** 17, 5 * 10 ** 17]])
+    node.set_call(_weighted, address, 'getSwapFeePercentage', [], [25 * 10 ** 14])
+
+
+def balancer_v2_lbp(node: SyntheticNode, address: str, pool_id: bytes):
+    """
+    A Balancer v2 liquidity bootstrapping pool selling a made-up token for WETH, with a 1% fee,
+    midway through moving its weights from 90/10 to 30/70 (token/WETH) over three days
+    """
+    tokens = sorted([(LBP_TOKEN_ADDRESS, 18, 20_000_000 * 10 ** 18), (WETH_ADDRESS, 18, 1_500 * 10 ** 18)], key=lambda x: bytes.fromhex(x[0][2:]))
+    _balancer_v2_vault(node, address, pool_id, tokens)
+    start_weights = [9 * 10 ** 17 if t == LBP_TOKEN_ADDRESS else 10 ** 17 for t, _, _ in tokens]
+    end_weights = [3 * 10 ** 17 if t == LBP_TOKEN_ADDRESS else 7 * 10 ** 17 for t, _, _ in tokens]
+    start_ts = TIMESTAMP - 36 * 60 * 60
+    end_ts = start_ts + 3 * 24 * 60 * 60
+
+    # end time, start time, end weights (4 x 16 bits), start weights (4 x 31 bits), 3 unused bits, swaps enabled
+    state = (end_ts << 224) | (start_ts << 192) | 1
+    for i, (sw, ew) in enumerate(zip(start_weights, end_weights)):
+        state |= compress(ew, 16) << (128 + 16 * i)
+        state |= compress(sw, 31) << (4 + 31 * i)
+    node.set_storage(address, 0xb, state)
+    node.set_call(_lbp, address, 'getSwapEnabled', [], [True])
+    node.set_call(_lbp, address, 'getSwapFeePercentage', [], [10 ** 16])
+
+
+def _pool_id(address: str, specialization: int, nonce: int) -> bytes:
+    return bytes.fromhex(address[2:]) + specialization.to_bytes(2, 'big') + nonce.to_bytes(10, 'big')
+
+
+POOLS = [
+    ('uniswap_v2_usdc_weth', 'UniswapV2Pricer', {
+        'address': '0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc',
+        'token0': USDC_ADDRESS,
+        'token1': WETH_ADDRESS,
+    }, lambda node, args: uniswap_v2(node, args['address'], 100_000_000 * 10 ** 6, 25_000 * 10 ** 18)),
+    ('uniswap_v3_usdc_weth_500', 'UniswapV3Pricer', {
+        'address': '0x88e6A0c2dDD26FEEb64F039a2c41296FcB3f5640',
+        'token0': USDC_ADDRESS,
+        'token1': WETH_ADDRESS,
+        'fee': 500,
+    }, lambda node, args: uniswap_v3(node, args['address'], args['fee'], 10)),
+    ('balancer_v1_bal_weth', 'BalancerPricer', {
+        'address': '0x59A19D8c652FA0284f44113D0ff9aBa70bd46fB4',
+    }, lambda node, args: balancer_v1(node, args['address'])),
+    ('balancer_v2_weighted', 'BalancerV2WeightedPoolPricer', {
+        'address': '0xA6F548DF93de924d73be7D25dC02554c6bD66dB5',
+        'pool_id': _pool_id('0xA6F548DF93de924d73be7D25dC02554c6bD66dB5', 2, 0xe).hex(),
+    }, lambda node, args: balancer_v2_weighted(node, args['address'], bytes.fromhex(args['pool_id']))),
+    ('balancer_v2_lbp', 'BalancerV2LiquidityBootstrappingPoolPricer', {
+        'address': LBP_ADDRESS,
+        'pool_id': _pool_id(LBP_ADDRESS, 1, 0x80).hex(),
+    }, lambda node, args: balancer_v2_lbp(node, args['address'], bytes.fromhex(args['pool_id']))),
+]
+
+
+def synthesize_smoke_corpus(fixture_dir: str, name: str):
+    """
+    A bench_detectors corpus of one profitable uniswap v2 circuit: two USDC/WETH pairs
+    whose prices differ by about 2.5%
+    """
+    prefix = os.path.join(fixture_dir, name)
+    if os.path.exists(prefix + '.rpc.jsonl.gz'):
+        # recordings are appended to
+        os.unlink(prefix + '.rpc.jsonl.gz')
+    recorder = RPCRecorder(prefix + '.rpc.jsonl.gz')
+    node = SyntheticNode(BLOCK_NUMBER + N_BLOCKS, recorder)
+    w3 = web3.Web3(node)
+
+    pairs = {
+        '0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc': (100_000_000 * 10 ** 6, 25_000 * 10 ** 18),
+        '0x397FF1542f962076d0BFE58eA045FfA2d347ACa0': (41_000_000 * 10 ** 6, 10_000 * 10 ** 18),
+    }
+    for address, (reserve0, reserve1) in pairs.items():
+        uniswap_v2(node, address, reserve0, reserve1, observe=False)
+
+    case = Case(
+        kind = 'uniswap_v2',
+        block_number = BLOCK_NUMBER,
+        timestamp = TIMESTAMP,
+        legs = [('UniswapV2Pricer', {'address': a, 'token0': USDC_ADDRESS, 'token1': WETH_ADDRESS}) for a in pairs],
+        directions = [(WETH_ADDRESS, USDC_ADDRESS), (USDC_ADDRESS, WETH_ADDRESS)],
+        optimum = 0,
+    )
+    case = case._replace(optimum = brute_force_optimum(make_circuit(w3, case), case))
+    save_corpus(prefix, name, [case], w3, recorder)
+
+
+def synthesize_seek_scenario(fixture_dir: str, name: str):
+    """
+    A bench_seek_candidates scenario over the observed range, on a pool of two USDC/WETH
+    uniswap v2 forks about 2.5% apart, a DAI/USDC/WETH triangle and a uniswap v3 pool
+    """
+    # logs must come from the node, not from a (real) archive of the same blocks
+    os.environ['LOG_ARCHIVE_DIR'] = ''
+
+    prefix = os.path.join(fixture_dir, name)
+    if os.path.exists(prefix + '.rpc.jsonl.gz'):
+        # recordings are appended to
+        os.unlink(prefix + '.rpc.jsonl.gz')
+    recorder = RPCRecorder(prefix + '.rpc.jsonl.gz')
+    node = SyntheticNode(BLOCK_NUMBER + N_BLOCKS + 1, recorder)
+    w3 = web3.Web3(node)
+
+    dai = web3.Web3.toChecksumAddress(DAI_ADDRESS)
+    origin_block = 10_000_000
+    pool = PricerPool(w3)
+    for method, address, token0, token1, reserve0, reserve1 in [
+            ('add_uniswap_v2', '0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc', USDC_ADDRESS, WETH_ADDRESS, 100_000_000 * 10 ** 6, 25_000 * 10 ** 18),
+            ('add_sushiswap_v2', '0x397FF1542f962076d0BFE58eA045FfA2d347ACa0', USDC_ADDRESS, WETH_ADDRESS, 41_000_000 * 10 ** 6, 10_000 * 10 ** 18),
+            ('add_uniswap_v2', '0xA478c2975Ab1Ea89e8196811F51A7B7Ade33eB11', dai, WETH_ADDRESS, 60_000_000 * 10 ** 18, 15_000 * 10 ** 18),
+            ('add_uniswap_v2', '0xAE461cA67B15dc8dc81CE7615e0320dA1A9aB8D5', dai, USDC_ADDRESS, 5_000_000 * 10 ** 18, 5_050_000 * 10 ** 6),
+        ]:
+        uniswap_v2(node, address, reserve0, reserve1)
+        getattr(pool, method)(address, token0, token1, origin_block)
+    uniswap_v3(node, '0x88e6A0c2dDD26FEEb64F039a2c41296FcB3f5640', 500, 10)
+    pool.add_uniswap_v3('0x88e6A0c2dDD26FEEb64F039a2c41296FcB3f5640', USDC_ADDRESS, WETH_ADDRESS, 500, origin_block)
+    save_pool(pool, prefix + '.pool.json.gz')
+
+    save_scenario(prefix, name, BLOCK_NUMBER + 1, BLOCK_NUMBER + N_BLOCKS, w3, recorder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the synthetic benchmark fixtures, without a node')
+    parser.add_argument('--fixture-dir', type=str, default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument('--only', type=str, nargs='*', default=None, help='Only build fixtures with these names')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    os.makedirs(args.fixture_dir, exist_ok=True)
+    for name, pricer_name, pricer_args, build in POOLS:
+        if args.only is not None and name not in args.only:
+            continue
+        node = SyntheticNode(BLOCK_NUMBER + N_BLOCKS)
+        build(node, pricer_args)
+        record_fixture(args.fixture_dir, name, pricer_name, pricer_args, BLOCK_NUMBER, TIMESTAMP, N_BLOCKS, N_AMOUNTS, make_provider=node.recording)
+
+    if args.only is None or 'smoke' in args.only:
+        synthesize_smoke_corpus(args.fixture_dir, 'smoke')
+
+    if args.only is None or 'seek_candidates_smoke' in args.only:
+        synthesize_seek_scenario(args.fixture_dir, 'seek_candidates_smoke')
+
+
+if __name__ == '__main__':
+    main()
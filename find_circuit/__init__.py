@@ -1,2 +1,4 @@
+from .catalog import CircuitCatalog
 from .find import FoundArbitrage, PricingCircuit
+from .log_price_graph import LogPriceGraph
 from .monitor import profitable_circuits
@@ -0,0 +1,253 @@
+"""
+find_circuit/catalog.py
+
+A precomputed catalog of all 2- and 3-length circuits through WETH,
+indexed by exchange, so that proposing circuits is a lookup.
+"""
+import array
+import itertools
+import sys
+import typing
+
+import logging
+import pricers
+from pricers.pricer_pool import PricerPoolListener
+from utils import WETH_ADDRESS
+from utils import profiling
+
+l = logging.getLogger(__name__)
+
+
+class CircuitCatalog(PricerPoolListener):
+    """
+    Enumerates every simple cycle of length 2 or 3 through WETH once, and keeps the
+    enumeration current as exchanges are added or their token sets change.
+
+    Circuits are stored in a canonical orientation:
+
+        length-2: (WETH -> X) (X -> WETH)
+        length-3: (WETH -> X) (X -> Y) (Y -> WETH), with X sorting before Y
+
+    as flat arrays of exchange and token indices. For length-2 circuits the third
+    exchange and the token Y are -1.
+
+    Removed circuits are tombstoned; the catalog is rebuilt once too many
+    tombstones accumulate.
+    """
+    _pool: pricers.PricerPool
+
+    _addresses: typing.List[str]
+    _address_idxs: typing.Dict[str, int]
+    _tokens: typing.List[str]
+    _token_idxs: typing.Dict[str, int]
+
+    _exchanges: array.array
+    _mids: array.array
+    _origin_blocks: array.array
+    _alive: bytearray
+    _n_dead: int
+    _by_exchange: typing.Dict[int, array.array]
+
+    def __init__(self, pool: pricers.PricerPool) -> None:
+        self._pool = pool
+        self._addresses = []
+        self._address_idxs = {}
+        self._tokens = []
+        self._token_idxs = {}
+        self.build()
+        pool.add_listener(self)
+
+    def __len__(self) -> int:
+        return len(self._alive) - self._n_dead
+
+    def build(self):
+        """
+        (Re)build the whole catalog from the pool's current topology.
+        """
+        self._exchanges = array.array('i')
+        self._mids = array.array('i')
+        self._origin_blocks = array.array('i')
+        self._alive = bytearray()
+        self._n_dead = 0
+        self._by_exchange = {}
+
+        weth_pairs = []
+        other_pairs = []
+        for pair, addresses in self._pool._token_pairs_to_pools.items():
+            if len(addresses) == 0:
+                continue
+            if WETH_ADDRESS in pair:
+                weth_pairs.append((pair, addresses))
+            else:
+                other_pairs.append((pair, addresses))
+
+        for (t0, t1), addresses in weth_pairs:
+            x = t1 if t0 == WETH_ADDRESS else t0
+            for a1, a2 in itertools.combinations(addresses, 2):
+                self._add(a1, a2, None, x, None)
+
+        for (x, y), addresses in other_pairs:
+            firsts = list(self._pool.get_exchanges_for_pair(WETH_ADDRESS, x))
+            if len(firsts) == 0:
+                continue
+            lasts = list(self._pool.get_exchanges_for_pair(WETH_ADDRESS, y))
+            for middle in addresses:
+                for first in firsts:
+                    if first == middle:
+                        continue
+                    for last in lasts:
+                        if last == middle or last == first:
+                            continue
+                        self._add(first, middle, last, x, y)
+
+        n_bytes = self.nbytes()
+        profiling.set_gauge('circuit_catalog.circuits', len(self))
+        profiling.set_gauge('circuit_catalog.bytes', n_bytes)
+        l.info(f'Built circuit catalog with {len(self):,} circuits ({n_bytes / (1024 * 1024):,.1f} MiB)')
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the catalog (the interned addresses and tokens are shared with the pool, and not counted)
+        """
+        ret = sum(sys.getsizeof(x) for x in (self._exchanges, self._mids, self._origin_blocks, self._alive, self._by_exchange))
+        ret += sum(sys.getsizeof(x) for x in self._by_exchange.values())
+        ret += sum(sys.getsizeof(x) for x in (self._addresses, self._address_idxs, self._tokens, self._token_idxs))
+        return ret
+
+    def on_tokens_changed(self, address: str, old_tokens: typing.Collection[str], new_tokens: typing.Collection[str]):
+        if len(old_tokens) > 0:
+            self._remove_exchange(address)
+        if len(new_tokens) > 1:
+            self._add_exchange(address, new_tokens)
+
+        if self._n_dead > 1_000 and self._n_dead > len(self):
+            self.build()
+
+    def circuits_for(
+            self,
+            pair: typing.Tuple[str, str],
+            address: str,
+            block_number: typing.Optional[int] = None
+        ) -> typing.Iterator[typing.Tuple[typing.Tuple[str, ...], typing.Tuple[typing.Tuple[str, str], ...]]]:
+        """
+        Yields (exchanges, directions) for every circuit that uses the exchange at address
+        to trade the given pair, optionally only where all exchanges exist as of block_number.
+        """
+        idx = self._address_idxs.get(address, None)
+        if idx is None or idx not in self._by_exchange:
+            return
+
+        for circuit_id in self._by_exchange[idx]:
+            if not self._alive[circuit_id]:
+                continue
+            if block_number is not None and self._origin_blocks[circuit_id] > block_number:
+                continue
+
+            exchanges, directions = self._get(circuit_id)
+            for exchange, (t_in, t_out) in zip(exchanges, directions):
+                if exchange == address:
+                    if t_in in pair and t_out in pair:
+                        yield exchanges, directions
+                    break
+
+    def _get(self, circuit_id: int) -> typing.Tuple[typing.Tuple[str, ...], typing.Tuple[typing.Tuple[str, str], ...]]:
+        i = circuit_id * 3
+        x = self._tokens[self._mids[circuit_id * 2]]
+        if self._exchanges[i + 2] < 0:
+            return (
+                (self._addresses[self._exchanges[i]], self._addresses[self._exchanges[i + 1]]),
+                ((WETH_ADDRESS, x), (x, WETH_ADDRESS)),
+            )
+        y = self._tokens[self._mids[circuit_id * 2 + 1]]
+        return (
+            tuple(self._addresses[self._exchanges[i + j]] for j in range(3)),
+            ((WETH_ADDRESS, x), (x, y), (y, WETH_ADDRESS)),
+        )
+
+    def _add_exchange(self, address: str, tokens: typing.Collection[str]):
+        """
+        Add all circuits using the (new) exchange at address, which the pool's indexes already include.
+        """
+        for t0, t1 in itertools.combinations(tokens, 2):
+            if WETH_ADDRESS in (t0, t1):
+                x = t1 if t0 == WETH_ADDRESS else t0
+
+                # as one of the legs of a 2-length circuit
+                for other in self._pool.get_exchanges_for_pair(WETH_ADDRESS, x):
+                    if other != address:
+                        self._add(address, other, None, x, None)
+
+                # as the first (or last) leg of a 3-length circuit
+                for middle in self._pool.get_exchanges_for(x):
+                    if middle == address:
+                        continue
+                    for y in self._pool.get_tokens_for(middle):
+                        if y == WETH_ADDRESS or y == x:
+                            continue
+                        for other in self._pool.get_exchanges_for_pair(WETH_ADDRESS, y):
+                            if other == address or other == middle:
+                                continue
+                            if _sorts_before(x, y):
+                                self._add(address, middle, other, x, y)
+                            else:
+                                self._add(other, middle, address, y, x)
+            else:
+                # as the middle leg of a 3-length circuit
+                x, y = (t0, t1) if _sorts_before(t0, t1) else (t1, t0)
+                lasts = list(self._pool.get_exchanges_for_pair(WETH_ADDRESS, y))
+                for first in self._pool.get_exchanges_for_pair(WETH_ADDRESS, x):
+                    if first == address:
+                        continue
+                    for last in lasts:
+                        if last == address or last == first:
+                            continue
+                        self._add(first, address, last, x, y)
+
+    def _remove_exchange(self, address: str):
+        idx = self._address_idxs.get(address, None)
+        if idx is None:
+            return
+        for circuit_id in self._by_exchange.pop(idx, []):
+            if self._alive[circuit_id]:
+                self._alive[circuit_id] = 0
+                self._n_dead += 1
+
+    def _add(self, a1: str, a2: str, a3: typing.Optional[str], x: str, y: typing.Optional[str]):
+        circuit_id = len(self._alive)
+        addresses = [a1, a2] if a3 is None else [a1, a2, a3]
+
+        origin_block = 0
+        for address in addresses:
+            idx = self._intern_address(address)
+            self._exchanges.append(idx)
+            if idx not in self._by_exchange:
+                self._by_exchange[idx] = array.array('i')
+            self._by_exchange[idx].append(circuit_id)
+            origin_block = max(origin_block, self._pool.origin_block_for(address))
+        if a3 is None:
+            self._exchanges.append(-1)
+
+        self._mids.append(self._intern_token(x))
+        self._mids.append(-1 if y is None else self._intern_token(y))
+        self._origin_blocks.append(origin_block)
+        self._alive.append(1)
+
+    def _intern_address(self, address: str) -> int:
+        ret = self._address_idxs.get(address, None)
+        if ret is None:
+            ret = len(self._addresses)
+            self._addresses.append(address)
+            self._address_idxs[address] = ret
+        return ret
+
+    def _intern_token(self, token: str) -> int:
+        ret = self._token_idxs.get(token, None)
+        if ret is None:
+            ret = len(self._tokens)
+            self._tokens.append(token)
+            self._token_idxs[token] = ret
+        return ret
+
+
+def _sorts_before(t0: str, t1: str) -> bool:
+    return bytes.fromhex(t0[2:]) < bytes.fromhex(t1[2:])
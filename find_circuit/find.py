@@ -10,7 +10,7 @@ import typing
 import logging
 import numpy as np
 import scipy.optimize
-from pricers.balancer import TooLittleInput
+from pricers.balancer import TokenNotAvailable, TooLittleInput
 import pricers.token_transfer
 from pricers.base import NotEnoughLiquidityException
 
@@ -24,6 +24,7 @@ from utils.profiling import profile, inc_measurement
 l = logging.getLogger(__name__)
 
 count_model_queries = 0
+count_pruned_by_bound = 0
 
 class FeeTransferCalculator:
 
@@ -39,8 +40,8 @@ DEFAULT_FEE_TRANSFER_CALCULATOR: FeeTransferCalculator = BuiltinFeeTransferCalcu
 
 class FoundArbitrage(typing.NamedTuple):
     amount_in: int
-    circuit: typing.List[pricers.base.BaseExchangePricer]
-    directions: typing.List[typing.Tuple[str, str]]
+    circuit: typing.Tuple[pricers.base.BaseExchangePricer, ...]
+    directions: typing.Tuple[typing.Tuple[str, str], ...]
     pivot_token: str
     profit: int
 
@@ -61,31 +62,31 @@ class FoundArbitrage(typing.NamedTuple):
         return f'<FoundArbitrage amount_in={self.amount_in} profit={self.profit} circuit=[{circuit_str}] directions=[{directions_str}]>'
 
 class PricingCircuit:
-    _circuit: typing.List[pricers.base.BaseExchangePricer]
-    _directions: typing.List[typing.Tuple[str, str]]
+    # immutable tuples, so they can be handed out (ie, to FoundArbitrage) without copying
+    __slots__ = ('_circuit', '_directions')
 
-    def __init__(self, _circuit: typing.List[pricers.base.BaseExchangePricer], _directions: typing.List[typing.Tuple[str, str]]) -> None:
+    _circuit: typing.Tuple[pricers.base.BaseExchangePricer, ...]
+    _directions: typing.Tuple[typing.Tuple[str, str], ...]
+
+    def __init__(self, _circuit: typing.Sequence[pricers.base.BaseExchangePricer], _directions: typing.Sequence[typing.Tuple[str, str]]) -> None:
         assert len(_circuit) == len(_directions)
-        self._circuit = _circuit
-        self._directions = _directions
+        self._circuit = tuple(_circuit)
+        self._directions = tuple(_directions)
 
     @property
     def pivot_token(self) -> str:
         return self._directions[0][0]
 
     @property
-    def circuit(self) -> typing.List[pricers.base.BaseExchangePricer]:
-        return list(self._circuit)
+    def circuit(self) -> typing.Tuple[pricers.base.BaseExchangePricer, ...]:
+        return self._circuit
 
     @property
-    def directions(self) -> typing.List[typing.Tuple[str, str]]:
-        return list(self._directions)
+    def directions(self) -> typing.Tuple[typing.Tuple[str, str], ...]:
+        return self._directions
 
     def copy(self) -> 'PricingCircuit':
-        return PricingCircuit(
-            self.circuit.copy(),
-            self.directions.copy()
-        )
+        return PricingCircuit(self._circuit, self._directions)
 
     def sample(
             self,
@@ -174,20 +175,130 @@ class PricingCircuit:
 
         return new_mp * transfer_fee
 
+    def profit_upper_bound(
+            self,
+            block_identifier: int,
+            timestamp: typing.Optional[int] = None,
+        ) -> float:
+        """
+        Cheaply upper-bound the profit (in the pivot token) this circuit could make, without searching.
+
+        Marginal prices only get worse as more goes in, so for any amount_in the output is at most
+        P * amount_in, where P is the product of the spot prices; it is also at most C, the smallest
+        leg's reserve of its output token carried to the end of the circuit at spot prices.
+        Together these bound the profit by C * (P - 1) / P.
+
+        Transfer fees only reduce the output, so the bound holds with them as well (up to float rounding).
+
+        Reserves are only read as already known to the pricers (this makes no balance queries);
+        if any is unknown the bound is infinite.
+        """
+        spots = []
+        reserves = []
+        try:
+            for p, (t_in, t_out) in zip(self._circuit, self._directions):
+                _, spot = p.token_out_for_exact_in(t_in, t_out, 0, block_identifier, timestamp=timestamp)
+                reserve = p.get_known_value_locked(t_out)
+                if reserve is None:
+                    return math.inf
+                spots.append(spot)
+                reserves.append(reserve)
+        except (NotEnoughLiquidityException, TooLittleInput, TokenNotAvailable, ZeroDivisionError):
+            # cannot say anything useful
+            return math.inf
+
+        return _profit_bound(spots, reserves)
+
+    def known_profit_upper_bound(self) -> typing.Optional[float]:
+        """
+        Same as profit_upper_bound(), but only from the spot prices and reserves the pricers
+        already know, so it never queries the node; None if any is not known.
+        """
+        spots = []
+        reserves = []
+        for p, (t_in, t_out) in zip(self._circuit, self._directions):
+            spot = p.get_known_spot_price(t_in, t_out)
+            reserve = p.get_known_value_locked(t_out)
+            if spot is None or reserve is None:
+                return None
+            spots.append(spot)
+            reserves.append(reserve)
+        return _profit_bound(spots, reserves)
+
     def rotate(self):
         """
         Rotate the cycle once, to use a new pivot token
         """
-        self._circuit = self._circuit[1:] + [self._circuit[0]]
-        self._directions = self._directions[1:] + [self._directions[0]]
+        self._circuit = self._circuit[1:] + self._circuit[:1]
+        self._directions = self._directions[1:] + self._directions[:1]
 
     def flip(self):
         """
         Flip the cycle in the alternate direction
         a -> b -> c  ==> c -> b -> a
         """
-        self._circuit = list(reversed(self._circuit))
-        self._directions = list((t2, t1) for (t1, t2) in reversed(self._directions))
+        self._circuit = self._circuit[::-1]
+        self._directions = tuple((t2, t1) for (t1, t2) in reversed(self._directions))
+
+    def orientations(self, pivot_token: typing.Optional[str] = None) -> typing.Iterator['PricingCircuit']:
+        """
+        Each rotation of the cycle, each followed by its flip, without modifying this circuit.
+        If pivot_token is given, only orientations that start (and end) at that token are
+        produced; the others are never built.
+        """
+        for i, (t_in, _) in enumerate(self._directions):
+            if pivot_token is not None and t_in != pivot_token:
+                continue
+            if i == 0:
+                circuit, directions = self._circuit, self._directions
+                yield self
+            else:
+                circuit = self._circuit[i:] + self._circuit[:i]
+                directions = self._directions[i:] + self._directions[:i]
+                yield self._oriented(circuit, directions)
+            yield self._oriented(circuit[::-1], tuple((t2, t1) for (t1, t2) in reversed(directions)))
+
+    def _oriented(self, circuit: typing.Tuple[pricers.base.BaseExchangePricer, ...], directions: typing.Tuple[typing.Tuple[str, str], ...]) -> 'PricingCircuit':
+        """
+        A circuit over the same exchanges in another orientation (see orientations())
+        """
+        ret = PricingCircuit.__new__(PricingCircuit)
+        ret._circuit = circuit
+        ret._directions = directions
+        return ret
+
+
+def _profit_bound(spots: typing.List[float], reserves: typing.List[int]) -> float:
+    """
+    The bound of PricingCircuit.profit_upper_bound(), given each leg's spot price and reserve of its output token
+    """
+    price = math.prod(spots)
+    if price <= 1:
+        return 0.0
+
+    capacity = math.inf
+    carry = 1.0
+    for spot, reserve in zip(reversed(spots), reversed(reserves)):
+        capacity = min(capacity, reserve * carry)
+        carry *= spot
+
+    return capacity * (price - 1) / price
+
+
+def orientations_to_search(
+        pc: PricingCircuit,
+        only_weth_pivot: bool,
+        try_all_directions: bool,
+    ) -> typing.Iterable[PricingCircuit]:
+    """
+    The orientations of the circuit a detector searches: every rotation and direction (only those
+    pivoting on WETH, if only_weth_pivot), or if not try_all_directions just the circuit as given
+    """
+    if try_all_directions:
+        return pc.orientations(WETH_ADDRESS if only_weth_pivot else None)
+    if only_weth_pivot and pc.pivot_token != WETH_ADDRESS:
+        return ()
+    return (pc,)
 
 
 def detect_arbitrages_bisection(
@@ -197,196 +308,206 @@ def detect_arbitrages_bisection(
         only_weth_pivot = False,
         try_all_directions = True,
         fee_transfer_calculator: FeeTransferCalculator = DEFAULT_FEE_TRANSFER_CALCULATOR,
+        min_profit: int = 0,
     ) -> typing.List[FoundArbitrage]:
+    """
+    Find the optimal amount_in for each rotation and direction of the circuit (see
+    orientations_to_search); pc itself is left as-is.
+
+    If min_profit is set, orientations whose profit_upper_bound() falls below it are
+    not searched (and so arbitrages with profit below min_profit may be omitted).
+    """
+    global count_pruned_by_bound
     ret = []
 
     t_start = time.time()
 
-    # for each rotation
-    for _ in range(len(pc._circuit) if try_all_directions else 1):
+    # for each rotation and direction
+    for oriented in orientations_to_search(pc, only_weth_pivot, try_all_directions):
         def run_exc(i):
             amt_in = math.ceil(i)
-            price_ratio = pc.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+            price_ratio = oriented.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
             return price_ratio - 1
 
-        # try each direction
-        for _ in range(2 if try_all_directions else 1):
-
-            if not (only_weth_pivot and pc.pivot_token != WETH_ADDRESS):
-                # quickly try pushing 100 tokens -- if unprofitable, fail
+        # quickly try pushing 100 tokens -- if unprofitable, fail
 
-                with profile('pricing.quick_check'):
+        with profile('pricing.quick_check'):
+            try:
+                for quick_test_amount_in_zeros in range(5, 25): # start quick test at about 10^-10 dollars (July '22)
+                    quick_test_amount_in = 10 ** quick_test_amount_in_zeros
                     try:
-                        for quick_test_amount_in_zeros in range(5, 25): # start quick test at about 10^-10 dollars (July '22)
-                            quick_test_amount_in = 10 ** quick_test_amount_in_zeros
-                            try:
-                                quick_test_pr = pc.sample_new_price_ratio(quick_test_amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                                break
-                            except TooLittleInput:
-                                # try the next largest amount
-                                continue
-                        else:
-                            # exhausted quick_test_amount_in options -- probably there's no way to pump enough liquidity
-                            # to this exchange just yet
-                            continue
-                    except NotEnoughLiquidityException:
-                        # not profitable most likely
+                        quick_test_pr = oriented.sample_new_price_ratio(quick_test_amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                        break
+                    except TooLittleInput:
+                        # try the next largest amount
                         continue
+                else:
+                    # exhausted quick_test_amount_in options -- probably there's no way to pump enough liquidity
+                    # to this exchange just yet
+                    continue
+            except NotEnoughLiquidityException:
+                # not profitable most likely
+                continue
+
+        if quick_test_pr > 1 and min_profit > 0:
+            with profile('pricing.prune_bound'):
+                bound = oriented.profit_upper_bound(block_identifier, timestamp=timestamp)
+            if bound < min_profit:
+                count_pruned_by_bound += 1
+                continue
+
+        with profile('pricing.optimize'):
+            if quick_test_pr > 1:
+                # this may be profitable
+
+                # search for crossing-point where liquidity does not run out
+                lower_bound = quick_test_amount_in
+                upper_bound = (100_000 * (10 ** 18)) # a shit-ton of ether
+
+                with profile('pricing.optimize.bounds.upper'):
+                    upper_bound = find_upper_bound(oriented, lower_bound, upper_bound, block_identifier, fee_transfer_calculator, timestamp=timestamp)
+
+                out_lower_bound = oriented.sample(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                out_upper_bound = oriented.sample(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+
+                if out_upper_bound < 100:
+                    # haven't managed to get anything out with the most money we can pump through, abandon
+                    continue
+
+                if out_lower_bound < 100:
+                    # search for crossing-point where (some) positive tokens come out of lower bound
+                    lower_bound_search_upper = upper_bound
+                    with profile('pricing.optimize.bounds.lower'):
+                        while lower_bound < lower_bound_search_upper - 1000:
+                            midpoint = (lower_bound + lower_bound_search_upper) // 2
+                            midpoint_out = oriented.sample(midpoint, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                            if midpoint_out < 100:
+                                lower_bound = midpoint
+                            else:
+                                lower_bound_search_upper = midpoint
+                                out_lower_bound = midpoint_out
+                        lower_bound = lower_bound_search_upper
+
+                assert lower_bound <= upper_bound, f'expect {lower_bound} <= {upper_bound}'
+
+                # NOTE: it may be the case here that out_lower_bound - lower_bound < 0
+                # i.e, the lower bound is not profitable. This can occur if there is significant
+                # input required to get the first units of output produced -- those are essentially a flat
+                # fee which pushes the pricing "parabola" downward
+
+                mp_lower_bound = oriented.sample_new_price_ratio(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                mp_upper_bound = oriented.sample_new_price_ratio(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+
+                if mp_lower_bound < 1:
+                    amount_in = lower_bound
+                elif mp_upper_bound > 1:
+                    amount_in = upper_bound
+                else:
+                    if mp_lower_bound <= mp_upper_bound:
+                        # about to fail, dump info
+                        for p, (t_in, t_out) in zip(oriented.circuit, oriented.directions):
+                            l.critical(type(p).__name__, p.address, t_in, t_out)
+                        with open('/mnt/goldphish/pts.txt', mode='w') as fout:
+                            for amt_in in np.linspace(lower_bound, upper_bound, 200):
+                                amt_in = int(np.ceil(amt_in))
+                                profit = oriented.sample(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amt_in
+                                price = oriented.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, debug=True, fee_transfer_calculator=fee_transfer_calculator)
+                                fout.write(f'{amt_in},{profit},{price}\n')
+                        l.critical(f'lower_bound {lower_bound}')
+                        l.critical(f'upper_bound {upper_bound}')
+                        l.critical(f'mp_lower_bound {mp_lower_bound}')
+                        l.critical(f'mp_upper_bound {mp_upper_bound}')
+                    assert mp_lower_bound > mp_upper_bound
+                    assert 1 < mp_lower_bound
+
+                    # the root (marginal price = 1) lies somewhere within the bounds
+                    with profiling.profile('pricing.optimize.root_find'):
+                        # guess is linear midpoint between the two
+                        # (y - y1) = m (x - x1) solve for x where y = 1
+                        # 1 - y1 = m (x - x1)
+                        # (1 - y1) / m = x - x1
+                        # (1 - y1) / m + x1 = x
+
+                        # cast upper bound to float so we can ensure it is STRICTLY LESS THAN the int val
+                        fl_upper_bound = float(upper_bound)
+                        while math.ceil(fl_upper_bound) > upper_bound:
+                            fl_upper_bound *= 0.99999999999999
+
+                        fl_lower_bound = float(lower_bound)
+                        while math.ceil(fl_lower_bound) < lower_bound:
+                            fl_lower_bound *= 1.00000000000001
+
+                        if fl_lower_bound < fl_upper_bound:
+                            try:
+                                result = scipy.optimize.root_scalar(
+                                    f = run_exc,
+                                    bracket = (
+                                        fl_lower_bound,
+                                        fl_upper_bound,
+                                    ),
+                                )
+                                amount_in = math.ceil(result.root)
+                            except ValueError:
+                                # probably the upper bound is juuuuust above 1 -- use that as amount_in
+                                mp_fl_upper_bound = oriented.sample_new_price_ratio(math.ceil(fl_upper_bound), block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
+                                if mp_fl_upper_bound > 1:
+                                    amount_in = math.ceil(mp_fl_upper_bound)
+                                else:
+                                    # this should not happen, log generously if it does
+                                    mp_fl_lower_bound = oriented.sample_new_price_ratio(math.ceil(fl_lower_bound), block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
 
-                with profile('pricing.optimize'):
-                    if quick_test_pr > 1:
-                        # this may be profitable
-
-                        # search for crossing-point where liquidity does not run out
-                        lower_bound = quick_test_amount_in
-                        upper_bound = (100_000 * (10 ** 18)) # a shit-ton of ether
-
-                        with profile('pricing.opti6mize.bounds.upper'):
-                            upper_bound = find_upper_bound(pc, lower_bound, upper_bound, block_identifier, fee_transfer_calculator, timestamp=timestamp)
-
-                        out_lower_bound = pc.sample(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                        out_upper_bound = pc.sample(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-
-                        if out_upper_bound < 100:
-                            # haven't managed to get anything out with the most money we can pump through, abandon
-                            continue
-
-                        if out_lower_bound < 100:
-                            # search for crossing-point where (some) positive tokens come out of lower bound
-                            lower_bound_search_upper = upper_bound
-                            with profile('pricing.optimize.bounds.lower'):
-                                while lower_bound < lower_bound_search_upper - 1000:
-                                    midpoint = (lower_bound + lower_bound_search_upper) // 2
-                                    midpoint_out = pc.sample(midpoint, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                                    if midpoint_out < 100:
-                                        lower_bound = midpoint
-                                    else:
-                                        lower_bound_search_upper = midpoint
-                                        out_lower_bound = midpoint_out
-                                lower_bound = lower_bound_search_upper
-
-                        assert lower_bound <= upper_bound, f'expect {lower_bound} <= {upper_bound}'
-
-                        # NOTE: it may be the case here that out_lower_bound - lower_bound < 0
-                        # i.e, the lower bound is not profitable. This can occur if there is significant
-                        # input required to get the first units of output produced -- those are essentially a flat
-                        # fee which pushes the pricing "parabola" downward
-
-                        mp_lower_bound = pc.sample_new_price_ratio(lower_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                        mp_upper_bound = pc.sample_new_price_ratio(upper_bound, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-
-                        if mp_lower_bound < 1:
-                            amount_in = lower_bound
-                        elif mp_upper_bound > 1:
-                            amount_in = upper_bound
-                        else:
-                            if mp_lower_bound <= mp_upper_bound:
-                                # about to fail, dump info
-                                for p, (t_in, t_out) in zip(pc.circuit, pc.directions):
-                                    l.critical(type(p).__name__, p.address, t_in, t_out)
-                                with open('/mnt/goldphish/pts.txt', mode='w') as fout:
-                                    for amt_in in np.linspace(lower_bound, upper_bound, 200):
-                                        amt_in = int(np.ceil(amt_in))
-                                        profit = pc.sample(amt_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amt_in
-                                        price = pc.sample_new_price_ratio(amt_in, block_identifier, timestamp=timestamp, debug=True, fee_transfer_calculator=fee_transfer_calculator)
-                                        fout.write(f'{amt_in},{profit},{price}\n')
-                                l.critical(f'lower_bound {lower_bound}')
-                                l.critical(f'upper_bound {upper_bound}')
-                                l.critical(f'mp_lower_bound {mp_lower_bound}')
-                                l.critical(f'mp_upper_bound {mp_upper_bound}')
-                            assert mp_lower_bound > mp_upper_bound
-                            assert 1 < mp_lower_bound
-
-                            # the root (marginal price = 1) lies somewhere within the bounds
-                            with profiling.profile('pricing.optimize.root_find'):
-                                # guess is linear midpoint between the two
-                                # (y - y1) = m (x - x1) solve for x where y = 1
-                                # 1 - y1 = m (x - x1)
-                                # (1 - y1) / m = x - x1
-                                # (1 - y1) / m + x1 = x
-
-                                # cast upper bound to float so we can ensure it is STRICTLY LESS THAN the int val
-                                fl_upper_bound = float(upper_bound)
-                                while math.ceil(fl_upper_bound) > upper_bound:
-                                    fl_upper_bound *= 0.99999999999999
-
-                                fl_lower_bound = float(lower_bound)
-                                while math.ceil(fl_lower_bound) < lower_bound:
-                                    fl_lower_bound *= 1.00000000000001
-
-                                if fl_lower_bound < fl_upper_bound:
-                                    try:
-                                        result = scipy.optimize.root_scalar(
-                                            f = run_exc,
-                                            bracket = (
-                                                fl_lower_bound,
-                                                fl_upper_bound,
-                                            ),
-                                        )
-                                        amount_in = math.ceil(result.root)
-                                    except ValueError:
-                                        # probably the upper bound is juuuuust above 1 -- use that as amount_in
-                                        mp_fl_upper_bound = pc.sample_new_price_ratio(math.ceil(fl_upper_bound), block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-                                        if mp_fl_upper_bound > 1:
-                                            amount_in = math.ceil(mp_fl_upper_bound)
-                                        else:
-                                            # this should not happen, log generously if it does
-                                            mp_fl_lower_bound = pc.sample_new_price_ratio(math.ceil(fl_lower_bound), block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator)
-
-                                            l.critical('about to fail')
-                                            for p in pc._circuit:
-                                                l.critical(str(p))
+                                    l.critical('about to fail')
+                                    for p in oriented._circuit:
+                                        l.critical(str(p))
     
-                                            l.critical(f"fl_upper_bound {fl_upper_bound}")
-                                            l.critical(f'fl_lower_bound {fl_lower_bound}')
-                                            l.critical(f'mp_lower_bound {mp_fl_lower_bound}')
-                                            l.critical(f'mp_upper_bound {mp_fl_upper_bound}')
-                                            l.critical(f'upper_bound {upper_bound}')
-                                            l.critical(f'lower_bound {lower_bound}')
-                                            l.critical(f'block_identifier {block_identifier}')
-                                            raise
-                                else:
-                                    l.warning('fl_lower_bound crossed fl_upper_bound')
-                                    amount_in = math.ceil(fl_lower_bound)
-
-                        expected_profit = pc.sample(amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amount_in
-
-                        # quickly reduce input amount (optimizes for rounding)
-                        input_reduction = 0
-                        first_token_in, first_token_out = pc.directions[0]
-                        first_out_normal, _ = pc.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in, block_identifier=block_identifier)
-
-                        with profile('pricing.optimize.reduce_input'):
-                            for i in range(0, 21):
-                                attempting_reduction = 10 ** i
-                                if attempting_reduction >= amount_in:
-                                    break
-
-                                try:
-                                    out_reduced, _ = pc.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in - attempting_reduction, block_identifier=block_identifier)
-                                except NotEnoughLiquidityException:
-                                    l.critical(f'Ran out of liquidity while sampling {amount_in - attempting_reduction} on {pc.circuit[0].address}')
+                                    l.critical(f"fl_upper_bound {fl_upper_bound}")
+                                    l.critical(f'fl_lower_bound {fl_lower_bound}')
+                                    l.critical(f'mp_lower_bound {mp_fl_lower_bound}')
+                                    l.critical(f'mp_upper_bound {mp_fl_upper_bound}')
+                                    l.critical(f'upper_bound {upper_bound}')
+                                    l.critical(f'lower_bound {lower_bound}')
+                                    l.critical(f'block_identifier {block_identifier}')
                                     raise
-
-                                if first_out_normal == out_reduced:
-                                    input_reduction = attempting_reduction
-                                else:
-                                    break
-
-                            amount_in -= input_reduction
-                            expected_profit += input_reduction
-
-                        if expected_profit > 0:
-                            to_add = FoundArbitrage(
-                                amount_in   = amount_in,
-                                directions  = pc.directions,
-                                circuit     = pc.circuit,
-                                pivot_token = pc.pivot_token,
-                                profit      = expected_profit,
-                            )
-                            ret.append(to_add)
-            pc.flip()
-        pc.rotate()
+                        else:
+                            l.warning('fl_lower_bound crossed fl_upper_bound')
+                            amount_in = math.ceil(fl_lower_bound)
+
+                expected_profit = oriented.sample(amount_in, block_identifier, timestamp=timestamp, fee_transfer_calculator=fee_transfer_calculator) - amount_in
+
+                # quickly reduce input amount (optimizes for rounding)
+                input_reduction = 0
+                first_token_in, first_token_out = oriented.directions[0]
+                first_out_normal, _ = oriented.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in, block_identifier=block_identifier)
+
+                with profile('pricing.optimize.reduce_input'):
+                    for i in range(0, 21):
+                        attempting_reduction = 10 ** i
+                        if attempting_reduction >= amount_in:
+                            break
+
+                        try:
+                            out_reduced, _ = oriented.circuit[0].token_out_for_exact_in(first_token_in, first_token_out, amount_in - attempting_reduction, block_identifier=block_identifier)
+                        except NotEnoughLiquidityException:
+                            l.critical(f'Ran out of liquidity while sampling {amount_in - attempting_reduction} on {oriented.circuit[0].address}')
+                            raise
+
+                        if first_out_normal == out_reduced:
+                            input_reduction = attempting_reduction
+                        else:
+                            break
+
+                    amount_in -= input_reduction
+                    expected_profit += input_reduction
+
+                if expected_profit > 0:
+                    to_add = FoundArbitrage(
+                        amount_in   = amount_in,
+                        directions  = oriented.directions,
+                        circuit     = oriented.circuit,
+                        pivot_token = oriented.pivot_token,
+                        profit      = expected_profit,
+                    )
+                    ret.append(to_add)
 
     if all(isinstance(x, UniswapV2Pricer) for x in pc._circuit):
         inc_measurement(f'optimize_uv2_{len(pc._circuit)}', time.time() - t_start)
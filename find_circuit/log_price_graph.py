@@ -0,0 +1,248 @@
+"""
+find_circuit/log_price_graph.py
+
+Maintains a log-price graph over the exchanges in a PricerPool and searches it
+for negative cycles (ie, marginally profitable circuits) of bounded length.
+"""
+import math
+import typing
+
+import logging
+import pricers
+from pricers.balancer import TokenNotAvailable, TooLittleInput
+from pricers.base import BaseExchangePricer, NotEnoughLiquidityException
+from utils import WETH_ADDRESS
+from utils.profiling import profile
+
+from .find import PricingCircuit
+
+l = logging.getLogger(__name__)
+
+# Key for a single directed edge: (exchange address, token_in, token_out)
+EdgeKey = typing.Tuple[str, str, str]
+
+# A hop-limited Bellman-Ford layer: token -> (distance, predecessor token, exchange used to get here)
+_Layer = typing.Dict[str, typing.Tuple[float, typing.Optional[str], typing.Optional[str]]]
+
+
+class LogPriceGraph:
+    """
+    Directed graph over tokens, where each exchange contributes one edge per
+    direction per token pair, weighted by -log(spot price after fee).
+
+    A cycle with negative total weight has a product of spot prices above 1, so
+    pushing a small amount of the pivot around it is profitable. Such cycles are
+    handed to the exact optimizer as PricingCircuits.
+
+    Edge weights are loaded lazily from the pricers and cached until the
+    exchange is reported as modified via `observe()`; thus `observe()` must see
+    the modified pairs of EVERY block, in order, or the cached weights go stale.
+    """
+    _pool: pricers.PricerPool
+    _weights: typing.Dict[EdgeKey, float]
+    _changed: typing.List[EdgeKey]
+
+    def __init__(
+            self,
+            pool: pricers.PricerPool,
+            max_cycle_length: int = 4,
+            min_cycle_length: int = 2,
+            pivot_token: str = WETH_ADDRESS,
+            edge_filter: typing.Optional[typing.Callable[[BaseExchangePricer, int], bool]] = None,
+        ) -> None:
+        """
+        edge_filter, if given, is called as edge_filter(pricer, block_number); exchanges
+        for which it returns False contribute no edges (ie, monitor.meets_thresholds)
+        """
+        assert 2 <= min_cycle_length <= max_cycle_length
+        self._pool = pool
+        self.max_cycle_length = max_cycle_length
+        self.min_cycle_length = min_cycle_length
+        self.pivot_token = pivot_token
+        self._edge_filter = edge_filter
+        self._weights = {}
+        self._changed = []
+
+    def observe(self, modified_pairs: typing.Dict[typing.Tuple[str, str], typing.List[str]]):
+        """
+        Invalidate the edges of the given (modified) pairs, and remember them as the
+        neighborhood to search on the next call to `find_cycles()`.
+        """
+        self._changed = []
+        for (token0, token1), addresses in modified_pairs.items():
+            for address in addresses:
+                for t_in, t_out in [(token0, token1), (token1, token0)]:
+                    k = (address, t_in, t_out)
+                    self._weights.pop(k, None)
+                    self._changed.append(k)
+
+    def weight(self, address: str, token_in: str, token_out: str, block_number: int, timestamp: typing.Optional[int] = None) -> float:
+        """
+        Get the weight of the given edge, -log(marginal price after fee), or infinity
+        if the edge cannot be traded (or is filtered out).
+        """
+        k = (address, token_in, token_out)
+        ret = self._weights.get(k, None)
+        if ret is not None:
+            return ret
+
+        ret = math.inf
+        pricer = self._pool.get_pricer_for(address)
+        if self._edge_filter is None or self._edge_filter(pricer, block_number):
+            try:
+                _, spot = pricer.token_out_for_exact_in(token_in, token_out, 0, block_number, timestamp=timestamp)
+                if spot > 0:
+                    ret = -math.log(spot)
+            except (NotEnoughLiquidityException, TooLittleInput, TokenNotAvailable, ZeroDivisionError):
+                pass
+
+        self._weights[k] = ret
+        return ret
+
+    def find_cycles(self, block_number: int, timestamp: typing.Optional[int] = None) -> typing.Iterator[PricingCircuit]:
+        """
+        Find negative cycles through the pivot token that use at least one of the edges
+        changed in the last `observe()`.
+
+        For each changed edge (u -> v) this runs two hop-limited Bellman-Ford searches,
+        forward from v and backward from u, where the pivot may only appear as an endpoint.
+        Only tokens whose distance improved in the previous layer are relaxed (as in SPFA),
+        so the search stays in the neighborhood of the changed edge.
+
+        The cycles are all found before the first is yielded, so that the profiling span
+        covers only the search, not whatever the caller does with each cycle.
+        """
+        found: typing.List[PricingCircuit] = []
+        with profile('propose-circuit.negative_cycles'):
+            seen = set()
+            for address, u, v in self._changed:
+                w = self.weight(address, u, v, block_number, timestamp)
+                if math.isinf(w):
+                    continue
+
+                max_hops = self.max_cycle_length - 1
+                if v == self.pivot_token:
+                    fwd = [{v: (0.0, None, None)}]
+                else:
+                    fwd = self._layers(v, address, max_hops, block_number, timestamp, reverse=False)
+                if u == self.pivot_token:
+                    bwd = [{u: (0.0, None, None)}]
+                else:
+                    bwd = self._layers(u, address, max_hops, block_number, timestamp, reverse=True)
+
+                for n_fwd, layer_fwd in enumerate(fwd):
+                    if self.pivot_token not in layer_fwd:
+                        continue
+                    d_fwd = layer_fwd[self.pivot_token][0]
+
+                    for n_bwd, layer_bwd in enumerate(bwd):
+                        length = n_fwd + n_bwd + 1
+                        if length > self.max_cycle_length:
+                            break
+                        if length < self.min_cycle_length or self.pivot_token not in layer_bwd:
+                            continue
+                        d_bwd = layer_bwd[self.pivot_token][0]
+
+                        if d_bwd + w + d_fwd >= 0:
+                            continue
+
+                        # pivot -> ... -> u
+                        head = _unwind(bwd, n_bwd, self.pivot_token, reverse=True)
+                        # v -> ... -> pivot
+                        tail = _unwind(fwd, n_fwd, self.pivot_token, reverse=False)
+                        legs = head + [(address, u, v)] + tail
+
+                        pc = self._to_circuit(legs)
+                        if pc is None:
+                            continue
+
+                        k = tuple(sorted(legs))
+                        if k in seen:
+                            continue
+                        seen.add(k)
+                        found.append(pc)
+
+        yield from found
+
+    def _layers(
+            self,
+            source: str,
+            exclude_address: str,
+            max_hops: int,
+            block_number: int,
+            timestamp: typing.Optional[int],
+            reverse: bool
+        ) -> typing.List[_Layer]:
+        """
+        Hop-limited Bellman-Ford from source. Layer k holds the lightest k-hop path to each
+        token (or, if reverse, from each token to source). The pivot token is terminal.
+        """
+        ret: typing.List[_Layer] = [{source: (0.0, None, None)}]
+        best: typing.Dict[str, float] = {source: 0.0}
+
+        for _ in range(max_hops):
+            layer: _Layer = {}
+            for token, (dist, _, _) in ret[-1].items():
+                if token == self.pivot_token:
+                    continue
+                for address in self._pool.get_exchanges_for(token, block_number):
+                    if address == exclude_address:
+                        continue
+                    for other_token in self._pool.get_tokens_for(address):
+                        if other_token == token:
+                            continue
+                        if reverse:
+                            w = self.weight(address, other_token, token, block_number, timestamp)
+                        else:
+                            w = self.weight(address, token, other_token, block_number, timestamp)
+                        new_dist = dist + w
+                        if math.isinf(new_dist):
+                            continue
+                        # a path that is no lighter than one using fewer hops is dominated
+                        if new_dist >= best.get(other_token, math.inf) and other_token != self.pivot_token:
+                            continue
+                        if other_token in layer and layer[other_token][0] <= new_dist:
+                            continue
+                        layer[other_token] = (new_dist, token, address)
+            if len(layer) == 0:
+                break
+            for token, (dist, _, _) in layer.items():
+                best[token] = min(best.get(token, math.inf), dist)
+            ret.append(layer)
+
+        return ret
+
+    def _to_circuit(self, legs: typing.List[EdgeKey]) -> typing.Optional[PricingCircuit]:
+        """
+        Convert the list of legs to a PricingCircuit, or None if the cycle is not simple
+        """
+        if len(set(address for address, _, _ in legs)) != len(legs):
+            return None
+        if len(set(t_in for _, t_in, _ in legs)) != len(legs):
+            return None
+
+        # rotate so that the pivot comes first
+        i = next(i for i, (_, t_in, _) in enumerate(legs) if t_in == self.pivot_token)
+        legs = legs[i:] + legs[:i]
+
+        return PricingCircuit(
+            [self._pool.get_pricer_for(address) for address, _, _ in legs],
+            [(t_in, t_out) for _, t_in, t_out in legs],
+        )
+
+
+def _unwind(layers: typing.List[_Layer], n_hops: int, token: str, reverse: bool) -> typing.List[EdgeKey]:
+    """
+    Reconstruct the path ending at (or, if reverse, starting from) token after n_hops
+    """
+    ret = []
+    for k in range(n_hops, 0, -1):
+        _, pred, address = layers[k][token]
+        if reverse:
+            ret.append((address, token, pred))
+        else:
+            ret.append((address, pred, token))
+        token = pred
+    if not reverse:
+        ret.reverse()
+    return ret
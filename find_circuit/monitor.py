@@ -3,6 +3,7 @@ find_circuit/monitor.py
 
 Monitors arbitrage opportunities over time.
 """
+import itertools
 import time
 import typing
 
@@ -15,10 +16,13 @@ from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2Liquidity
 from pricers.balancer_v2.weighted_pool import BalancerV2WeightedPoolPricer
 
 from pricers.base import BaseExchangePricer
+from pricers.pricer_pool import PricerPoolListener
 import utils
 from utils.profiling import profile
 
 from .find import PricingCircuit, FoundArbitrage, detect_arbitrages_bisection
+from .catalog import CircuitCatalog
+from .log_price_graph import LogPriceGraph
 
 from utils import TETHER_ADDRESS, UNI_ADDRESS, USDC_ADDRESS, WBTC_ADDRESS, WETH_ADDRESS
 
@@ -45,9 +49,32 @@ def profitable_circuits(
         timestamp: typing.Optional[int] = None,
         only_weth_pivot = False,
         detection_func = detect_arbitrages_bisection,
+        cycle_graph: typing.Optional[LogPriceGraph] = None,
+        circuit_catalog: typing.Optional[CircuitCatalog] = None,
+        threshold_index: typing.Optional['ThresholdIndex'] = None,
+        time_budget_seconds: typing.Optional[float] = None,
     ) -> typing.Iterator[FoundArbitrage]:
+    """
+    Finds profitable arbitrages among the circuits affected by the modified pairs.
+
+    If cycle_graph is given it must be passed on every block; it is used to propose
+    longer circuits (found as negative cycles) in addition to the 2- and 3-length ones.
+
+    If circuit_catalog is given, the 2- and 3-length circuits are looked up from it
+    rather than enumerated; if threshold_index is given, it is used in place of
+    meets_thresholds.
+
+    If time_budget_seconds is given, runs in 'anytime' mode: all circuits are proposed
+    up-front, then searched in order of decreasing estimated profit until the budget
+    (measured from the start of this call) runs out.
+    """
+    t_deadline = None if time_budget_seconds is None else time.time() + time_budget_seconds
+    queued: typing.List[PricingCircuit] = []
     elapsed = 0
-    it_pcs = propose_circuits(modified_pairs_last_block, pool, block_number)
+    it_pcs = propose_circuits(modified_pairs_last_block, pool, block_number, circuit_catalog=circuit_catalog, threshold_index=threshold_index)
+    if cycle_graph is not None:
+        cycle_graph.observe(modified_pairs_last_block)
+        it_pcs = itertools.chain(it_pcs, cycle_graph.find_cycles(block_number, timestamp=timestamp))
     circuits_considered = set()
 
     while True:
@@ -68,7 +95,7 @@ def profitable_circuits(
 
             # generate a unique key for this circuit to ensure we don't have to explore it more than once
             # since the detector works both forward, backward, and in all rotations.
-            # Since we only deal with cycles of length 3 or 2, we disambiguate rotations of a cycle by simply
+            # Since circuits are simple cycles, we disambiguate rotations (and flips) of a cycle by simply
             # sorting the items.
             k = []
             for p, (t_in, t_out) in zip(item._circuit, item._directions):
@@ -80,27 +107,119 @@ def profitable_circuits(
                 # duplicate, don't bother
                 continue
             circuits_considered.add(k)
+            utils.profiling.inc_count('propose-circuit.circuits')
 
             elapsed += time.time() - t_start
-            yield from detection_func(item, block_number, timestamp = timestamp, only_weth_pivot = only_weth_pivot)
+            if t_deadline is None:
+                yield from detection_func(item, block_number, timestamp = timestamp, only_weth_pivot = only_weth_pivot)
+            else:
+                queued.append(item)
         except StopIteration:
             break
     utils.profiling.inc_measurement('propose-circuit', elapsed)
 
+    if t_deadline is not None:
+        yield from _detect_anytime(queued, block_number, timestamp, only_weth_pivot, detection_func, t_deadline)
+
+
+def _detect_anytime(
+        pcs: typing.List[PricingCircuit],
+        block_number: int,
+        timestamp: typing.Optional[int],
+        only_weth_pivot: bool,
+        detection_func,
+        t_deadline: float,
+    ) -> typing.Iterator[FoundArbitrage]:
+    """
+    Run detection on the most promising circuits first, stopping once past the deadline.
+    """
+    with profile('propose-circuit.anytime_score'):
+        scores = [_estimate_score(pc) for pc in pcs]
+        # circuits whose state is not known yet rank with the median promising one (after those known
+        # to score as well, and before those known to be unprofitable)
+        positive = sorted(s for s in scores if s is not None and s > 0)
+        neutral = positive[(len(positive) - 1) // 2] if len(positive) > 0 else 0.0
+        keys = [(neutral, 1) if s is None else (s, 2 if s > 0 else 0) for s in scores]
+    order = sorted(range(len(pcs)), key=lambda i: keys[i], reverse=True)
+
+    n_skipped = 0
+    for n_done, i in enumerate(order):
+        if time.time() > t_deadline:
+            n_skipped = len(order) - n_done
+            break
+        yield from detection_func(pcs[i], block_number, timestamp = timestamp, only_weth_pivot = only_weth_pivot)
+
+    utils.profiling.inc_count('anytime.circuits', len(pcs))
+    utils.profiling.inc_count('anytime.circuits_skipped', n_skipped)
+    if n_skipped > 0:
+        l.debug(f'Ran out of time in block {block_number:,}, skipped {n_skipped:,} of {len(pcs):,} circuits')
+
+
+def _estimate_score(pc: PricingCircuit) -> typing.Optional[float]:
+    """
+    Estimate how much profit the circuit could make, as the better of its two directions'
+    profit upper-bound (spot-price gap times liquidity), from what the pricers already know;
+    None if that is not enough. Makes no node queries, as they would eat into the time budget.
+    """
+    ret = None
+    # the circuit as given, then flipped
+    for oriented in itertools.islice(pc.orientations(), 2):
+        bound = oriented.known_profit_upper_bound()
+        if bound is None:
+            return None
+        ret = bound if ret is None else max(ret, bound)
+    return ret
+
 
 
 def propose_circuits(
         modified_pairs_last_block: typing.Dict[typing.Tuple[str, str], typing.List[str]],
         pool: pricers.PricerPool,
-        block_number: int
+        block_number: int,
+        circuit_catalog: typing.Optional[CircuitCatalog] = None,
+        threshold_index: typing.Optional['ThresholdIndex'] = None,
     ) -> typing.Iterator[PricingCircuit]:
     """
     Proposes arbitrage circuits to test for profitability.
 
     """
+    thresholds_func = meets_thresholds if threshold_index is None else threshold_index.meets_thresholds
+
     for pair, addresses in modified_pairs_last_block.items():
         for address in addresses:
-            yield from _propose_circuits_pair(pair, address, pool, block_number)
+            if circuit_catalog is not None and not TMP_FIXUP_REMOVE_ME:
+                yield from _propose_circuits_pair_catalog(pair, address, pool, block_number, circuit_catalog, thresholds_func)
+            else:
+                yield from _propose_circuits_pair(pair, address, pool, block_number, thresholds_func)
+
+
+def _propose_circuits_pair_catalog(
+        pair: typing.Tuple[str, str],
+        address: str,
+        pool: pricers.PricerPool,
+        block_number: int,
+        circuit_catalog: CircuitCatalog,
+        meets_thresholds: typing.Callable[[BaseExchangePricer, int], bool],
+    ) -> typing.Iterator[PricingCircuit]:
+    """
+    Same as _propose_circuits_pair, but looks up the circuits from the catalog.
+    """
+    pricer = pool.get_pricer_for(address)
+    if not meets_thresholds(pricer, block_number):
+        return
+
+    for exchanges, directions in circuit_catalog.circuits_for(pair, address, block_number):
+        circuit = []
+        for exchange in exchanges:
+            if exchange == address:
+                circuit.append(pricer)
+                continue
+            other_pricer = pool.get_pricer_for(exchange)
+            if not meets_thresholds(other_pricer, block_number):
+                break
+            circuit.append(other_pricer)
+        else:
+            yield PricingCircuit(circuit, directions)
 
 
 def _propose_circuits_pair(
@@ -108,6 +227,7 @@ def _propose_circuits_pair(
         address: str,
         pool: pricers.PricerPool,
         block_number: int,
+        meets_thresholds: typing.Callable[[BaseExchangePricer, int], bool],
     ) -> typing.Iterator[PricingCircuit]:
     # There are several situations here.
 
@@ -228,3 +348,51 @@ def meets_thresholds(pricer: BaseExchangePricer, block_identifier: int) -> bool:
             if bal < THRESHOLDS[t]:
                 return False
         return True
+
+
+class ThresholdIndex(PricerPoolListener):
+    """
+    Caches the result of meets_thresholds() for each exchange.
+
+    The status is recomputed from the pricer's locally-known balances whenever the
+    pool observes a block with logs for that exchange (Sync reserves, Uniswap v3
+    Swap/Mint/Burn amounts, Balancer joins/exits/swaps), so checking it needs no
+    node queries. Statuses that cannot be recomputed locally are dropped, and get
+    queried once on their next lookup.
+    """
+    _pool: pricers.PricerPool
+    _status: typing.Dict[str, bool]
+
+    def __init__(self, pool: pricers.PricerPool) -> None:
+        self._pool = pool
+        self._status = {}
+        pool.add_listener(self)
+
+    def meets_thresholds(self, pricer: BaseExchangePricer, block_identifier: int) -> bool:
+        ret = self._status.get(pricer.address, None)
+        if ret is None:
+            ret = meets_thresholds(pricer, block_identifier)
+            self._status[pricer.address] = ret
+        return ret
+
+    def on_tokens_changed(self, address: str, old_tokens: typing.Collection[str], new_tokens: typing.Collection[str]):
+        self._status.pop(address, None)
+
+    def on_block_observed(self, block_number: int, observed: typing.List[BaseExchangePricer]):
+        for pricer in observed:
+            status = True
+            for t in self._pool.get_tokens_for(pricer.address):
+                if t not in THRESHOLDS:
+                    continue
+                bal = pricer.get_known_value_locked(t)
+                if bal is None:
+                    status = None
+                    break
+                if bal < THRESHOLDS[t]:
+                    status = False
+                    break
+
+            if status is None:
+                self._status.pop(pricer.address, None)
+            else:
+                self._status[pricer.address] = status
@@ -67,6 +67,8 @@ class BalancerPricer(BaseExchangePricer):
                         LOG_JOIN_TOPIC, LOG_EXIT_TOPIC, LOG_SWAP_TOPIC, \
                     ]
 
+    __slots__ = ('finalized', 'tokens', 'swap_fee', 'token_denorms', '_public_swap', '_balance_cache')
+
     w3: web3.Web3
     finalized: typing.Optional[bool]
     tokens: typing.Optional[typing.Set[str]]
@@ -254,6 +256,9 @@ class BalancerPricer(BaseExchangePricer):
 
         return self.get_balance(token_address, block_identifier)
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        return self._balance_cache.get(token_address, None)
+
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
         _tot_weight = 0
         for t in self.get_tokens(block_identifier):
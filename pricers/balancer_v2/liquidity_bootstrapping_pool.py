@@ -105,6 +105,8 @@ def get_interpolated_value(start_value: int, end_value: int, start_time: int, en
 
 
 class BalancerV2LiquidityBootstrappingPoolPricer(BaseExchangePricer):
+    __slots__ = ('vault', 'contract', 'pool_id', '_balance_cache', 'swap_fee', 'swap_enabled', 'tokens', 'pool_state')
+
     w3: web3.Web3
     address: str
     vault: web3.contract.Contract
@@ -292,6 +294,9 @@ class BalancerV2LiquidityBootstrappingPoolPricer(BaseExchangePricer):
 
         return self.get_balance(token_address, block_identifier)
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        return self._balance_cache.get(token_address, None)
+
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
         norm = self.get_token_weight(token_address, block_identifier)
         return decimal.Decimal(norm) / decimal.Decimal(ONE)
@@ -21,6 +21,8 @@ _pool: web3.contract.Contract = web3.Web3().eth.contract(address=b'\x00'*20, abi
 SWAP_FEE_CHANGED_TOPIC = event_abi_to_log_topic(_pool.events.SwapFeePercentageChanged().abi)
 
 class BalancerV2WeightedPoolPricer(BaseExchangePricer):
+    __slots__ = ('vault', 'contract', 'pool_id', '_balance_cache', 'swap_fee', 'tokens', 'token_weights')
+
     w3: web3.Web3
     address: str
     vault: web3.contract.Contract
@@ -172,6 +174,9 @@ class BalancerV2WeightedPoolPricer(BaseExchangePricer):
 
         return self.get_balance(token_address, block_identifier)
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        return self._balance_cache.get(token_address, None)
+
     def get_token_weight(self, token_address: str, _: int) -> decimal.Decimal:
         norm = self.token_weights[token_address]
 
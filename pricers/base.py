@@ -24,6 +24,9 @@ class NotEnoughLiquidityException(Exception):
         return f'<NotEnoughLiquidityException amount_in={self.amount_in} amount_remaining={self.remaining}>'
 
 class BaseExchangePricer:
+    # hundreds of thousands of pricers live in a worker, so they (and subclasses) use slots
+    __slots__ = ('w3', 'address')
+
     w3: web3.Web3
     address: str
 
@@ -36,6 +39,21 @@ class BaseExchangePricer:
     def get_value_locked(self, token_address: str, block_identifier: int) -> int:
         raise NotImplementedError()
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        """
+        Gets the value locked as currently known to this pricer, without querying
+        the node; returns None if it is not known.
+        """
+        return None
+
+    def get_known_spot_price(self, token_in: str, token_out: str) -> typing.Optional[float]:
+        """
+        Gets the spot price (after fee) as currently known to this pricer, as in
+        token_out_for_exact_in() with zero input, without querying the node; returns
+        None if it is not known.
+        """
+        return None
+
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
         raise NotImplementedError()
 
@@ -4,10 +4,12 @@ import typing
 import time
 import logging
 import os
+import weakref
 import web3
 import web3.contract
 import web3.types
 
+from utils import memory
 from utils.profiling import profile, inc_measurement
 from pricers.balancer import BalancerPricer
 from pricers.balancer_v2.liquidity_bootstrapping_pool import BalancerV2LiquidityBootstrappingPoolPricer
@@ -16,7 +18,7 @@ from pricers.block_observation_result import BlockObservationResult
 from utils import get_abi, BALANCER_VAULT_ADDRESS, get_block_timestamp
 from .base import BaseExchangePricer
 from .uniswap_v2 import UniswapV2Pricer
-from .uniswap_v3 import UniswapV3Pricer
+from .uniswap_v3 import TickCache, UniswapV3Pricer
 from .token_balance_changing_logs import CACHE_INVALIDATING_TOKEN_LOGS
 
 import cachetools
@@ -38,6 +40,26 @@ class MyLRUCacher(cachetools.LRUCache):
 
 _pool_id = 0
 
+
+class PricerPoolListener:
+    """
+    Receives notifications when the pool's exchanges (or their tokens) change.
+    """
+
+    def on_tokens_changed(self, address: str, old_tokens: typing.Collection[str], new_tokens: typing.Collection[str]):
+        """
+        Called after the exchange at address was added (old_tokens is empty) or
+        its token set was changed, once the pool's indexes reflect the change.
+        """
+        pass
+
+    def on_block_observed(self, block_number: int, observed: typing.List[BaseExchangePricer]):
+        """
+        Called after the given pricers observed logs in block_number.
+        """
+        pass
+
+
 class PricerPool:
     """
     Contains a pool of pricers and some utility methods.
@@ -66,6 +88,7 @@ class PricerPool:
     _cache_misses: int
     _last_stat_log_ts: float
     _balancer_v2_vault: web3.contract.Contract
+    _listeners: typing.List[PricerPoolListener]
 
     def __init__(self, w3: web3.Web3, tmpdir: typing.Optional[str] = None) -> None:
         global _pool_id
@@ -101,11 +124,28 @@ class PricerPool:
         self._cache_misses = 0
         self._last_stat_log_ts = time.time()
         self._origin_blocks = {}
+        self._monitored_addresses = set([BALANCER_VAULT_ADDRESS])
+        self._listeners = []
         self._balancer_v2_vault = w3.eth.contract(
             address=BALANCER_VAULT_ADDRESS,
             abi=get_abi('balancer_v2/Vault.json'),
         )
 
+        # weakly, so that reporting does not keep the pool alive
+        ref = weakref.ref(self)
+        memory.register_cache('pricer_pool_cache', lambda: getattr(ref(), '_cache', None))
+        memory.register_cache('pricer_pool_evictable_cache', lambda: getattr(ref(), '_evictable_cache', None))
+        memory.register_cache('pricer_pool_v3_tick_caches', lambda: ref() and ref()._v3_tick_caches())
+        if tmpdir is not None:
+            memory.register_dir('pricer_pool_leveldb', lambda: my_dir if ref() is not None else None)
+
+    def _v3_tick_caches(self) -> typing.List[TickCache]:
+        """
+        The tick caches of the uniswap v3 pricers in memory
+        """
+        pricers = list(self._cache.values()) + list(self._evictable_cache.values())
+        return [p.tick_cache for p in pricers if isinstance(p, UniswapV3Pricer)]
+
     def clear(self):
         """
         Reset the pricer pool
@@ -113,19 +153,19 @@ class PricerPool:
         self._evictable_cache.clear()
         self._cache.clear()
 
+    def add_listener(self, listener: PricerPoolListener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: PricerPoolListener):
+        self._listeners.remove(listener)
+
     def monitored_addresses(self) -> typing.Set[str]:
         """
-        Gets all addresses which must be monitored for logs
+        Gets all addresses which must be monitored for logs.
+
+        This is the pool's own (live) set, kept up to date as exchanges are added; do not modify it.
         """
-        ret = set()
-        ret.update(self._uniswap_v2_pools.keys())
-        ret.update(self._sushiswap_v2_pools.keys())
-        ret.update(self._shibaswap_pools.keys())
-        ret.update(self._uniswap_v3_pools.keys())
-        ret.update(self._balancer_v1_pools.keys())
-        ret.update(self._balancer_v2_pools.keys())
-        ret.add(BALANCER_VAULT_ADDRESS)
-        return ret
+        return self._monitored_addresses
 
     def add_uniswap_v2(self, address: str, token0: str, token1: str, origin_block: int):
         """
@@ -137,10 +177,13 @@ class PricerPool:
         assert origin_block > 0 # sanity check
         assert bytes.fromhex(token0[2:]) < bytes.fromhex(token1[2:])
         self._uniswap_v2_pools[address] = (token0, token1)
+        self._monitored_addresses.add(address)
         self._token_to_pools[token0].append(address)
         self._token_to_pools[token1].append(address)
         self._token_pairs_to_pools[(token0, token1)].append(address)
         self._origin_blocks[address] = origin_block
+        for listener in self._listeners:
+            listener.on_tokens_changed(address, (), (token0, token1))
 
     def add_sushiswap_v2(self, address: str, token0: str, token1: str, origin_block: int):
         """
@@ -152,10 +195,13 @@ class PricerPool:
         assert origin_block > 0 # sanity check
         assert bytes.fromhex(token0[2:]) < bytes.fromhex(token1[2:])
         self._sushiswap_v2_pools[address] = (token0, token1)
+        self._monitored_addresses.add(address)
         self._token_to_pools[token0].append(address)
         self._token_to_pools[token1].append(address)
         self._token_pairs_to_pools[(token0, token1)].append(address)
         self._origin_blocks[address] = origin_block
+        for listener in self._listeners:
+            listener.on_tokens_changed(address, (), (token0, token1))
 
     def add_shibaswap(self, address: str, token0: str, token1: str, origin_block: int):
         """
@@ -167,10 +213,13 @@ class PricerPool:
         assert origin_block > 0 # sanity check
         assert bytes.fromhex(token0[2:]) < bytes.fromhex(token1[2:])
         self._shibaswap_pools[address] = (token0, token1)
+        self._monitored_addresses.add(address)
         self._token_to_pools[token0].append(address)
         self._token_to_pools[token1].append(address)
         self._token_pairs_to_pools[(token0, token1)].append(address)
         self._origin_blocks[address] = origin_block
+        for listener in self._listeners:
+            listener.on_tokens_changed(address, (), (token0, token1))
 
     def add_uniswap_v3(self, address: str, token0: str, token1: str, fee: int, origin_block: int):
         """
@@ -183,10 +232,13 @@ class PricerPool:
         assert bytes.fromhex(token0[2:]) < bytes.fromhex(token1[2:])
         assert origin_block > 0
         self._uniswap_v3_pools[address] = (token0, token1, fee)
+        self._monitored_addresses.add(address)
         self._token_to_pools[token0].append(address)
         self._token_to_pools[token1].append(address)
         self._token_pairs_to_pools[(token0, token1)].append(address)
         self._origin_blocks[address] = origin_block
+        for listener in self._listeners:
+            listener.on_tokens_changed(address, (), (token0, token1))
 
     def add_balancer_v1(self, address: str, origin_block: int):
         """
@@ -194,6 +246,7 @@ class PricerPool:
         """
         assert web3.Web3.isChecksumAddress(address)
         self._balancer_v1_pools[address] = []
+        self._monitored_addresses.add(address)
         self._origin_blocks[address] = origin_block
 
     def add_balancer_v2(self, address: str, pool_id: bytes, pool_type: str, origin_block: int):
@@ -204,9 +257,28 @@ class PricerPool:
 
         assert web3.Web3.isChecksumAddress(address)
         self._balancer_v2_pools[address] = ([], pool_id, pool_type)
+        self._monitored_addresses.add(address)
         self._origin_blocks[address] = origin_block
         self._balancer_v2_pool_id_to_addr[pool_id] = address
 
+    def exchange_specs(self) -> typing.Iterator[typing.Tuple[str, typing.Tuple]]:
+        """
+        Yields (add_* method name, args) for every exchange in the pool, in the order
+        load_pool adds them; calling those on an empty pool rebuilds this one.
+        """
+        for address, (token0, token1) in self._uniswap_v2_pools.items():
+            yield 'add_uniswap_v2', (address, token0, token1, self._origin_blocks[address])
+        for address, (token0, token1, fee) in self._uniswap_v3_pools.items():
+            yield 'add_uniswap_v3', (address, token0, token1, fee, self._origin_blocks[address])
+        for address, (token0, token1) in self._sushiswap_v2_pools.items():
+            yield 'add_sushiswap_v2', (address, token0, token1, self._origin_blocks[address])
+        for address, (token0, token1) in self._shibaswap_pools.items():
+            yield 'add_shibaswap', (address, token0, token1, self._origin_blocks[address])
+        for address in self._balancer_v1_pools:
+            yield 'add_balancer_v1', (address, self._origin_blocks[address])
+        for address, (_, pool_id, pool_type) in self._balancer_v2_pools.items():
+            yield 'add_balancer_v2', (address, pool_id, pool_type, self._origin_blocks[address])
+
     def warm(self, block_identifier: int):
         """
         Warm cache in prep for scrape starting at given block
@@ -259,6 +331,7 @@ class PricerPool:
             old_tokens, _, _ = self._balancer_v2_pools[address]
         else:
             raise NotImplementedError(f'not sure how to handle {address}')
+        previous_tokens = list(old_tokens)
 
         # remove from self._token_pairs_to_pools
         for t0 in old_tokens:
@@ -285,6 +358,9 @@ class PricerPool:
         old_tokens.clear()
         old_tokens.extend(tokens)
 
+        for listener in self._listeners:
+            listener.on_tokens_changed(address, previous_tokens, old_tokens)
+
     def get_exchanges_for(self, token_address: str, block_number: typing.Optional[int] = None) -> typing.Iterable[str]:
         """
         Gets an iterable over all exchange addresses that pair this token.
@@ -384,6 +460,11 @@ class PricerPool:
             for pair in result.pair_prices_updated:
                 ret[pair].append(p.address)
 
+        if len(self._listeners) > 0:
+            observed = [p for p, _ in update_results]
+            for listener in self._listeners:
+                listener.on_block_observed(block_number, observed)
+
         return dict(ret)
 
         # For now -- do not care about misbehaving tokens that change balances
@@ -29,6 +29,8 @@ RESERVES_SLOT = '0x0000000000000000000000000000000000000000000000000000000000000
 class UniswapV2Pricer(BaseExchangePricer):
     RELEVANT_LOGS = [UNIV2_SYNC_EVENT_TOPIC]
 
+    __slots__ = ('token0', 'token1', 'known_token0_bal', 'known_token1_bal')
+
     w3: web3.Web3
     address: str
     token0: str
@@ -77,17 +79,18 @@ class UniswapV2Pricer(BaseExchangePricer):
         else:
             raise NotImplementedError()
 
-        if new_reserve_out == 0:
-            spot = 0
-        else:
-            # how much out do we get for 1 unit in?
-            # https://github.com/Uniswap/v2-periphery/blob/master/contracts/libraries/UniswapV2Library.sol#L43
-            amount_in_with_fee = 1 * 997
-            numerator = amount_in_with_fee * new_reserve_out
-            denominator = new_reserve_in * 1_000 + amount_in_with_fee
-            spot = numerator / denominator
+        return (amt_out, self._spot(new_reserve_in, new_reserve_out))
 
-        return (amt_out, spot)
+    @staticmethod
+    def _spot(reserve_in: int, reserve_out: int) -> float:
+        if reserve_out == 0:
+            return 0
+        # how much out do we get for 1 unit in?
+        # https://github.com/Uniswap/v2-periphery/blob/master/contracts/libraries/UniswapV2Library.sol#L43
+        amount_in_with_fee = 1 * 997
+        numerator = amount_in_with_fee * reserve_out
+        denominator = reserve_in * 1_000 + amount_in_with_fee
+        return numerator / denominator
 
     def exact_token0_to_token1(self, token0_amount, block_identifier: int) -> int:
         # based off https://github.com/Uniswap/v2-periphery/blob/master/contracts/libraries/UniswapV2Library.sol#L43
@@ -140,6 +143,22 @@ class UniswapV2Pricer(BaseExchangePricer):
 
         raise Exception(f'Do not know about token {token_address} in {self.address}')
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        if token_address == self.token0:
+            return self.known_token0_bal
+        elif token_address == self.token1:
+            return self.known_token1_bal
+        return None
+
+    def get_known_spot_price(self, token_in: str, token_out: str) -> typing.Optional[float]:
+        if self.known_token0_bal is None or self.known_token1_bal is None:
+            return None
+        if token_in == self.token0 and token_out == self.token1:
+            return self._spot(self.known_token0_bal, self.known_token1_bal)
+        elif token_in == self.token1 and token_out == self.token0:
+            return self._spot(self.known_token1_bal, self.known_token0_bal)
+        raise NotImplementedError()
+
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
         return decimal.Decimal('0.5')
 
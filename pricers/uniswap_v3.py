@@ -1,3 +1,5 @@
+import array
+import bisect
 import decimal
 import typing
 import web3
@@ -19,6 +21,97 @@ Tick = typing.NamedTuple('Tick', [
     ('initialized', bool)
 ])
 
+_LO_MASK = (1 << 64) - 1
+
+
+class TickCache:
+    """
+    The known ticks of a pool, as a mapping of tick index to Tick.
+
+    Stored as parallel arrays sorted by tick index, with the (128-bit) liquidities
+    split into high and low 64-bit halves: about 40 bytes a tick, where a dict of
+    Tick tuples takes about 200. Ticks are built on read.
+    """
+    __slots__ = ('_ids', '_gross_hi', '_gross_lo', '_net_hi', '_net_lo', '_initialized')
+
+    def __init__(self) -> None:
+        self._ids = array.array('i')
+        self._gross_hi = array.array('Q')
+        self._gross_lo = array.array('Q')
+        self._net_hi = array.array('q')
+        self._net_lo = array.array('Q')
+        self._initialized = bytearray()
+
+    def _find(self, tick: int) -> int:
+        i = bisect.bisect_left(self._ids, tick)
+        if i < len(self._ids) and self._ids[i] == tick:
+            return i
+        return -1
+
+    def _at(self, i: int) -> Tick:
+        return Tick(
+            self._ids[i],
+            liquidity_gross = (self._gross_hi[i] << 64) | self._gross_lo[i],
+            liquidity_net = (self._net_hi[i] << 64) | self._net_lo[i],
+            initialized = self._initialized[i] != 0,
+        )
+
+    def get(self, tick: int, default: typing.Optional[Tick] = None) -> typing.Optional[Tick]:
+        i = self._find(tick)
+        if i < 0:
+            return default
+        return self._at(i)
+
+    def __getitem__(self, tick: int) -> Tick:
+        i = self._find(tick)
+        if i < 0:
+            raise KeyError(tick)
+        return self._at(i)
+
+    def __setitem__(self, tick: int, value: Tick):
+        # check everything before touching the arrays, so a failed set leaves them in step
+        if not -(1 << 31) <= tick < (1 << 31):
+            raise OverflowError(f'tick {tick} out of range')
+        if not 0 <= value.liquidity_gross < (1 << 128):
+            raise OverflowError(f'liquidity_gross {value.liquidity_gross} out of range for uint128')
+        if not -(1 << 127) <= value.liquidity_net < (1 << 127):
+            raise OverflowError(f'liquidity_net {value.liquidity_net} out of range for int128')
+        gross_hi, gross_lo = value.liquidity_gross >> 64, value.liquidity_gross & _LO_MASK
+        net_hi, net_lo = value.liquidity_net >> 64, value.liquidity_net & _LO_MASK
+        i = bisect.bisect_left(self._ids, tick)
+        if i < len(self._ids) and self._ids[i] == tick:
+            self._gross_hi[i] = gross_hi
+            self._gross_lo[i] = gross_lo
+            self._net_hi[i] = net_hi
+            self._net_lo[i] = net_lo
+            self._initialized[i] = value.initialized
+        else:
+            self._ids.insert(i, tick)
+            self._gross_hi.insert(i, gross_hi)
+            self._gross_lo.insert(i, gross_lo)
+            self._net_hi.insert(i, net_hi)
+            self._net_lo.insert(i, net_lo)
+            self._initialized.insert(i, value.initialized)
+
+    def __contains__(self, tick: int) -> bool:
+        return self._find(tick) >= 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._ids)
+
+    def keys(self) -> typing.Iterator[int]:
+        return iter(self._ids)
+
+    def values(self) -> typing.Iterator[Tick]:
+        return (self._at(i) for i in range(len(self._ids)))
+
+    def items(self) -> typing.Iterator[typing.Tuple[int, Tick]]:
+        return ((self._ids[i], self._at(i)) for i in range(len(self._ids)))
+
+
 generic_uv3 = web3.Web3().eth.contract(
     address = b'\x00' * 20,
     abi = get_abi('uniswap_v3/IUniswapV3Pool.json')['abi'],
@@ -38,6 +131,11 @@ class UniswapV3Pricer(BaseExchangePricer):
     MIN_SQRT_RATIO = 4295128739
     MAX_SQRT_RATIO = 1461446703485210103287273052203988822378723970342
 
+    __slots__ = (
+        'token0', 'token1', 'fee', 'tick_spacing', 'tick_cache', 'tick_bitmap_cache', 'slot0_cache',
+        'liquidity_cache', 'last_block_observed', 'known_token0_balance', 'known_token1_balance',
+    )
+
     w3: web3.Web3
     address: str
     contract: web3.contract.Contract
@@ -45,7 +143,7 @@ class UniswapV3Pricer(BaseExchangePricer):
     token1: str
     fee: int
     tick_spacing: int
-    tick_cache: typing.Dict[int, Tick]
+    tick_cache: TickCache
     tick_bitmap_cache: typing.Dict[int, int]
     slot0_cache: typing.Optional[typing.Tuple[int, int]]
     liquidity_cache: typing.Optional[int]
@@ -70,7 +168,7 @@ class UniswapV3Pricer(BaseExchangePricer):
             10_000: 200,
         }[fee]
         self.set_web3(w3)
-        self.tick_cache = {}
+        self.tick_cache = TickCache()
         self.tick_bitmap_cache = {}
         self.slot0_cache = None
         self.liquidity_cache = None
@@ -175,18 +273,7 @@ class UniswapV3Pricer(BaseExchangePricer):
         (sqrt_price_x96, tick) = self.get_slot0(block_identifier)
 
         if amount_specified == 0:
-            if zero_for_one:
-                price = sqrt_price_x96 * sqrt_price_x96 / (1 << 192)
-            else:
-                if sqrt_price_x96 == 0:
-                    # not initialized, cannot buy anything for any price
-                    price = 0.0
-                else:
-                    price = (1 << 192) / (sqrt_price_x96 * sqrt_price_x96)
-
-            price *= (10 ** 6 - self.fee) / (10 ** 6)
-
-            return (0, 0, price)
+            return (0, 0, self._spot(sqrt_price_x96, zero_for_one))
 
         if sqrt_price_x96 == 0:
             # this is not initialized; you cannot get any token out
@@ -543,7 +630,8 @@ class UniswapV3Pricer(BaseExchangePricer):
         assert UniswapV3Pricer.MIN_TICK <= tick
         assert tick <= UniswapV3Pricer.MAX_TICK
 
-        if not use_cache or tick not in self.tick_cache:
+        ret = self.tick_cache.get(tick) if use_cache else None
+        if ret is None:
 
             if isinstance(block_identifier, int):
                 block_identifier_encoded = hex(block_identifier)
@@ -572,14 +660,15 @@ class UniswapV3Pricer(BaseExchangePricer):
             bresp_1 = bytes.fromhex(resp[1]['result'][2:])
             initialized = bool(bresp_1[0])
 
-            self.tick_cache[tick] = Tick(
+            ret = Tick(
                 tick,
                 liquidity_gross=liquidity_gross,
                 liquidity_net=liquidity_net,
                 initialized=initialized
             )
+            self.tick_cache[tick] = ret
 
-        return self.tick_cache[tick]
+        return ret
 
     @staticmethod
     def least_significant_bit(x: int) -> int:
@@ -865,6 +954,35 @@ class UniswapV3Pricer(BaseExchangePricer):
 
         return bal
 
+    def get_known_value_locked(self, token_address: str) -> typing.Optional[int]:
+        if token_address == self.token0:
+            return self.known_token0_balance
+        elif token_address == self.token1:
+            return self.known_token1_balance
+        return None
+
+    def get_known_spot_price(self, token_in: str, token_out: str) -> typing.Optional[float]:
+        if self.slot0_cache is None:
+            return None
+        if token_in == self.token0 and token_out == self.token1:
+            return self._spot(self.slot0_cache[0], True)
+        elif token_in == self.token1 and token_out == self.token0:
+            return self._spot(self.slot0_cache[0], False)
+        raise NotImplementedError()
+
+    def _spot(self, sqrt_price_x96: int, zero_for_one: bool) -> float:
+        if zero_for_one:
+            price = sqrt_price_x96 * sqrt_price_x96 / (1 << 192)
+        else:
+            if sqrt_price_x96 == 0:
+                # not initialized, cannot buy anything for any price
+                price = 0.0
+            else:
+                price = (1 << 192) / (sqrt_price_x96 * sqrt_price_x96)
+
+        price *= (10 ** 6 - self.fee) / (10 ** 6)
+        return price
+
     def get_token_weight(self, token_address: str, block_identifier: int) -> decimal.Decimal:
         return decimal.Decimal('0.5')
 
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from utils.async_rpc import AsyncJSONRPCClient, RPCBatchError
+
+
+async def handler(ws, path=None):
+    """
+    Answers eth_blockNumber with the request's id (in hex); batches are answered in
+    reverse order, except that a batch starting with
+      - 'too_large' is rejected as a whole, as geth does
+      - 'invalid' gets a null-id error for its first request
+    """
+    async for message in ws:
+        payload = json.loads(message)
+        if not isinstance(payload, list):
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'id': payload['id'], 'result': hex(payload['id'])}))
+            continue
+
+        if payload[0]['method'] == 'too_large':
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'batch too large'}}))
+            continue
+
+        ret = [{'jsonrpc': '2.0', 'id': x['id'], 'result': hex(x['id'])} for x in payload]
+        if payload[0]['method'] == 'invalid':
+            ret[0] = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': 'invalid request'}}
+        await ws.send(json.dumps(list(reversed(ret))))
+
+
+def run_against_server(f):
+    async def main():
+        async with websockets.serve(handler, '127.0.0.1', 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncJSONRPCClient(f'ws://127.0.0.1:{port}', timeout=5)
+            return await f(client)
+    return asyncio.run(main())
+
+
+def test_batch_in_request_order():
+    async def f(client: AsyncJSONRPCClient):
+        resps = await client.request_batch([('eth_blockNumber', [])] * 5)
+        assert [r['result'] for r in resps] == [hex(r['id']) for r in resps]
+        assert [r['id'] for r in resps] == sorted(r['id'] for r in resps)
+        assert client.n_outstanding == 0
+    run_against_server(f)
+
+
+def test_whole_batch_rejected():
+    async def f(client: AsyncJSONRPCClient):
+        with pytest.raises(RPCBatchError, match='batch too large'):
+            await client.request_batch([('too_large', []), ('eth_blockNumber', [])])
+
+        # the connection is still usable
+        resp = await client.request('eth_blockNumber', [])
+        assert resp['result'] == hex(resp['id'])
+        assert client.n_outstanding == 0
+    run_against_server(f)
+
+
+def test_null_id_error_in_batch():
+    async def f(client: AsyncJSONRPCClient):
+        with pytest.raises(RPCBatchError, match='invalid request'):
+            await client.request_batch([('invalid', []), ('eth_blockNumber', []), ('eth_blockNumber', [])])
+        assert client.n_outstanding == 0
+    run_against_server(f)
+
+
+def test_concurrent_requests():
+    async def f(client: AsyncJSONRPCClient):
+        # a rejection cannot be attributed, so it fails every batch outstanding at the time;
+        # the server answers in order, so the first batch is answered before then
+        results = await asyncio.gather(
+            client.request_batch([('eth_blockNumber', [])] * 3),
+            client.request_batch([('too_large', [])]),
+            client.request('eth_blockNumber', []),
+            return_exceptions=True,
+        )
+        assert [r['result'] for r in results[0]] == [hex(r['id']) for r in results[0]]
+        assert isinstance(results[1], RPCBatchError)
+        assert results[2]['result'] == hex(results[2]['id'])
+        assert client.n_outstanding == 0
+    run_against_server(f)
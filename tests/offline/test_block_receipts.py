@@ -0,0 +1,78 @@
+import typing
+
+import web3
+
+import utils
+
+
+def fake_receipt(txn_hash: str) -> typing.Dict[str, typing.Any]:
+    return {'transactionHash': txn_hash, 'blockNumber': hex(100), 'status': '0x1', 'logs': []}
+
+
+TXNS = ['0x' + bytes([i]).hex() * 32 for i in range(3)]
+
+
+class FakeProvider(web3.providers.BaseProvider):
+    """
+    Serves the receipts of one block; eth_getBlockReceipts answers with the
+    given errors (in turn) until they run out
+    """
+
+    def __init__(self, block_receipts_errors: typing.List[typing.Optional[dict]]) -> None:
+        self.block_receipts_errors = list(block_receipts_errors)
+        self.requested = []
+
+    def make_request(self, method, params):
+        self.requested.append(method)
+        if method == 'eth_getBlockReceipts':
+            if self.block_receipts_errors:
+                error = self.block_receipts_errors.pop(0)
+                if error is None:
+                    return {'jsonrpc': '2.0', 'id': 1, 'result': None}
+                return {'jsonrpc': '2.0', 'id': 1, 'error': error}
+            return {'jsonrpc': '2.0', 'id': 1, 'result': [fake_receipt(h) for h in TXNS]}
+        if method == 'eth_getBlockByNumber':
+            return {'jsonrpc': '2.0', 'id': 1, 'result': {'number': hex(100), 'transactions': TXNS}}
+        assert method == 'eth_getTransactionReceipt'
+        return {'jsonrpc': '2.0', 'id': 1, 'result': fake_receipt(params[0])}
+
+    def make_request_batch(self, reqs):
+        return [self.make_request(method, params) for method, params in reqs]
+
+
+def receipt_hashes(w3: web3.Web3) -> typing.List[str]:
+    return ['0x' + r['transactionHash'].hex().removeprefix('0x') for r in utils.get_block_receipts(w3, 100)]
+
+
+def test_transient_error_falls_back_once():
+    provider = FakeProvider([{'code': -32000, 'message': 'header not found'}, None])
+    w3 = web3.Web3(provider)
+
+    assert receipt_hashes(w3) == TXNS
+    assert provider.requested.count('eth_getTransactionReceipt') == 3
+    assert receipt_hashes(w3) == TXNS
+    assert provider.requested.count('eth_getTransactionReceipt') == 6
+
+    # once the node answers, the block method is used again
+    provider.requested.clear()
+    assert receipt_hashes(w3) == TXNS
+    assert provider.requested == ['eth_getBlockReceipts']
+
+
+def test_unsupported_method_is_remembered():
+    for error in [
+            {'code': -32601, 'message': 'Method not found'},
+            {'code': -32000, 'message': 'the method eth_getBlockReceipts does not exist/is not available'},
+        ]:
+        provider = FakeProvider([error])
+        w3 = web3.Web3(provider)
+
+        assert receipt_hashes(w3) == TXNS
+        provider.requested.clear()
+        assert receipt_hashes(w3) == TXNS
+        assert 'eth_getBlockReceipts' not in provider.requested
+
+        # other providers are unaffected
+        other = FakeProvider([])
+        assert receipt_hashes(web3.Web3(other)) == TXNS
+        assert other.requested == ['eth_getBlockReceipts']
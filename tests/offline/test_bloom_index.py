@@ -0,0 +1,95 @@
+import numpy as np
+from eth_utils import keccak
+
+from utils.bloom_index import BloomIndex, bloom_bits, bloom_matches
+
+WETH = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+TRANSFER = keccak(b'Transfer(address,address,uint256)')
+SENDER = bytes(12) + bytes.fromhex('B4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc')
+RECIPIENT = bytes(12) + bytes.fromhex('397FF1542f962076d0BFE58eA045FfA2d347ACa0')
+
+# logsBloom of a block whose only log is a WETH Transfer from SENDER to RECIPIENT
+# (computed with the eth-bloom reference implementation)
+EXPECTED_BLOOM = bytes.fromhex(
+    '1000000000000000000000000000000000000000000000000000000000000000'
+    '0000000000000000000000000000000002000000080000000000000000000000'
+    '0000000000000000000000080000000000000000000000000000000000000000'
+    '0000000000000000000000000000200000000000000000000000001000000000'
+    '0000000000000000000000000000000000000000000000000000000000000000'
+    '0000000000000002000000000000000000000000000000000000000000000000'
+    '0000000208000000000000000001000000000000000000000000000000000000'
+    '0008200000000000000000000000000000000000000000000000000000000000'
+)
+
+
+def make_bloom(*items: bytes) -> np.ndarray:
+    bloom = np.zeros(256, dtype=np.uint8)
+    for item in items:
+        byte_idxs, masks = bloom_bits(item)
+        for b, m in zip(byte_idxs, masks):
+            bloom[b] |= m
+    return bloom
+
+
+def test_bloom_bits_match_reference():
+    assert len(EXPECTED_BLOOM) == 256
+    bloom = make_bloom(bytes.fromhex(WETH[2:]), TRANSFER, SENDER, RECIPIENT)
+    assert bloom.tobytes() == EXPECTED_BLOOM
+
+    for item in [bytes.fromhex(WETH[2:]), TRANSFER, SENDER, RECIPIENT]:
+        byte_idxs, masks = bloom_bits(item)
+        assert len(byte_idxs) == len(masks) == 3
+        assert all(bin(int(m)).count('1') == 1 for m in masks)
+
+
+def test_bloom_matches():
+    blooms = np.stack([
+        np.frombuffer(EXPECTED_BLOOM, dtype=np.uint8),
+        make_bloom(TRANSFER),
+        np.zeros(256, dtype=np.uint8),
+        np.full(256, 0xff, dtype=np.uint8),
+    ])
+    assert list(bloom_matches(blooms, [bytes.fromhex(WETH[2:])])) == [True, False, False, True]
+    assert list(bloom_matches(blooms, [TRANSFER])) == [True, True, False, True]
+    assert list(bloom_matches(blooms, [keccak(b'not in any bloom'), TRANSFER])) == [True, True, False, True]
+    assert list(bloom_matches(blooms, [])) == [False, False, False, False]
+
+
+class FakeHeaderStore:
+    """
+    Blooms for blocks 0.. from a fixed table
+    """
+
+    def __init__(self, blooms: np.ndarray) -> None:
+        self.blooms = blooms
+        self.requested = []
+
+    def logs_blooms(self, start_block: int, end_block: int) -> np.ndarray:
+        self.requested.append((start_block, end_block))
+        return self.blooms[start_block:end_block]
+
+
+def test_candidate_blocks():
+    n = 100
+    blooms = np.zeros((n, 256), dtype=np.uint8)
+    weth_transfers = {3, 17, 50, 51, 99}
+    other_transfers = {10, 60}
+    weth_only = {20}
+    for b in weth_transfers:
+        blooms[b] = np.frombuffer(EXPECTED_BLOOM, dtype=np.uint8)
+    for b in other_transfers:
+        blooms[b] = make_bloom(bytes(20), TRANSFER)
+    for b in weth_only:
+        blooms[b] = make_bloom(bytes.fromhex(WETH[2:]), keccak(b'Deposit(address,uint256)'))
+
+    store = FakeHeaderStore(blooms)
+    index = BloomIndex(store, chunk_size=16)
+
+    assert index.candidate_blocks(0, n - 1, addresses=[WETH], topics=[TRANSFER]) == sorted(weth_transfers)
+    assert index.candidate_blocks(0, n - 1, addresses=[WETH]) == sorted(weth_transfers | weth_only)
+    assert index.candidate_blocks(0, n - 1, topics=[TRANSFER]) == sorted(weth_transfers | other_transfers)
+    assert index.candidate_blocks(18, 51, addresses=[WETH], topics=[TRANSFER]) == [50, 51]
+    # read in chunks
+    assert all(e - s <= 16 for s, e in store.requested)
+
+    assert list(index.iter_candidates_backward(60, addresses=[WETH], not_before=10)) == [51, 50, 20, 17]
@@ -0,0 +1,90 @@
+import random
+import typing
+import web3
+
+import pricers
+import find_circuit
+import find_circuit.monitor
+from find_circuit.find import PricingCircuit
+from utils import WETH_ADDRESS
+
+
+def _address(rng: random.Random) -> str:
+    return web3.Web3.toChecksumAddress(rng.randbytes(20).hex())
+
+
+def _add_exchange(pool: pricers.PricerPool, rng: random.Random, tokens: typing.List[str], origin_block: int):
+    # about half the exchanges trade WETH (tokens[0]), as on mainnet
+    if rng.random() < 0.5:
+        pair = [tokens[0], rng.choice(tokens[1:])]
+    else:
+        pair = rng.sample(tokens[1:], 2)
+    token0, token1 = sorted(pair, key=lambda t: bytes.fromhex(t[2:]))
+    if rng.random() < 0.5:
+        pool.add_uniswap_v2(_address(rng), token0, token1, origin_block)
+    else:
+        pool.add_uniswap_v3(_address(rng), token0, token1, rng.choice([500, 3_000, 10_000]), origin_block)
+
+
+def _key(pc: PricingCircuit) -> typing.Tuple:
+    # rotations and flips of a cycle are the same circuit (as in monitor.profitable_circuits)
+    return tuple(sorted((p.address, *sorted(d)) for p, d in zip(pc.circuit, pc.directions)))
+
+
+def _always(pricer, block_number) -> bool:
+    return True
+
+
+def _proposals(pool: pricers.PricerPool, block_number: int, catalog: typing.Optional[find_circuit.CircuitCatalog]) -> typing.Dict[str, typing.Set[typing.Tuple]]:
+    ret = {}
+    for pair, addresses in list(pool._token_pairs_to_pools.items()):
+        for address in pool.get_exchanges_for_pair(pair[0], pair[1], block_number):
+            if catalog is None:
+                pcs = find_circuit.monitor._propose_circuits_pair(pair, address, pool, block_number, _always)
+            else:
+                pcs = find_circuit.monitor._propose_circuits_pair_catalog(pair, address, pool, block_number, catalog, _always)
+            ret[address] = set(_key(pc) for pc in pcs)
+    return ret
+
+
+def test_catalog_matches_enumeration():
+    rng = random.Random(1234)
+    tokens = [WETH_ADDRESS] + [_address(rng) for _ in range(12)]
+    pool = pricers.PricerPool(web3.Web3())
+
+    # half the exchanges exist when the catalog is built, the rest are added to it afterward
+    for _ in range(40):
+        _add_exchange(pool, rng, tokens, rng.randint(1, 100))
+    catalog = find_circuit.CircuitCatalog(pool)
+    for _ in range(40):
+        _add_exchange(pool, rng, tokens, rng.randint(1, 100))
+
+    for block_number in [30, 60, 100]:
+        expected = _proposals(pool, block_number, None)
+        got = _proposals(pool, block_number, catalog)
+        assert got == expected
+    assert sum(len(v) for v in expected.values()) > 100
+
+    # proposals are in the canonical orientation, with no duplicates
+    rebuilt = find_circuit.CircuitCatalog(pool)
+    assert len(rebuilt) == len(catalog)
+    for pair, addresses in pool._token_pairs_to_pools.items():
+        for address in addresses:
+            circuits = list(rebuilt.circuits_for(pair, address))
+            assert len(circuits) == len(set(circuits))
+            for exchanges, directions in circuits:
+                assert directions[0][0] == WETH_ADDRESS
+                assert len(set(exchanges)) == len(exchanges)
+
+
+def test_catalog_nbytes():
+    rng = random.Random(5678)
+    tokens = [WETH_ADDRESS] + [_address(rng) for _ in range(20)]
+    pool = pricers.PricerPool(web3.Web3())
+    for _ in range(200):
+        _add_exchange(pool, rng, tokens, 1)
+    catalog = find_circuit.CircuitCatalog(pool)
+
+    assert len(catalog) > 1_000
+    # seek_candidates' catalog size limit assumes about 40 bytes a circuit
+    assert catalog.nbytes() / len(catalog) < 60
@@ -0,0 +1,127 @@
+import gc
+import typing
+import weakref
+
+import numpy as np
+import pytest
+import web3
+
+from utils import RetryingProvider, get_header_store
+from utils.header_store import BLOCKS_PER_SEGMENT, HeaderStore, _to_record
+
+
+def fake_block(block_number: int) -> typing.Dict[str, typing.Any]:
+    ret = {
+        'number': hex(block_number),
+        'timestamp': hex(1_600_000_000 + 13 * block_number),
+        'hash': '0x' + block_number.to_bytes(32, 'big').hex(),
+        'logsBloom': '0x' + bytes((block_number + i) % 256 for i in range(256)).hex(),
+    }
+    if block_number >= 12_965_000:
+        # london
+        ret['baseFeePerGas'] = hex(block_number * 1_000)
+    return ret
+
+
+class FakeProvider(web3.providers.BaseProvider):
+    """
+    Serves made-up blocks up to head, and counts the blocks it was asked for
+    """
+
+    def __init__(self, head: int, finalized: int) -> None:
+        self.head = head
+        self.finalized = finalized
+        self.requested = []
+
+    def get_finalized_block(self) -> int:
+        return self.finalized
+
+    def make_request(self, method, params):
+        assert method == 'eth_getBlockByNumber'
+        block_number = int(params[0], 16)
+        self.requested.append(block_number)
+        if block_number > self.head:
+            return {'jsonrpc': '2.0', 'id': 1, 'result': None}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': fake_block(block_number)}
+
+    def make_request_batch(self, reqs):
+        return [self.make_request(method, params) for method, params in reqs]
+
+
+def test_record_encoding():
+    rec = _to_record({'jsonrpc': '2.0', 'id': 1, 'result': fake_block(13_000_000)})
+    assert rec['present'] == 1
+    assert int(rec['timestamp']) == 1_600_000_000 + 13 * 13_000_000
+    assert int(rec['base_fee']) == 13_000_000_000
+    assert rec['hash'].tobytes() == (13_000_000).to_bytes(32, 'big')
+    assert rec['logs_bloom'].tobytes() == bytes((13_000_000 + i) % 256 for i in range(256))
+
+    # before london there is no base fee
+    rec = _to_record({'jsonrpc': '2.0', 'id': 1, 'result': fake_block(12_000_000)})
+    assert int(rec['base_fee']) == 0
+
+    with pytest.raises(Exception):
+        _to_record({'jsonrpc': '2.0', 'id': 1, 'result': None})
+    with pytest.raises(Exception):
+        _to_record({'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': 'oops'}})
+
+
+def test_persists_finalized_only(tmp_path):
+    provider = FakeProvider(head=13_000_100, finalized=13_000_050)
+    store = HeaderStore(web3.Web3(provider), str(tmp_path), read_ahead=20, batch_size=7)
+
+    assert store.timestamp(13_000_000) == 1_600_000_000 + 13 * 13_000_000
+    assert store.base_fee(13_000_000) == 13_000_000_000
+    assert store.block_hash(13_000_005) == (13_000_005).to_bytes(32, 'big')
+    # read ahead, so the next blocks were already loaded
+    assert sorted(provider.requested) == list(range(13_000_000, 13_000_020))
+
+    # unfinalized blocks are fetched individually and not persisted
+    assert store.logs_bloom(13_000_070) == bytes((13_000_070 + i) % 256 for i in range(256))
+    assert provider.requested[-1] == 13_000_070
+
+    # another process sees what was persisted, without asking the node
+    provider2 = FakeProvider(head=13_000_100, finalized=13_000_050)
+    store2 = HeaderStore(web3.Web3(provider2), str(tmp_path))
+    assert store2.timestamp(13_000_019) == 1_600_000_000 + 13 * 13_000_019
+    assert provider2.requested == []
+    store2.timestamp(13_000_070)
+    assert provider2.requested == [13_000_070]
+
+
+def test_logs_blooms_across_segments(tmp_path):
+    start = 13 * BLOCKS_PER_SEGMENT - 5
+    provider = FakeProvider(head=start + 20, finalized=start + 8)
+    store = HeaderStore(web3.Web3(provider), str(tmp_path))
+
+    blooms = store.logs_blooms(start, start + 12)
+    assert blooms.shape == (12, 256)
+    for i in range(12):
+        assert blooms[i].tobytes() == bytes((start + i + j) % 256 for j in range(256))
+    assert np.array_equal(store.logs_blooms(start + 3, start + 4)[0], blooms[3])
+
+
+def test_shared_store_per_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv('HEADER_STORE_DIR', str(tmp_path))
+
+    # not mainnet: no store, and nothing remembered that a later connection could pick up
+    for _ in range(10):
+        assert get_header_store(web3.Web3(FakeProvider(head=100, finalized=90))) is None
+    gc.collect()
+
+    provider = RetryingProvider(['ws://127.0.0.1:1'])
+    w3 = web3.Web3(provider)
+    store = get_header_store(w3)
+    assert store is not None
+    assert get_header_store(w3) is store
+    # connections sharing the provider share its store
+    assert get_header_store(web3.Web3(provider)) is store
+    assert get_header_store(web3.Web3(RetryingProvider(['ws://127.0.0.1:1']))) not in (None, store)
+
+    # the store does not keep the connection alive
+    w3_ref = weakref.ref(w3)
+    store_ref = weakref.ref(store)
+    del w3, provider, store
+    gc.collect()
+    assert w3_ref() is None
+    assert store_ref() is None
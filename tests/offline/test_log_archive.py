@@ -0,0 +1,157 @@
+import typing
+
+import web3
+from eth_utils import to_checksum_address
+
+from utils.log_archive import BLOCKS_PER_PARTITION, LogArchive
+
+ADDRESSES = ['0x' + bytes([i + 1]).hex() * 20 for i in range(3)]
+TOPIC = '0x' + 'dd' * 32
+
+
+def fake_logs(block_number: int) -> typing.List[dict]:
+    """
+    Made-up logs: blocks divisible by 7 have none, others have one per address in a rotating subset
+    """
+    if block_number % 7 == 0:
+        return []
+    ret = []
+    for log_index, address in enumerate(ADDRESSES[: block_number % 3 + 1]):
+        ret.append({
+            'address': address,
+            'topics': [TOPIC, '0x' + block_number.to_bytes(32, 'big').hex()],
+            'data': '0x' + bytes([log_index]).hex() * (block_number % 5),
+            'blockNumber': hex(block_number),
+            'blockHash': '0x' + (block_number + 1).to_bytes(32, 'big').hex(),
+            'transactionHash': '0x' + (block_number * 10 + log_index // 2).to_bytes(32, 'big').hex(),
+            'transactionIndex': hex(log_index // 2),
+            'logIndex': hex(log_index),
+            'removed': False,
+        })
+    return ret
+
+
+class FakeProvider(web3.providers.BaseProvider):
+    """
+    Serves eth_getLogs over made-up logs, recording the requested ranges
+    """
+
+    def __init__(self, finalized: int) -> None:
+        self.finalized = finalized
+        self.requested = []
+
+    def get_finalized_block(self) -> int:
+        return self.finalized
+
+    def make_request(self, method, params):
+        assert method == 'eth_getLogs'
+        start, end = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+        self.requested.append((start, end))
+        return {'jsonrpc': '2.0', 'id': 1, 'result': [log for b in range(start, end + 1) for log in fake_logs(b)]}
+
+    def make_request_batch(self, reqs):
+        return [self.make_request(method, params) for method, params in reqs]
+
+
+def requested_blocks(provider: FakeProvider) -> typing.Set[int]:
+    return set(b for s, e in provider.requested for b in range(s, e + 1))
+
+
+def check_logs(archive: LogArchive, start: int, end: int, addresses: typing.Optional[typing.Set[str]] = None):
+    got = archive.get_logs(start, end, addresses)
+    expected = [
+        log for b in range(start, end + 1) for log in fake_logs(b)
+        if addresses is None or to_checksum_address(log['address']) in addresses
+    ]
+    assert len(got) == len(expected)
+    for g, e in zip(got, expected):
+        assert g['address'] == to_checksum_address(e['address'])
+        assert ['0x' + bytes(t).hex() for t in g['topics']] == e['topics']
+        assert g['data'] == e['data']
+        assert g['blockNumber'] == int(e['blockNumber'], 16)
+        assert '0x' + bytes(g['blockHash']).hex() == e['blockHash']
+        assert '0x' + bytes(g['transactionHash']).hex() == e['transactionHash']
+        assert g['logIndex'] == int(e['logIndex'], 16)
+
+
+def test_extract_and_read(tmp_path):
+    provider = FakeProvider(finalized=3 * BLOCKS_PER_PARTITION)
+    archive = LogArchive(str(tmp_path))
+
+    start, end = BLOCKS_PER_PARTITION - 50, BLOCKS_PER_PARTITION + 120
+    archive.extract(web3.Web3(provider), start, end, batch_size=30)
+    assert requested_blocks(provider) == set(range(start, end + 1))
+
+    assert archive.covers(start, end)
+    assert archive.covers(start + 10, end - 10)
+    assert not archive.covers(start - 1, end)
+    assert not archive.covers(start, end + 1)
+
+    check_logs(archive, start, end)
+    check_logs(archive, start + 3, start + 3)
+    check_logs(archive, start, end, {to_checksum_address(ADDRESSES[1])})
+
+    blocks = list(archive.iter_blocks(start, start + 20))
+    assert [b for b, _ in blocks] == list(range(start, start + 21))
+    assert all(len(logs) == len(fake_logs(b)) for b, logs in blocks)
+
+    # a fresh archive on the same directory reads the same files
+    check_logs(LogArchive(str(tmp_path)), start, end)
+
+
+def test_append_after_gap(tmp_path):
+    provider = FakeProvider(finalized=3 * BLOCKS_PER_PARTITION)
+    w3 = web3.Web3(provider)
+    archive = LogArchive(str(tmp_path))
+
+    archive.extract(w3, 0, 999)
+    provider.requested.clear()
+
+    # starts after the covered end of the partition, so the gap is filled in too
+    archive.extract(w3, 5000, 6000)
+    assert requested_blocks(provider) == set(range(1000, 6001))
+    assert archive.covers(0, 6000)
+    check_logs(archive, 0, 6000)
+
+    # nothing left to extract
+    provider.requested.clear()
+    archive.extract(w3, 100, 5500)
+    assert provider.requested == []
+
+
+def test_extract_before_covered(tmp_path):
+    provider = FakeProvider(finalized=3 * BLOCKS_PER_PARTITION)
+    w3 = web3.Web3(provider)
+    archive = LogArchive(str(tmp_path))
+
+    archive.extract(w3, 500, 999)
+    provider.requested.clear()
+
+    # would leave a hole before what is covered, so the partition is re-extracted from our start
+    archive.extract(w3, 100, 200)
+    assert requested_blocks(provider) == set(range(100, 1000))
+    assert archive.covers(100, 999)
+    check_logs(archive, 100, 999)
+
+
+def test_unfinalized_not_extracted(tmp_path):
+    provider = FakeProvider(finalized=250)
+    archive = LogArchive(str(tmp_path))
+
+    archive.extract(web3.Web3(provider), 0, 1000)
+    assert max(e for _, e in provider.requested) == 250
+    assert archive.covers(0, 250)
+    assert not archive.covers(0, 251)
+
+
+def test_filtered_archive(tmp_path):
+    provider = FakeProvider(finalized=3 * BLOCKS_PER_PARTITION)
+    only = {to_checksum_address(ADDRESSES[0])}
+    archive = LogArchive(str(tmp_path), addresses=only)
+
+    archive.extract(web3.Web3(provider), 0, 300)
+    assert archive.covers(0, 300, addresses=only)
+    # logs of other addresses were not kept
+    assert not archive.covers(0, 300)
+    assert not archive.covers(0, 300, addresses={to_checksum_address(ADDRESSES[1])})
+    check_logs(archive, 0, 300, only)
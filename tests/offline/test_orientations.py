@@ -0,0 +1,72 @@
+import web3
+
+from find_circuit.find import PricingCircuit, detect_arbitrages_bisection, orientations_to_search
+from pricers.uniswap_v2 import UniswapV2Pricer
+from utils import WETH_ADDRESS
+
+TOKEN_B = '0x' + 'bb' * 20
+TOKEN_C = '0x' + 'cc' * 20
+TOKEN_D = '0x' + 'dd' * 20
+
+
+def by_rotate_and_flip(pc: PricingCircuit):
+    """
+    The orientations as the detectors used to walk them, by rotating and flipping a copy in place
+    """
+    ret = []
+    ref = pc.copy()
+    for _ in range(len(ref.circuit)):
+        flipped = ref.copy()
+        flipped.flip()
+        ret.append((ref.circuit, ref.directions))
+        ret.append((flipped.circuit, flipped.directions))
+        ref.rotate()
+    return ret
+
+
+def test_orientations_match_rotate_and_flip():
+    tokens = [WETH_ADDRESS, TOKEN_B, TOKEN_C, TOKEN_D]
+    for n in [2, 3, 4]:
+        t = tokens[:n]
+        pc = PricingCircuit([f'p{i}' for i in range(n)], list(zip(t, t[1:] + t[:1])))
+        expected = by_rotate_and_flip(pc)
+
+        assert [(o.circuit, o.directions) for o in pc.orientations()] == expected
+        assert [(o.circuit, o.directions) for o in pc.orientations(WETH_ADDRESS)] == \
+            [x for x in expected if x[1][0][0] == WETH_ADDRESS]
+        assert [(o.circuit, o.directions) for o in pc.orientations(TOKEN_B)] == \
+            [x for x in expected if x[1][0][0] == TOKEN_B]
+        # not modified
+        assert (pc.circuit, pc.directions) == expected[0]
+
+    pc = PricingCircuit(['p0', 'p1', 'p2'], [(TOKEN_B, TOKEN_C), (TOKEN_C, WETH_ADDRESS), (WETH_ADDRESS, TOKEN_B)])
+    assert list(orientations_to_search(pc, only_weth_pivot=True, try_all_directions=False)) == []
+    assert list(orientations_to_search(pc, only_weth_pivot=False, try_all_directions=False)) == [pc]
+    assert [o.pivot_token for o in orientations_to_search(pc, only_weth_pivot=True, try_all_directions=True)] == [WETH_ADDRESS, WETH_ADDRESS]
+
+
+def make_pool(address: str, weth_reserve: int, b_reserve: int) -> UniswapV2Pricer:
+    ret = UniswapV2Pricer(web3.Web3(), web3.Web3.toChecksumAddress(address), WETH_ADDRESS, TOKEN_B)
+    ret.known_token0_bal = weth_reserve
+    ret.known_token1_bal = b_reserve
+    return ret
+
+
+def test_bisection_searches_flip_when_forward_fails():
+    # B is cheap in `cheap` and dear in `dear`: only buying it in `cheap` and selling it in `dear` is profitable
+    cheap = make_pool('0x' + '11' * 20, 100 * 10 ** 18, 300_000 * 10 ** 18)
+    dear = make_pool('0x' + '22' * 20, 100 * 10 ** 18, 200_000 * 10 ** 18)
+
+    # forward orientation sells B where it is cheap: fails the quick check
+    pc = PricingCircuit([dear, cheap], [(WETH_ADDRESS, TOKEN_B), (TOKEN_B, WETH_ADDRESS)])
+    assert pc.sample_new_price_ratio(10 ** 15, 1) < 1
+
+    found = detect_arbitrages_bisection(pc, 1, only_weth_pivot=True)
+    assert len(found) == 1
+    assert found[0].circuit == (cheap, dear)
+    assert found[0].directions == ((WETH_ADDRESS, TOKEN_B), (TOKEN_B, WETH_ADDRESS))
+    assert found[0].profit > 0
+
+    # the circuit passed in is left as given
+    assert pc.circuit == (dear, cheap)
+    assert pc.directions == ((WETH_ADDRESS, TOKEN_B), (TOKEN_B, WETH_ADDRESS))
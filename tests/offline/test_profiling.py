@@ -0,0 +1,71 @@
+import json
+import tempfile
+import time
+
+import web3
+
+import utils.profiling
+from benchmarks.bench_seek_candidates import build_pool, run_range
+from benchmarks.fixtures import DEFAULT_FIXTURE_DIR
+from utils.profiling import inc_measurement, profile, snapshot
+from utils.rpc_recording import ReplayProvider
+
+
+def busy(seconds: float):
+    t_end = time.perf_counter() + seconds
+    while time.perf_counter() < t_end:
+        pass
+
+
+def check_spans(spans: dict):
+    """
+    No span has negative self time, and no span's children add up to more than it
+    """
+    assert len(spans) > 0
+    for path, stats in spans.items():
+        assert stats['self_seconds'] >= 0, f'{path}: {stats}'
+        children = [
+            s for p, s in spans.items()
+            if p.startswith(path + '/') and '/' not in p[len(path) + 1:]
+        ]
+        assert sum(c['total_seconds'] for c in children) <= stats['total_seconds'], f'{path}: {stats}'
+
+
+def test_measurements_stay_out_of_spans():
+    utils.profiling.reset()
+
+    # as in detect_arbitrages_bisection: a measurement of time that spans already cover
+    with profile('find_candidates'):
+        t_start = time.time()
+        with profile('pricing.quick_check'):
+            busy(0.01)
+        with profile('pricing.optimize'):
+            busy(0.01)
+        inc_measurement('optimize_uv2_2', time.time() - t_start)
+
+    snap = snapshot()
+    check_spans(snap['spans'])
+    assert set(snap['spans']) == {'find_candidates', 'find_candidates/pricing.quick_check', 'find_candidates/pricing.optimize'}
+    assert snap['spans']['find_candidates']['self_seconds'] < 0.01
+
+    assert snap['measurements']['optimize_uv2_2']['count'] == 1
+    assert snap['measurements']['optimize_uv2_2']['total_seconds'] >= 0.02
+    assert utils.profiling.get_measurement('optimize_uv2_2') >= 0.02
+
+    utils.profiling.reset()
+    assert snapshot()['measurements'] == {}
+
+
+def test_seek_candidates_phases():
+    # the shipped scenario runs the instrumented call sites of the seek_candidates loop
+    prefix = f'{DEFAULT_FIXTURE_DIR}/seek_candidates_smoke'
+    with open(prefix + '.seek.json') as fin:
+        scenario = json.load(fin)
+    w3 = web3.Web3(ReplayProvider([prefix + '.rpc.jsonl.gz']))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = build_pool(w3, prefix + '.pool.json.gz', tmpdir)
+        result = run_range(w3, pool, scenario['start_block'], scenario['end_block'], scenario['min_profit'])
+
+    assert result['checksum'] == scenario['checksum']
+    assert 'propose-circuit' in result['measurements']
+    check_spans(utils.profiling.snapshot()['spans'])
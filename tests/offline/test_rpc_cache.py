@@ -0,0 +1,59 @@
+import os
+import time
+
+from utils.rpc_cache import RPCCache, block_of_request, block_of_response
+
+
+def test_block_of_request_at_block():
+    assert block_of_request('eth_getStorageAt', ['0xabc', '0x8', '0xcf8500']) == 13_600_000
+    assert block_of_request('eth_call', [{'to': '0xabc', 'data': '0x'}, 13_600_000]) == 13_600_000
+    assert block_of_request('eth_getBalance', ['0xabc', '0x10']) == 16
+    assert block_of_request('eth_getCode', ['0xabc', '0x10']) == 16
+
+    # tags are not final
+    assert block_of_request('eth_call', [{'to': '0xabc', 'data': '0x'}, 'latest']) is None
+    assert block_of_request('eth_getStorageAt', ['0xabc', '0x8', 'pending']) is None
+    # block parameter omitted (defaults to latest)
+    assert block_of_request('eth_getBalance', ['0xabc']) is None
+
+
+def test_block_of_request_blocks_and_logs():
+    assert block_of_request('eth_getBlockByNumber', ['0x10', False]) == 16
+    assert block_of_request('eth_getBlockByNumber', ['latest', False]) is None
+    assert block_of_request('eth_getBlockReceipts', ['0x10']) == 16
+
+    # a log range is final once its last block is
+    assert block_of_request('eth_getLogs', [{'fromBlock': '0x10', 'toBlock': '0x20', 'address': '0xabc'}]) == 32
+    assert block_of_request('eth_getLogs', [{'fromBlock': '0x10', 'toBlock': 'latest'}]) is None
+    assert block_of_request('eth_getLogs', [{'toBlock': '0x20'}]) is None
+    assert block_of_request('eth_getLogs', [{'blockHash': '0x' + '00' * 32}]) is None
+
+    # not keyed by block at all
+    assert block_of_request('eth_blockNumber', []) is None
+    assert block_of_request('eth_getTransactionReceipt', ['0x' + '00' * 32]) is None
+
+
+def test_block_of_response():
+    assert block_of_response('eth_getTransactionReceipt', {'result': {'blockNumber': '0x10'}}) == 16
+    # not mined yet
+    assert block_of_response('eth_getTransactionReceipt', {'result': None}) is None
+    assert block_of_response('eth_call', {'result': '0x'}) is None
+
+
+def test_put_get(tmp_path):
+    cache = RPCCache(os.path.join(tmp_path, 'cache.sqlite3'))
+    params = [{'to': '0xabc', 'data': '0x1234'}, '0x10']
+    assert cache.get('eth_call', params) is None
+
+    cache.put('eth_call', params, {'jsonrpc': '2.0', 'id': 1, 'result': '0x' + 'ab' * 32})
+
+    # written in the background
+    deadline = time.time() + 10
+    while cache.get('eth_call', params) is None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    assert cache.get('eth_call', params)['result'] == '0x' + 'ab' * 32
+    # keyed on params, regardless of dict ordering
+    assert cache.get('eth_call', [{'data': '0x1234', 'to': '0xabc'}, '0x10']) is not None
+    assert cache.get('eth_call', [{'to': '0xabc', 'data': '0x1234'}, '0x11']) is None
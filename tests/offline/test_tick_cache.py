@@ -0,0 +1,105 @@
+import pickle
+import random
+
+import pytest
+
+from pricers.uniswap_v3 import Tick, TickCache
+
+BOUNDARY_LIQUIDITIES = [
+    (0, 0),
+    (1, -1),
+    ((1 << 64) - 1, (1 << 64) - 1),
+    (1 << 64, -(1 << 64)),
+    ((1 << 127) + 1, (1 << 127) - 1),
+    ((1 << 128) - 1, -(1 << 127)),
+]
+
+
+def check_same(cache: TickCache, expected: dict):
+    assert len(cache) == len(expected)
+    assert list(cache) == sorted(expected)
+    assert list(cache.keys()) == sorted(expected)
+    assert list(cache.items()) == sorted(expected.items())
+    assert list(cache.values()) == [expected[k] for k in sorted(expected)]
+    for k, v in expected.items():
+        assert k in cache
+        assert cache[k] == v
+        assert cache.get(k) == v
+
+
+def test_round_trip():
+    rng = random.Random(1)
+    cache = TickCache()
+    expected = {}
+    for _ in range(2_000):
+        tick = rng.randint(-887272, 887272) // 60 * 60
+        value = Tick(
+            tick,
+            liquidity_gross = rng.randrange(1 << rng.choice([8, 64, 100, 128])),
+            liquidity_net = rng.randrange(-(1 << 127), 1 << 127) >> rng.randrange(128),
+            initialized = rng.random() < 0.9,
+        )
+        cache[tick] = value
+        expected[tick] = value
+    check_same(cache, expected)
+
+    missing = 887272 + 1
+    assert missing not in cache
+    assert cache.get(missing) is None
+    assert cache.get(missing, 'x') == 'x'
+    with pytest.raises(KeyError):
+        cache[missing]
+
+
+def test_boundaries():
+    cache = TickCache()
+    expected = {}
+    for i, (gross, net) in enumerate(BOUNDARY_LIQUIDITIES):
+        for tick in [-(1 << 31) + i, i * 10, (1 << 31) - 1 - i]:
+            value = Tick(tick, gross, net, i % 2 == 0)
+            cache[tick] = value
+            expected[tick] = value
+    check_same(cache, expected)
+
+    # overwrite in place
+    for tick in list(expected):
+        value = Tick(tick, (1 << 128) - 1 - expected[tick].liquidity_gross, -1 - expected[tick].liquidity_net, True)
+        cache[tick] = value
+        expected[tick] = value
+    check_same(cache, expected)
+
+
+@pytest.mark.parametrize('tick,gross,net', [
+    (0, 1 << 128, 0),
+    (0, -1, 0),
+    (0, 0, 1 << 127),
+    (0, 0, -(1 << 127) - 1),
+    (1 << 31, 0, 0),
+    (-(1 << 31) - 1, 0, 0),
+    (5, 1 << 128, 0),
+])
+def test_out_of_range_leaves_cache_unchanged(tick, gross, net):
+    cache = TickCache()
+    expected = {t: Tick(t, t + 1000, -t, True) for t in [-10, 0, 10]}
+    for t, v in expected.items():
+        cache[t] = v
+
+    with pytest.raises(OverflowError):
+        cache[tick] = Tick(tick, gross, net, True)
+    check_same(cache, expected)
+
+    # still usable
+    cache[20] = Tick(20, 1, 1, False)
+    expected[20] = Tick(20, 1, 1, False)
+    check_same(cache, expected)
+
+
+def test_pickle():
+    cache = TickCache()
+    expected = {}
+    for i, (gross, net) in enumerate(BOUNDARY_LIQUIDITIES):
+        value = Tick(i * 60, gross, net, i % 2 == 1)
+        cache[i * 60] = value
+        expected[i * 60] = value
+
+    check_same(pickle.loads(pickle.dumps(cache)), expected)
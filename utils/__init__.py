@@ -1,4 +1,5 @@
 import asyncio
+import concurrent.futures
 import datetime
 import typing
 import os
@@ -6,22 +7,38 @@ import json
 import time
 import logging
 import backoff
+import cachetools
 import scipy.stats
 import logging
 import logging.handlers
 import random
 import sys
+import threading
+import weakref
 import web3
 import web3.types
 import web3.contract
+import web3.datastructures
+import web3.exceptions
 import random
 import websockets.exceptions
 import requests.exceptions  
 
 from web3.providers.base import JSONBaseProvider
-
+from web3._utils.method_formatters import receipt_formatter
+
+from .async_rpc import get_event_loop, rpc_tag
+from .endpoint_pool import EndpointPool
+from .bloom_index import BloomIndex
+from .header_store import HeaderStore
+from .rpc_cache import RPCCache, open_default_cache
+from .rpc_recording import RPCRecorder, open_default_recorder
+from . import memory
+from . import metrics
+from . import rpc_cache
+from . import sampling
 from .throttler import BlockThrottle
-from .profiling import get_measurement, reset_measurement, profile
+from .profiling import get_measurement, inc_count, reset_measurement, profile, span_path
 
 l = logging.getLogger(__name__)
 
@@ -99,25 +116,84 @@ def setup_logging(job_name = None, suppress: typing.List[str] = [], worker_name:
                   'web3.RequestManager', 'websockets.server', 'asyncio', 'pika'] + suppress:
         logging.getLogger(lname).setLevel(logging.WARNING)
 
+    # every long-running job sets up logging first, so this is where metrics start too
+    metrics.maybe_start_server(job=job_name or '', worker=worker_name)
+
+    # kill -USR1 dumps all thread stacks, kill -USR2 samples them; files sit next to the log
+    sampling.install_signal_handlers(logdir, os.path.splitext(os.path.basename(fname))[0])
+
+def get_web3_hosts(default: str = 'ws://172.0.0.1:8646') -> typing.List[str]:
+    """
+    Get the node endpoints from WEB3_HOST, which may be a comma-separated list
+    """
+    web3_host = os.getenv('WEB3_HOST', default)
+    return [h.strip() for h in web3_host.split(',') if len(h.strip()) > 0]
+
+
+def get_fork_url(default: str = 'ws://172.17.0.1:8546') -> str:
+    """
+    Pick a node endpoint for ganache to fork from, at random so forks spread out over all nodes
+    """
+    return random.choice(get_web3_hosts(default))
+
+
+# read-only methods, for which identical requests in flight at once can share one response
+COALESCED_METHODS = {
+    'eth_getBlockReceipts',
+    'eth_getStorageAt',
+    'eth_call',
+    'eth_getBalance',
+    'eth_getCode',
+    'eth_getBlockByNumber',
+    'eth_getBlockByHash',
+    'eth_getTransactionByHash',
+    'eth_getTransactionReceipt',
+    'eth_getLogs',
+}
+
+
 class RetryingProvider(JSONBaseProvider):
-    _internal_provider: web3.WebsocketProvider
+    """
+    Websocket provider that retries on connection failure or timeout.
 
-    def __init__(self) -> None:
-        super().__init__()
-        self._internal_provider = None
-        self._connect()
+    Requests are pipelined over a pool of connections to every endpoint in WEB3_HOST
+    (see EndpointPool), so any number of threads (or futures from submit_request)
+    may have requests in flight at once. A retry goes to a different endpoint
+    if one is available.
+    """
+    pool: EndpointPool
+    cache: typing.Optional[RPCCache]
+    recorder: typing.Optional[RPCRecorder]
 
-    def _connect(self):
+    def __init__(
+            self,
+            endpoint_uris: typing.Optional[typing.Sequence[str]] = None,
+            connections_per_endpoint: int = 2,
+            cache: typing.Optional[RPCCache] = None,
+            recorder: typing.Optional[RPCRecorder] = None,
+        ) -> None:
+        """
+        If cache is given, responses to queries against finalized blocks are served from
+        (and saved to) it. If recorder is given, every request and its response is
+        recorded (including those served from the cache), for later replay.
+        """
+        super().__init__()
         l.debug('connecting to web3')
-        web3_host = os.getenv('WEB3_HOST', 'ws://172.0.0.1:8646')
-
-        self._internal_provider = web3.WebsocketProvider(
-            web3_host,
-            websocket_timeout=60 * 5,
-            websocket_kwargs={
-                'max_size': 1024 * 1024 * 1024, # 1 Gb max payload
-            },
+        self.pool = EndpointPool(
+            endpoint_uris or get_web3_hosts(),
+            connections_per_endpoint = connections_per_endpoint,
+            timeout = 60 * 5,
+            max_size = 1024 * 1024 * 1024, # 1 Gb max payload
         )
+        self.cache = cache
+        self.recorder = recorder
+        self._in_flight: typing.Dict[typing.Tuple[str, str], asyncio.Future] = {}
+        self._head_block = None
+        self._head_block_updated = 0.0
+        self._head_lock = threading.Lock()
+        # see get_header_store
+        self._header_store: typing.Optional[HeaderStore] = None
+        self._header_store_opened = False
 
     @backoff.on_exception(
         backoff.expo,
@@ -127,29 +203,14 @@ class RetryingProvider(JSONBaseProvider):
         ),
         max_time = 10 * 60,
         factor = 4,
-        on_backoff = lambda x: x['args'][0]._connect()
     )
-    def make_request_batch(self, requests: typing.Tuple[str, typing.Any]) -> typing.List[web3.types.RPCResponse]:
-        obj = []
-        for method, params in requests:
-            rpc_dict = {
-                "jsonrpc": "2.0",
-                "method": method,
-                "params": params or [],
-                "id": next(self.request_counter),
-            }
-            obj.append(rpc_dict)
-        payload = json.dumps(obj).encode('ascii')
-
-        future = asyncio.run_coroutine_threadsafe(
-            self._internal_provider.coro_make_request(payload),
-            web3.WebsocketProvider._loop
-        )
-        ret = future.result()
-        ret = sorted(ret, key=lambda x: x['id'])
+    async def _coro_make_request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        ret = await self.pool.request_batch(requests)
+        if self.recorder is not None:
+            for (method, params), resp in zip(requests, ret):
+                self.recorder.record(method, params, resp)
         return ret
 
-
     @backoff.on_exception(
         backoff.expo,
         (
@@ -158,17 +219,171 @@ class RetryingProvider(JSONBaseProvider):
         ),
         max_time = 10 * 60,
         factor = 4,
-        on_backoff = lambda x: x['args'][0]._connect()
     )
-    def make_request(self, method, params):
-        request_data = self.encode_rpc_request(method, params)
-        future = asyncio.run_coroutine_threadsafe(
-            self._internal_provider.coro_make_request(request_data),
-            web3.WebsocketProvider._loop
-        )
-        ret = future.result()
+    async def _coro_make_request(self, method, params) -> web3.types.RPCResponse:
+        ret = await self.pool.request(method, params)
+        if self.recorder is not None:
+            self.recorder.record(method, params, ret)
+        return ret
+
+    async def coro_make_request(self, method, params) -> web3.types.RPCResponse:
+        """
+        Make the request; if an identical read is already in flight, wait for its response
+        instead of sending another.
+        """
+        if method not in COALESCED_METHODS:
+            return await self._coro_make_request(method, params)
+
+        # only ever touched from the event loop, so needs no lock
+        key = (method, json.dumps(params, sort_keys=True))
+        fut = self._in_flight.get(key, None)
+        if fut is not None:
+            inc_count('rpc.coalesced')
+            return dict(await asyncio.shield(fut))
+
+        fut = asyncio.ensure_future(self._coro_make_request(method, params))
+        self._in_flight[key] = fut
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            if self._in_flight.get(key, None) is fut:
+                del self._in_flight[key]
+
+    async def coro_make_request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        """
+        Make the requests as one batch, less any reads identical to one already in flight,
+        whose responses are awaited instead.
+        """
+        ret: typing.List[typing.Optional[web3.types.RPCResponse]] = [None] * len(requests)
+        to_send: typing.List[int] = []
+        waiting: typing.Dict[int, asyncio.Future] = {}
+        mine: typing.Dict[int, typing.Tuple[typing.Tuple[str, str], asyncio.Future]] = {}
+
+        for i, (method, params) in enumerate(requests):
+            if method in COALESCED_METHODS:
+                key = (method, json.dumps(params, sort_keys=True))
+                fut = self._in_flight.get(key, None)
+                if fut is not None:
+                    inc_count('rpc.coalesced')
+                    waiting[i] = fut
+                    continue
+                fut = asyncio.get_running_loop().create_future()
+                # do not warn about an unretrieved exception if nobody else waited on this
+                fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._in_flight[key] = fut
+                mine[i] = (key, fut)
+            to_send.append(i)
+
+        try:
+            if len(to_send) > 0:
+                resps = await self._coro_make_request_batch([requests[i] for i in to_send])
+                for i, resp in zip(to_send, resps):
+                    ret[i] = resp
+                    if i in mine:
+                        mine[i][1].set_result(resp)
+        except BaseException as e:
+            for _, fut in mine.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            raise
+        finally:
+            for key, fut in mine.values():
+                if self._in_flight.get(key, None) is fut:
+                    del self._in_flight[key]
+
+        for i, fut in waiting.items():
+            ret[i] = dict(await asyncio.shield(fut))
+        return ret
+
+    def make_request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        if self.cache is None:
+            return self._run(self.coro_make_request_batch(requests))
+
+        ret = [self._cache_get(method, params) for method, params in requests]
+        missing = [i for i, resp in enumerate(ret) if resp is None]
+        if len(missing) > 0:
+            resps = self._run(self.coro_make_request_batch([requests[i] for i in missing]))
+            for i, resp in zip(missing, resps):
+                self._cache_put(requests[i][0], requests[i][1], resp)
+                ret[i] = resp
+        return ret
+
+    def make_request(self, method, params) -> web3.types.RPCResponse:
+        ret = self._cache_get(method, params)
+        if ret is None:
+            ret = self._run(self.coro_make_request(method, params))
+            self._cache_put(method, params, ret)
+        return ret
+
+    def submit_request(self, method, params) -> 'concurrent.futures.Future[web3.types.RPCResponse]':
+        """
+        Send the request without waiting for its response, which the returned future resolves to
+        """
+        cached = self._cache_get(method, params)
+        if cached is not None:
+            ret = concurrent.futures.Future()
+            ret.set_result(cached)
+            return ret
+
+        # the coroutine runs in a copy of this context, so it sees the tag
+        rpc_tag.set(span_path())
+        ret = asyncio.run_coroutine_threadsafe(self.coro_make_request(method, params), get_event_loop())
+        if self.cache is not None:
+            # the callback runs on the event loop, so it cannot query the head block itself
+            finalized_block = self.get_finalized_block()
+            def put(f: concurrent.futures.Future):
+                if f.exception() is None:
+                    self._cache_put(method, params, f.result(), finalized_block)
+            ret.add_done_callback(put)
         return ret
 
+    def _cache_get(self, method, params) -> typing.Optional[web3.types.RPCResponse]:
+        if self.cache is None:
+            return None
+        if method != 'eth_getTransactionReceipt':
+            block = rpc_cache.block_of_request(method, params)
+            if block is None or block > self.get_finalized_block():
+                return None
+        result = self.cache.get(method, params)
+        if result is None:
+            return None
+        ret = {'jsonrpc': '2.0', 'id': 0, 'result': result}
+        if self.recorder is not None:
+            self.recorder.record(method, params, ret)
+        return ret
+
+    def _cache_put(self, method, params, response: web3.types.RPCResponse, finalized_block: typing.Optional[int] = None):
+        if self.cache is None or 'error' in response or 'result' not in response:
+            return
+        if method == 'eth_getTransactionReceipt':
+            block = rpc_cache.block_of_response(method, response)
+        else:
+            block = rpc_cache.block_of_request(method, params)
+        if block is None:
+            return
+        if finalized_block is None:
+            finalized_block = self.get_finalized_block()
+        if block > finalized_block:
+            return
+        self.cache.put(method, params, response['result'])
+
+    def get_finalized_block(self) -> int:
+        """
+        Latest block considered final, from a head block number refreshed at most once a minute
+        """
+        with self._head_lock:
+            if self._head_block is None or self._head_block_updated + 60 < time.time():
+                resp = self._run(self.coro_make_request('eth_blockNumber', []))
+                self._head_block = int(resp['result'], 16)
+                self._head_block_updated = time.time()
+            return self._head_block - rpc_cache.CONFIRMATIONS
+
+    def _run(self, coro: typing.Coroutine):
+        assert threading.current_thread().name != 'async-rpc', 'cannot block the RPC event loop'
+        # the coroutine runs in a copy of this context, so it sees the tag
+        rpc_tag.set(span_path())
+        return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
 
 # class RetryingProvider(JSONBaseProvider):
 #     _internal_provider: web3.HTTPProvider
@@ -223,7 +438,7 @@ class RetryingProvider(JSONBaseProvider):
 
 
 def connect_web3() -> web3.Web3:
-    w3 = web3.Web3(RetryingProvider())
+    w3 = web3.Web3(RetryingProvider(cache=open_default_cache(), recorder=open_default_recorder()))
 
     if not w3.isConnected():
         l.error(f'Could not connect to web3')
@@ -543,18 +758,142 @@ def get_abi(abiname) -> typing.Any:
     return abi
 
 
-def get_block_logs(w3: web3.Web3, block_identifier: int) -> typing.List[web3.types.LogReceipt]:
+# providers whose node does not support eth_getBlockReceipts (weak, so a new provider
+# allocated at a dead one's address is not mistaken for it)
+_no_block_receipts: 'weakref.WeakSet[web3.providers.BaseProvider]' = weakref.WeakSet()
+
+
+def _is_method_unsupported(error: typing.Any) -> bool:
+    """
+    Whether a JSON-RPC error means the node does not implement the method at all
+    (as opposed to a transient failure, or a block it has not seen).
+    """
+    if not isinstance(error, dict):
+        return False
+    if error.get('code', None) == -32601:
+        return True
+    message = str(error.get('message', '')).lower()
+    return 'method' in message and 'does not exist' in message
+
+
+def _format_receipt(resp: web3.types.RPCResponse) -> web3.types.TxReceipt:
+    if 'error' in resp:
+        raise Exception(f'Could not get receipt: {resp["error"]}')
+    if resp['result'] is None:
+        raise web3.exceptions.TransactionNotFound('Transaction not found')
+    return web3.datastructures.AttributeDict.recursive(receipt_formatter(resp['result']))
+
+
+def iter_transaction_receipts(
+        w3: web3.Web3,
+        txn_hashes: typing.Sequence[typing.Union[bytes, str]],
+        batch_size: int = 200,
+    ) -> typing.Iterator[web3.types.TxReceipt]:
+    """
+    Yield the receipts for the given transactions (in order), fetching them batch_size at a time
+    """
+    txn_hashes = [h if isinstance(h, str) else '0x' + bytes(h).hex() for h in txn_hashes]
+
+    if not hasattr(w3.provider, 'make_request_batch'):
+        for h in txn_hashes:
+            yield w3.eth.get_transaction_receipt(h)
+        return
+
+    for i in range(0, len(txn_hashes), batch_size):
+        batch = txn_hashes[i : i + batch_size]
+        with profile('fetch_receipts'):
+            resps = w3.provider.make_request_batch([('eth_getTransactionReceipt', [h]) for h in batch])
+        assert len(resps) == len(batch)
+        for resp in resps:
+            yield _format_receipt(resp)
+
+
+def get_transaction_receipts(
+        w3: web3.Web3,
+        txn_hashes: typing.Sequence[typing.Union[bytes, str]],
+        batch_size: int = 200,
+    ) -> typing.List[web3.types.TxReceipt]:
+    """
+    Get the receipts for all the given transactions (in order), in as few round-trips as possible
+    """
+    return list(iter_transaction_receipts(w3, txn_hashes, batch_size))
+
+
+def get_block_receipts(w3: web3.Web3, block_identifier: web3.types.BlockIdentifier) -> typing.List[web3.types.TxReceipt]:
+    """
+    Get the receipts of every transaction in the block, in order; uses eth_getBlockReceipts
+    where the node supports it, else batched receipt requests.
+    """
+    if w3.provider not in _no_block_receipts:
+        with profile('fetch_receipts'):
+            encoded = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+            resp = w3.provider.make_request('eth_getBlockReceipts', [encoded])
+        if 'error' not in resp and resp.get('result', None) is not None:
+            return [web3.datastructures.AttributeDict.recursive(receipt_formatter(r)) for r in resp['result']]
+        if _is_method_unsupported(resp.get('error', None)):
+            l.debug(f'eth_getBlockReceipts not supported ({resp["error"]}), using batched receipts from now on')
+            _no_block_receipts.add(w3.provider)
+        else:
+            # transient error or unknown block: fall back for this call only
+            l.debug(f'eth_getBlockReceipts failed ({resp.get("error", None)}), falling back to batched receipts')
+
     block = w3.eth.get_block(block_identifier)
-    
+    return get_transaction_receipts(w3, block['transactions'])
+
+
+def get_block_logs(w3: web3.Web3, block_identifier: web3.types.BlockIdentifier) -> typing.List[web3.types.LogReceipt]:
     logs = []
-    for txn in block['transactions']:
-        receipt = w3.eth.get_transaction_receipt(txn)
+    for receipt in get_block_receipts(w3, block_identifier):
         logs.extend(receipt['logs'])
     return logs
 
 
-_block_timestamp_cache: typing.Dict[int, int] = {}
+_block_timestamp_cache = cachetools.LRUCache(maxsize=10_000)
+memory.register_cache('block_timestamp_cache', lambda: _block_timestamp_cache)
+_header_store_lock = threading.Lock()
+
+
+def get_header_store(w3: web3.Web3) -> typing.Optional[HeaderStore]:
+    """
+    Get the shared header store for the given (mainnet) connection, or None if it has none.
+
+    Only RetryingProvider connections get one, since a fork (ie ganache) has headers of its own.
+    The store lives at HEADER_STORE_DIR (default: STORAGE_DIR/headers); set it to an empty
+    string to disable the store.
+
+    The store is kept on the provider, so it lives (and is shared) exactly as long as the connection.
+    """
+    provider = w3.provider
+    if not isinstance(provider, RetryingProvider):
+        return None
+    with _header_store_lock:
+        if not provider._header_store_opened:
+            default_dir = os.path.join(os.getenv('STORAGE_DIR', '/mnt/goldphish'), 'headers')
+            directory = os.getenv('HEADER_STORE_DIR', default_dir)
+            if directory != '':
+                if not os.path.isdir(directory) and os.path.isdir(os.path.dirname(directory)):
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.isdir(directory):
+                    provider._header_store = HeaderStore(w3, directory)
+            provider._header_store_opened = True
+        return provider._header_store
+
+
+def get_bloom_index(w3: web3.Web3) -> typing.Optional[BloomIndex]:
+    """
+    Get a logsBloom index over the shared header store, or None if there is no header store
+    """
+    store = get_header_store(w3)
+    if store is None:
+        return None
+    return BloomIndex(store)
+
+
 def get_block_timestamp(w3: web3.Web3, block_number: int) -> int:
+    store = get_header_store(w3)
+    if store is not None:
+        return store.timestamp(block_number)
+
     got = _block_timestamp_cache.get(block_number, None)
     
     if got is not None:
@@ -638,6 +977,8 @@ class ProgressReporter:
         """
         now = time.time()
         self._observed_items += n_items
+        metrics.set_gauge('progress_items', self._observed_items + self._start_val)
+        metrics.set_gauge('progress_total_items', self._total_items)
 
         self._sma_points.append((now, self._observed_items))
 
@@ -662,6 +1003,7 @@ class ProgressReporter:
                 items_remaining = self._total_items - (self._observed_items + self._start_val)
                 eta_seconds = items_remaining / items_ps
                 eta_pretty = pretty_time_delta(eta_seconds)
+                metrics.set_gauge('progress_items_per_second', items_ps)
                 self._log.info(f'Progress: {self._observed_items + self._start_val} / {self._total_items} ({self._observed_items / (self._total_items - self._start_val) * 100 :.2f}%) - ETA {eta_pretty}')
                 self._last_screen_print_ts = now
                 ret = True
@@ -0,0 +1,221 @@
+"""
+utils/async_rpc.py
+
+Asyncio-native JSON-RPC client which pipelines many outstanding requests
+over a single websocket, matching responses to requests by id.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import threading
+import time
+import typing
+import logging
+
+import websockets
+import websockets.exceptions
+import web3.types
+
+from .profiling import record_rpc
+
+l = logging.getLogger(__name__)
+
+# what the requests are made for (ie, the caller's profiling span), for accounting
+rpc_tag: contextvars.ContextVar[str] = contextvars.ContextVar('rpc_tag', default='')
+
+_loop: typing.Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+class RPCBatchError(Exception):
+    """
+    The node did not answer a batch with one response per request (ie, it rejected the whole batch)
+    """
+    pass
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Gets the event loop that all clients run on, starting it in a daemon thread if needed
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            t = threading.Thread(target=_loop.run_forever, name='async-rpc', daemon=True)
+            t.start()
+    return _loop
+
+
+class AsyncJSONRPCClient:
+    """
+    JSON-RPC over one websocket, with any number of requests in flight.
+
+    The connection is opened lazily, and re-opened on the next request after it
+    closes; requests outstanding when it closes fail with ConnectionClosedError.
+    Batches are matched by any of their ids; a response that cannot be matched to one
+    (a rejection of a whole batch, which has no id) fails every batch outstanding on the
+    connection with RPCBatchError.
+    All methods must be awaited on the loop from get_event_loop().
+    """
+    endpoint_uri: str
+    timeout: float
+
+    _ws: typing.Optional[websockets.WebSocketClientProtocol]
+    # request id -> (connection, future, whether it is part of a batch); every id of a batch maps to the batch's future
+    _pending: typing.Dict[int, typing.Tuple[websockets.WebSocketClientProtocol, asyncio.Future, bool]]
+
+    def __init__(self, endpoint_uri: str, timeout: float = 60 * 5, max_size: int = 1024 * 1024 * 1024) -> None:
+        self.endpoint_uri = endpoint_uri
+        self.timeout = timeout
+        self._max_size = max_size
+        self._ws = None
+        self._connect_lock = None
+        self._pending = {}
+        self._n_outstanding = 0
+        self._ids = itertools.count()
+
+    @property
+    def n_outstanding(self) -> int:
+        # a batch counts once
+        return self._n_outstanding
+
+    async def request(self, method: str, params: typing.Any) -> web3.types.RPCResponse:
+        request_id = next(self._ids)
+        payload = {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params or [],
+            'id': request_id,
+        }
+        message = json.dumps(payload)
+        t_start = time.perf_counter_ns()
+        ret, n_bytes_received = await self._send([request_id], message, False)
+        record_rpc(rpc_tag.get(), method, len(message), n_bytes_received, time.perf_counter_ns() - t_start)
+        return ret
+
+    async def request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        """
+        Send the requests as one JSON-RPC batch; responses are returned in request order.
+
+        Raises RPCBatchError if the node rejects the batch as a whole, or leaves out the response to any request.
+        """
+        if len(requests) == 0:
+            return []
+
+        payload = []
+        for method, params in requests:
+            payload.append({
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params or [],
+                'id': next(self._ids),
+            })
+
+        # the batch response is routed by any of its ids
+        message = json.dumps(payload)
+        t_start = time.perf_counter_ns()
+        ret, n_bytes_received = await self._send([x['id'] for x in payload], message, True)
+        elapsed_ns = time.perf_counter_ns() - t_start
+
+        # bytes are split evenly over the batch, everything in it saw the same latency
+        tag = rpc_tag.get()
+        for method, _ in requests:
+            record_rpc(tag, method, len(message) // len(requests), n_bytes_received // len(requests), elapsed_ns)
+
+        if not isinstance(ret, list):
+            raise RPCBatchError(f'Batch of {len(requests)} requests was answered with {json.dumps(ret)[:1000]}')
+
+        by_id = {r['id']: r for r in ret if isinstance(r, dict) and r.get('id', None) is not None}
+        missing = [x for x in payload if x['id'] not in by_id]
+        if len(missing) > 0:
+            unattributed = [r for r in ret if not isinstance(r, dict) or r.get('id', None) is None]
+            raise RPCBatchError(
+                f'No response to {len(missing)} of {len(requests)} requests in batch (first: {missing[0]["method"]} id={missing[0]["id"]}); '
+                f'responses without an id: {json.dumps(unattributed)[:1000]}'
+            )
+        return [by_id[x['id']] for x in payload]
+
+    def reset(self):
+        """
+        Drop the current connection (failing whatever is outstanding on it); the next request reconnects.
+        """
+        ws = self._ws
+        self._ws = None
+        if ws is not None:
+            asyncio.run_coroutine_threadsafe(ws.close(), get_event_loop())
+
+    async def _send(self, keys: typing.List[int], message: str, is_batch: bool) -> typing.Tuple[typing.Any, int]:
+        """
+        Send the message and wait for the response to any of `keys` (its request ids); returns
+        the parsed response and its size in bytes
+        """
+        ws = await self._ensure_connected()
+        fut = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._pending[key] = (ws, fut, is_batch)
+        self._n_outstanding += 1
+        try:
+            await asyncio.wait_for(ws.send(message), timeout=self.timeout)
+            return await asyncio.wait_for(fut, timeout=self.timeout)
+        finally:
+            self._n_outstanding -= 1
+            for key in keys:
+                self._pending.pop(key, None)
+
+    async def _ensure_connected(self) -> websockets.WebSocketClientProtocol:
+        if self._ws is not None and not self._ws.closed:
+            return self._ws
+
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._ws is None or self._ws.closed:
+                l.debug(f'connecting to {self.endpoint_uri}')
+                ws = await asyncio.wait_for(
+                    websockets.connect(self.endpoint_uri, max_size=self._max_size),
+                    timeout=self.timeout,
+                )
+                self._ws = ws
+                asyncio.ensure_future(self._read_forever(ws))
+        return self._ws
+
+    async def _read_forever(self, ws: websockets.WebSocketClientProtocol):
+        try:
+            async for message in ws:
+                response = json.loads(message)
+                responses = response if isinstance(response, list) else [response]
+                keys = [r.get('id', None) for r in responses if isinstance(r, dict)]
+
+                maybe_pending = next((self._pending[k] for k in keys if k is not None and k in self._pending), None)
+                if maybe_pending is not None:
+                    _, fut, _ = maybe_pending
+                    if not fut.done():
+                        fut.set_result((response, len(message)))
+                elif all(k is None for k in keys):
+                    # cannot tell which batch this answers (ie, geth's 'batch too large'), so
+                    # fail every batch outstanding on this connection rather than leave it waiting
+                    exc = RPCBatchError(f'Batch rejected: {message[:1000]}')
+                    n_failed = 0
+                    for ws_, fut, is_batch in list(self._pending.values()):
+                        if ws_ is ws and is_batch and not fut.done():
+                            fut.set_exception(exc)
+                            n_failed += 1
+                    if n_failed == 0:
+                        l.warning(f'Got response without a request id: {message[:1000]}')
+                else:
+                    l.warning(f'Got response for unknown request ids={keys}')
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception:
+            l.exception('Unexpected error reading from websocket')
+            await ws.close()
+        finally:
+            exc = websockets.exceptions.ConnectionClosedError(ws.close_code or 1006, ws.close_reason or '')
+            for ws_, fut, _ in list(self._pending.values()):
+                if ws_ is ws and not fut.done():
+                    fut.set_exception(exc)
+            if self._ws is ws:
+                self._ws = None
@@ -0,0 +1,106 @@
+"""
+utils/bloom_index.py
+
+Answers "which blocks might have logs from these addresses / with these topics"
+from the blocks' logsBloom, using the header store, so that sparse scans
+only need to fetch logs for a handful of blocks.
+"""
+import typing
+import logging
+
+import numpy as np
+from eth_utils import keccak
+
+from .header_store import HeaderStore
+from .profiling import inc_count, profile
+
+l = logging.getLogger(__name__)
+
+
+def bloom_bits(item: bytes) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the (byte index, bit mask) pairs which `item` sets in a 2048-bit logsBloom
+    (see the yellow paper, section 4.3.1)
+    """
+    h = keccak(item)
+    byte_idxs = []
+    masks = []
+    for i in range(0, 6, 2):
+        bit = ((h[i] << 8) | h[i + 1]) & 2047
+        # the bloom is big-endian, so bit 0 is in the last byte
+        byte_idxs.append(255 - bit // 8)
+        masks.append(1 << (bit % 8))
+    return np.array(byte_idxs, dtype=np.intp), np.array(masks, dtype=np.uint8)
+
+
+def bloom_matches(blooms: np.ndarray, items: typing.Iterable[bytes]) -> np.ndarray:
+    """
+    For a (n, 256) array of blooms, get a boolean array of which blooms may contain any of the items
+    """
+    ret = np.zeros(blooms.shape[0], dtype=bool)
+    for item in items:
+        byte_idxs, masks = bloom_bits(item)
+        ret |= np.all((blooms[:, byte_idxs] & masks) == masks, axis=1)
+    return ret
+
+
+class BloomIndex:
+    """
+    Matching follows eth_getLogs filters: a block is a candidate if its bloom may contain
+    any of the addresses (if given) AND any of the topics (if given). Blooms have
+    false positives but never false negatives, so non-candidate blocks can be skipped.
+    """
+
+    def __init__(self, header_store: HeaderStore, chunk_size: int = 10_000) -> None:
+        self._header_store = header_store
+        self.chunk_size = chunk_size
+
+    def candidate_blocks(
+            self,
+            start_block: int,
+            end_block: int,
+            addresses: typing.Optional[typing.Iterable[str]] = None,
+            topics: typing.Optional[typing.Iterable[bytes]] = None,
+        ) -> typing.List[int]:
+        """
+        Get the blocks in [start_block, end_block] (ascending) that might have matching logs
+        """
+        assert start_block <= end_block
+        assert addresses is not None or topics is not None
+        address_items = None if addresses is None else [bytes.fromhex(a[2:]) for a in addresses]
+        topic_items = None if topics is None else [bytes(t) for t in topics]
+
+        ret = []
+        with profile('bloom_index.candidate_blocks'):
+            for chunk_start in range(start_block, end_block + 1, self.chunk_size):
+                chunk_end = min(end_block + 1, chunk_start + self.chunk_size)
+                blooms = self._header_store.logs_blooms(chunk_start, chunk_end)
+                mask = np.ones(blooms.shape[0], dtype=bool)
+                if address_items is not None:
+                    mask &= bloom_matches(blooms, address_items)
+                if topic_items is not None:
+                    mask &= bloom_matches(blooms, topic_items)
+                ret.extend(int(x) + chunk_start for x in np.flatnonzero(mask))
+
+        inc_count('bloom_index.blocks_scanned', end_block - start_block + 1)
+        inc_count('bloom_index.candidates', len(ret))
+        return ret
+
+    def iter_candidates_backward(
+            self,
+            on_or_before: int,
+            addresses: typing.Optional[typing.Iterable[str]] = None,
+            topics: typing.Optional[typing.Iterable[bytes]] = None,
+            not_before: int = 0,
+        ) -> typing.Iterator[int]:
+        """
+        Yields candidate blocks (as candidate_blocks) walking backward from `on_or_before`
+        down to `not_before`, for finding the most recent activity of an address
+        """
+        addresses = None if addresses is None else list(addresses)
+        topics = None if topics is None else list(topics)
+        chunk_end = on_or_before
+        while chunk_end >= not_before:
+            chunk_start = max(not_before, chunk_end - self.chunk_size + 1)
+            yield from reversed(self.candidate_blocks(chunk_start, chunk_end, addresses, topics))
+            chunk_end = chunk_start - 1
@@ -0,0 +1,187 @@
+"""
+utils/endpoint_pool.py
+
+Spreads JSON-RPC requests over a pool of connections to several (archive) nodes,
+ejecting nodes that fail or fall behind the others on latency.
+"""
+import asyncio
+import statistics
+import time
+import typing
+import logging
+
+import websockets.exceptions
+import web3.types
+
+from . import metrics
+from .async_rpc import AsyncJSONRPCClient
+from .profiling import PRINT_INTERVAL_SECONDS
+
+l = logging.getLogger(__name__)
+
+# smoothing factor for the exponentially-weighted moving average of latency
+LATENCY_EWMA_ALPHA = 0.05
+
+
+class EndpointStats:
+    endpoint_uri: str
+    latency_ewma: typing.Optional[float]
+    n_requests: int
+    n_failures: int
+    n_ejections: int
+    ejected_until: float
+
+    def __init__(self, endpoint_uri: str) -> None:
+        self.endpoint_uri = endpoint_uri
+        self.latency_ewma = None
+        self.n_requests = 0
+        self.n_failures = 0
+        self.n_ejections = 0
+        self.ejected_until = 0.0
+
+    def record_latency(self, elapsed: float):
+        self.n_requests += 1
+        if self.latency_ewma is None:
+            self.latency_ewma = elapsed
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (elapsed - self.latency_ewma)
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class EndpointPool:
+    """
+    A fixed number of AsyncJSONRPCClients per endpoint. Each request goes to the
+    client with the least outstanding work among endpoints not currently ejected.
+
+    An endpoint is ejected for `eject_seconds` when a request to it fails, or when
+    its latency average is `slow_factor` times the median of the other endpoints.
+    Failed requests are NOT retried here; the caller is expected to retry, which
+    then routes around the ejected endpoint.
+    """
+    stats: typing.Dict[str, EndpointStats]
+    _clients: typing.List[typing.Tuple[EndpointStats, AsyncJSONRPCClient]]
+
+    def __init__(
+            self,
+            endpoint_uris: typing.Sequence[str],
+            connections_per_endpoint: int = 2,
+            eject_seconds: float = 30,
+            slow_factor: float = 4,
+            min_requests_before_slow: int = 100,
+            timeout: float = 60 * 5,
+            max_size: int = 1024 * 1024 * 1024,
+        ) -> None:
+        assert len(endpoint_uris) > 0
+        assert connections_per_endpoint > 0
+        self.eject_seconds = eject_seconds
+        self.slow_factor = slow_factor
+        self.min_requests_before_slow = min_requests_before_slow
+        self.stats = {}
+        self._clients = []
+        self._last_log = time.time()
+        for endpoint_uri in endpoint_uris:
+            stats = EndpointStats(endpoint_uri)
+            self.stats[endpoint_uri] = stats
+            for _ in range(connections_per_endpoint):
+                client = AsyncJSONRPCClient(endpoint_uri, timeout=timeout, max_size=max_size)
+                self._clients.append((stats, client))
+            metrics.register_gauge('rpc_outstanding_requests', lambda uri=endpoint_uri: self.n_outstanding(uri), endpoint=endpoint_uri)
+            metrics.register_gauge('rpc_latency_ewma_seconds', lambda stats=stats: stats.latency_ewma, endpoint=endpoint_uri)
+            metrics.register_gauge('rpc_endpoint_ejected', lambda stats=stats: int(stats.is_ejected(time.time())), endpoint=endpoint_uri)
+
+    async def request(self, method: str, params: typing.Any) -> web3.types.RPCResponse:
+        stats, client = self._choose()
+        return await self._timed(stats, client, client.request(method, params))
+
+    async def request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        stats, client = self._choose()
+        return await self._timed(stats, client, client.request_batch(requests))
+
+    def n_outstanding(self, endpoint_uri: str) -> int:
+        """
+        Number of requests awaiting a response from the given endpoint
+        """
+        return sum(c.n_outstanding for s, c in self._clients if s.endpoint_uri == endpoint_uri)
+
+    def reset(self):
+        """
+        Drop all connections; they re-open on next use.
+        """
+        for _, client in self._clients:
+            client.reset()
+
+    def maybe_log_stats(self):
+        """
+        Log per-endpoint stats, if enough time has passed since they were last logged
+        """
+        if time.time() < self._last_log + PRINT_INTERVAL_SECONDS:
+            return
+        self.log_stats()
+
+    def log_stats(self):
+        now = time.time()
+        self._last_log = now
+        for stats in self.stats.values():
+            latency = 'n/a' if stats.latency_ewma is None else f'{stats.latency_ewma * 1000:.1f}ms'
+            l.debug(
+                f'endpoint {stats.endpoint_uri} latency={latency} requests={stats.n_requests:,} '
+                f'failures={stats.n_failures:,} ejections={stats.n_ejections:,} '
+                f'ejected={stats.is_ejected(now)}'
+            )
+
+    def _choose(self) -> typing.Tuple[EndpointStats, AsyncJSONRPCClient]:
+        now = time.time()
+        candidates = [(s, c) for s, c in self._clients if not s.is_ejected(now)]
+        if len(candidates) == 0:
+            # everything is ejected -- use whichever comes back soonest
+            soonest = min(s.ejected_until for s, _ in self._clients)
+            candidates = [(s, c) for s, c in self._clients if s.ejected_until == soonest]
+
+        def work(sc: typing.Tuple[EndpointStats, AsyncJSONRPCClient]) -> typing.Tuple[float, int]:
+            s, c = sc
+            latency = s.latency_ewma if s.latency_ewma is not None else 0.0
+            return (c.n_outstanding + 1) * latency, c.n_outstanding
+
+        return min(candidates, key=work)
+
+    async def _timed(self, stats: EndpointStats, client: AsyncJSONRPCClient, coro: typing.Awaitable) -> typing.Any:
+        t_start = time.monotonic()
+        try:
+            ret = await coro
+        except (websockets.exceptions.ConnectionClosedError, asyncio.exceptions.TimeoutError):
+            stats.n_failures += 1
+            self._eject(stats, 'request failed')
+            client.reset()
+            raise
+        stats.record_latency(time.monotonic() - t_start)
+        self._check_slow(stats)
+        self.maybe_log_stats()
+        return ret
+
+    def _check_slow(self, stats: EndpointStats):
+        if len(self.stats) < 2 or stats.n_requests < self.min_requests_before_slow:
+            return
+        others = [
+            s.latency_ewma for s in self.stats.values()
+            if s is not stats and s.latency_ewma is not None and s.n_requests >= self.min_requests_before_slow
+        ]
+        if len(others) == 0:
+            return
+        now = time.time()
+        if all(s.is_ejected(now) for s in self.stats.values() if s is not stats):
+            # never eject the last endpoint standing for being slow
+            return
+        if stats.latency_ewma > self.slow_factor * statistics.median(others):
+            self._eject(stats, f'latency {stats.latency_ewma * 1000:.1f}ms is too slow')
+            # start over once it comes back, otherwise it is ejected again immediately
+            stats.latency_ewma = statistics.median(others)
+
+    def _eject(self, stats: EndpointStats, reason: str):
+        now = time.time()
+        if stats.is_ejected(now):
+            return
+        l.warning(f'Ejecting endpoint {stats.endpoint_uri} for {self.eject_seconds} seconds: {reason}')
+        stats.ejected_until = now + self.eject_seconds
+        stats.n_ejections += 1
@@ -0,0 +1,192 @@
+"""
+utils/header_store.py
+
+Persistent store of the block-header fields we use (timestamp, hash, base fee,
+logs bloom), kept as fixed-size records in memory-mapped segment files so
+that any block can be looked up without an RPC.
+"""
+import os
+import tempfile
+import typing
+import logging
+
+import cachetools
+import numpy as np
+import web3
+import web3.types
+
+from .profiling import inc_count, profile
+
+l = logging.getLogger(__name__)
+
+BLOCKS_PER_SEGMENT = 100_000
+
+HEADER_DTYPE = np.dtype([
+    ('present', 'u1'),
+    ('timestamp', '<u8'),
+    ('base_fee', '<u8'),
+    ('hash', 'u1', (32,)),
+    ('logs_bloom', 'u1', (256,)),
+])
+
+
+class HeaderStore:
+    """
+    Headers are loaded in batches of eth_getBlockByNumber, reading ahead of the
+    requested block, since callers almost always scan forward.
+
+    Only finalized blocks are persisted (per the provider's get_finalized_block(), if
+    it has one); newer headers are fetched one at a time and kept in memory only.
+
+    Segment files are shared by all processes on the host: a segment is created
+    atomically (by hard-linking a complete file into place), and each record's
+    `present` flag is set only after the rest of the record is written.
+    """
+    directory: str
+    read_ahead: int
+    batch_size: int
+
+    _segments: typing.Dict[int, np.memmap]
+
+    def __init__(self, w3: web3.Web3, directory: str, read_ahead: int = 1_000, batch_size: int = 100) -> None:
+        assert os.path.isdir(directory)
+        self._w3 = w3
+        self.directory = directory
+        self.read_ahead = read_ahead
+        self.batch_size = batch_size
+        self._segments = {}
+        self._unfinalized = cachetools.LRUCache(maxsize=1_000)
+
+    def get(self, block_number: int) -> np.void:
+        """
+        Get the header record for the given block
+        """
+        segment = self._segment(block_number // BLOCKS_PER_SEGMENT)
+        rec = segment[block_number % BLOCKS_PER_SEGMENT]
+        if rec['present']:
+            return rec
+
+        finalized_block = self._finalized_block()
+        if block_number > finalized_block:
+            ret = self._unfinalized.get(block_number, None)
+            if ret is None:
+                ret = _to_record(self._w3.provider.make_request('eth_getBlockByNumber', [hex(block_number), False]))
+                self._unfinalized[block_number] = ret
+            return ret
+
+        inc_count('header_store.miss')
+        self.prefetch(block_number, min(block_number + self.read_ahead, finalized_block + 1))
+        rec = segment[block_number % BLOCKS_PER_SEGMENT]
+        assert rec['present']
+        return rec
+
+    def timestamp(self, block_number: int) -> int:
+        return int(self.get(block_number)['timestamp'])
+
+    def base_fee(self, block_number: int) -> int:
+        return int(self.get(block_number)['base_fee'])
+
+    def block_hash(self, block_number: int) -> bytes:
+        return self.get(block_number)['hash'].tobytes()
+
+    def logs_bloom(self, block_number: int) -> bytes:
+        return self.get(block_number)['logs_bloom'].tobytes()
+
+    def logs_blooms(self, start_block: int, end_block: int) -> np.ndarray:
+        """
+        Get the logs blooms of blocks in [start_block, end_block), as a (n_blocks, 256) array of bytes
+        """
+        assert start_block <= end_block
+        self.prefetch(start_block, end_block)
+
+        ret = np.empty((end_block - start_block, 256), dtype=np.uint8)
+        block_number = start_block
+        while block_number < end_block:
+            segment_id = block_number // BLOCKS_PER_SEGMENT
+            segment_end = min(end_block, (segment_id + 1) * BLOCKS_PER_SEGMENT)
+            segment = self._segment(segment_id)
+            lo = block_number % BLOCKS_PER_SEGMENT
+            hi = lo + segment_end - block_number
+            ret[block_number - start_block : segment_end - start_block] = segment['logs_bloom'][lo:hi]
+
+            # anything not persisted (ie, not yet finalized) is fetched individually
+            for idx in np.flatnonzero(segment['present'][lo:hi] == 0):
+                ret[block_number - start_block + idx] = self.get(block_number + int(idx))['logs_bloom']
+
+            block_number = segment_end
+        return ret
+
+    def prefetch(self, start_block: int, end_block: int):
+        """
+        Ensure all (finalized) headers in [start_block, end_block) are stored
+        """
+        end_block = min(end_block, self._finalized_block() + 1)
+        missing = [
+            b for b in range(start_block, end_block)
+            if not self._segment(b // BLOCKS_PER_SEGMENT)['present'][b % BLOCKS_PER_SEGMENT]
+        ]
+        if len(missing) == 0:
+            return
+
+        with profile('header_store.fetch'):
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i : i + self.batch_size]
+                resps = self._w3.provider.make_request_batch([
+                    ('eth_getBlockByNumber', [hex(b), False]) for b in batch
+                ])
+                assert len(resps) == len(batch)
+                for block_number, resp in zip(batch, resps):
+                    rec = _to_record(resp)
+                    assert rec['present']
+                    segment = self._segment(block_number // BLOCKS_PER_SEGMENT)
+                    idx = block_number % BLOCKS_PER_SEGMENT
+                    rec['present'] = 0
+                    segment[idx] = rec
+                    segment['present'][idx] = 1
+
+    def _finalized_block(self) -> int:
+        if hasattr(self._w3.provider, 'get_finalized_block'):
+            return self._w3.provider.get_finalized_block()
+        return -1
+
+    def _segment(self, segment_id: int) -> np.memmap:
+        ret = self._segments.get(segment_id, None)
+        if ret is not None:
+            return ret
+
+        fname = os.path.join(self.directory, f'headers_{segment_id:05d}.npy')
+        if not os.path.exists(fname):
+            # create under a temporary name and link into place, so nobody sees a partial file
+            fd, tmp_fname = tempfile.mkstemp(dir=self.directory, suffix='.npy.tmp')
+            os.close(fd)
+            os.chmod(tmp_fname, 0o644)
+            seg = np.lib.format.open_memmap(tmp_fname, mode='w+', dtype=HEADER_DTYPE, shape=(BLOCKS_PER_SEGMENT,))
+            seg.flush()
+            del seg
+            try:
+                os.link(tmp_fname, fname)
+            except FileExistsError:
+                # someone else beat us to it
+                pass
+            os.unlink(tmp_fname)
+
+        ret = np.lib.format.open_memmap(fname, mode='r+')
+        assert ret.dtype == HEADER_DTYPE
+        self._segments[segment_id] = ret
+        return ret
+
+
+def _to_record(resp: web3.types.RPCResponse) -> np.void:
+    if 'error' in resp:
+        raise Exception(f'Could not get block: {resp["error"]}')
+    block = resp['result']
+    if block is None:
+        raise Exception('Block does not exist')
+
+    ret = np.zeros((), dtype=HEADER_DTYPE)
+    ret['present'] = 1
+    ret['timestamp'] = int(block['timestamp'], 16)
+    ret['base_fee'] = int(block.get('baseFeePerGas', '0x0'), 16)
+    ret['hash'] = np.frombuffer(bytes.fromhex(block['hash'][2:]), dtype=np.uint8)
+    ret['logs_bloom'] = np.frombuffer(bytes.fromhex(block['logsBloom'][2:]), dtype=np.uint8)
+    return ret[()]
@@ -0,0 +1,441 @@
+"""
+utils/log_archive.py
+
+Local archive of (finalized) event logs, stored column-wise in compressed files
+partitioned by block range, so that scan jobs can re-read the same logs from
+disk rather than pulling them from the node again.
+"""
+import json
+import os
+import tempfile
+import threading
+import typing
+import logging
+
+import cachetools
+import numpy as np
+import web3
+import web3.types
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+from .profiling import inc_count, profile
+
+l = logging.getLogger(__name__)
+
+BLOCKS_PER_PARTITION = 10_000
+
+_COLUMNS = (
+    'covered',          # (2,) first and last block extracted into this partition (inclusive)
+    'block',            # (N,) block number of each log
+    'tx_index',         # (N,) transaction index of each log
+    'log_index',        # (N,) log index of each log
+    'tx_hash_idx',      # (N,) index into tx_hashes
+    'address_idx',      # (N,) index into addresses
+    'n_topics',         # (N,) number of topics of each log
+    'topic_idx',        # (N, 4) index into topics, only the first n_topics are meaningful
+    'data_offsets',     # (N + 1,) each log's data is data[data_offsets[i]:data_offsets[i + 1]]
+    'data',             # concatenated log data
+    'addresses',        # (A, 20) distinct addresses
+    'topics',           # (K, 32) distinct topics
+    'tx_hashes',        # (T, 32) distinct transaction hashes
+    'block_numbers',    # (B,) distinct block numbers, ascending
+    'block_hashes',     # (B, 32) hash of each block in block_numbers
+)
+
+
+class _Partition:
+    """
+    One decoded partition file, with the (small) lookup tables converted
+    to the python objects that go in each LogReceipt.
+    """
+
+    def __init__(self, arrays: typing.Mapping[str, np.ndarray]) -> None:
+        self.covered_start, self.covered_end = (int(x) for x in arrays['covered'])
+        self.block = arrays['block']
+        self.tx_index = arrays['tx_index']
+        self.log_index = arrays['log_index']
+        self.tx_hash_idx = arrays['tx_hash_idx']
+        self.address_idx = arrays['address_idx']
+        self.n_topics = arrays['n_topics']
+        self.topic_idx = arrays['topic_idx']
+        self.data_offsets = arrays['data_offsets']
+        self.data = arrays['data'].tobytes()
+
+        self.addresses = [to_checksum_address(a.tobytes()) for a in arrays['addresses']]
+        self.topics = [HexBytes(t.tobytes()) for t in arrays['topics']]
+        self.tx_hashes = [HexBytes(t.tobytes()) for t in arrays['tx_hashes']]
+        self.block_hashes = {
+            int(b): HexBytes(h.tobytes())
+            for b, h in zip(arrays['block_numbers'], arrays['block_hashes'])
+        }
+
+    def select(self, start_block: int, end_block: int, addresses: typing.Optional[typing.AbstractSet[str]]) -> np.ndarray:
+        """
+        Indices of logs in [start_block, end_block] emitted by one of the given addresses (or any, if None)
+        """
+        lo, hi = np.searchsorted(self.block, [start_block, end_block + 1])
+        idxs = np.arange(lo, hi)
+        if addresses is not None:
+            wanted = np.fromiter((a in addresses for a in self.addresses), dtype=bool, count=len(self.addresses))
+            idxs = idxs[wanted[self.address_idx[lo:hi]]]
+        return idxs
+
+    def log(self, i: int) -> web3.types.LogReceipt:
+        block_number = int(self.block[i])
+        n_topics = self.n_topics[i]
+        return AttributeDict({
+            'address': self.addresses[self.address_idx[i]],
+            'topics': [self.topics[t] for t in self.topic_idx[i, :n_topics]],
+            'data': '0x' + self.data[self.data_offsets[i] : self.data_offsets[i + 1]].hex(),
+            'blockNumber': block_number,
+            'blockHash': self.block_hashes[block_number],
+            'transactionHash': self.tx_hashes[self.tx_hash_idx[i]],
+            'transactionIndex': int(self.tx_index[i]),
+            'logIndex': int(self.log_index[i]),
+            'removed': False,
+        })
+
+
+class LogArchive:
+    """
+    Logs are extracted with eth_getLogs, optionally keeping only those emitted by
+    the given `addresses` and/or having a first topic in `topics`; the filter is fixed
+    when the archive is created and recorded in its meta.json.
+
+    Each partition covers BLOCKS_PER_PARTITION blocks and records which of its
+    blocks have been extracted so far, which must be a contiguous range. Extraction
+    appends to partially-covered partitions by rewriting them; files are
+    replaced atomically, so readers in other processes never see a partial file.
+    """
+    directory: str
+    addresses: typing.Optional[typing.FrozenSet[str]]
+    topics: typing.Optional[typing.FrozenSet[bytes]]
+
+    def __init__(
+            self,
+            directory: str,
+            addresses: typing.Optional[typing.Iterable[str]] = None,
+            topics: typing.Optional[typing.Iterable[bytes]] = None,
+        ) -> None:
+        assert os.path.isdir(directory)
+        self.directory = directory
+
+        meta_fname = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_fname):
+            with open(meta_fname) as fin:
+                meta = json.load(fin)
+            self.addresses = None if meta['addresses'] is None else frozenset(meta['addresses'])
+            self.topics = None if meta['topics'] is None else frozenset(bytes.fromhex(t) for t in meta['topics'])
+            if addresses is not None:
+                assert self.addresses is not None and self.addresses.issuperset(addresses), 'archive filter does not match'
+            if topics is not None:
+                assert self.topics is not None and self.topics.issuperset(topics), 'archive filter does not match'
+        else:
+            self.addresses = None if addresses is None else frozenset(to_checksum_address(a) for a in addresses)
+            self.topics = None if topics is None else frozenset(bytes(t) for t in topics)
+            meta = {
+                'addresses': None if self.addresses is None else sorted(self.addresses),
+                'topics': None if self.topics is None else sorted(t.hex() for t in self.topics),
+            }
+            _write_atomic(directory, meta_fname, lambda f: f.write(json.dumps(meta).encode('ascii')), suffix='.json.tmp')
+
+        self._partitions = cachetools.LRUCache(maxsize=4)
+        self._lock = threading.Lock()
+
+    def covers(
+            self,
+            start_block: int,
+            end_block: int,
+            addresses: typing.Optional[typing.AbstractSet[str]] = None,
+            topics: typing.Optional[typing.AbstractSet[bytes]] = None,
+        ) -> bool:
+        """
+        Whether every log in [start_block, end_block] from the given addresses (None means all addresses)
+        with first topic among the given topics (None means all topics) is in the archive
+        """
+        if self.addresses is not None and (addresses is None or not self.addresses.issuperset(addresses)):
+            return False
+        if self.topics is not None and (topics is None or not self.topics.issuperset(topics)):
+            return False
+
+        for partition_id in range(start_block // BLOCKS_PER_PARTITION, end_block // BLOCKS_PER_PARTITION + 1):
+            covered = self._covered(partition_id)
+            if covered is None:
+                return False
+            partition_start = partition_id * BLOCKS_PER_PARTITION
+            partition_end = partition_start + BLOCKS_PER_PARTITION - 1
+            if covered[0] > max(start_block, partition_start) or covered[1] < min(end_block, partition_end):
+                return False
+        return True
+
+    def iter_blocks(
+            self,
+            start_block: int,
+            end_block: int,
+            addresses: typing.Optional[typing.AbstractSet[str]] = None,
+        ) -> typing.Iterator[typing.Tuple[int, typing.List[web3.types.LogReceipt]]]:
+        """
+        Yields (block_number, logs) for every block in [start_block, end_block], in order,
+        with logs in log-index order. The range must be covered by the archive.
+        """
+        assert start_block <= end_block
+        for partition_id in range(start_block // BLOCKS_PER_PARTITION, end_block // BLOCKS_PER_PARTITION + 1):
+            partition_start = max(start_block, partition_id * BLOCKS_PER_PARTITION)
+            partition_end = min(end_block, (partition_id + 1) * BLOCKS_PER_PARTITION - 1)
+            partition = self._partition(partition_id)
+            if partition is None or partition.covered_start > partition_start or partition.covered_end < partition_end:
+                raise Exception(f'Log archive does not cover {partition_start:,} to {partition_end:,}')
+
+            idxs = partition.select(partition_start, partition_end, addresses)
+            inc_count('log_archive.logs', len(idxs))
+
+            next_block = partition_start
+            curr_logs = []
+            for i in idxs:
+                block_number = int(partition.block[i])
+                while next_block < block_number:
+                    yield next_block, curr_logs
+                    next_block += 1
+                    curr_logs = []
+                curr_logs.append(partition.log(i))
+            while next_block <= partition_end:
+                yield next_block, curr_logs
+                next_block += 1
+                curr_logs = []
+
+    def get_logs(
+            self,
+            start_block: int,
+            end_block: int,
+            addresses: typing.Optional[typing.AbstractSet[str]] = None,
+        ) -> typing.List[web3.types.LogReceipt]:
+        """
+        All archived logs in [start_block, end_block] (as eth_getLogs), optionally only those from the given addresses
+        """
+        ret = []
+        for _, logs in self.iter_blocks(start_block, end_block, addresses):
+            ret.extend(logs)
+        return ret
+
+    def extract(self, w3: web3.Web3, start_block: int, end_block: int, batch_size: int = 100):
+        """
+        Extract logs for [start_block, end_block] into the archive, skipping blocks already
+        extracted. Blocks that are not yet finalized (per the provider's get_finalized_block(),
+        if it has one) are not extracted, since they may still be reorganized.
+        """
+        if hasattr(w3.provider, 'get_finalized_block'):
+            end_block = min(end_block, w3.provider.get_finalized_block())
+
+        for partition_id in range(start_block // BLOCKS_PER_PARTITION, end_block // BLOCKS_PER_PARTITION + 1):
+            partition_start = max(start_block, partition_id * BLOCKS_PER_PARTITION)
+            partition_end = min(end_block, (partition_id + 1) * BLOCKS_PER_PARTITION - 1)
+
+            existing = self._partition(partition_id)
+            if existing is not None:
+                if existing.covered_start > partition_start:
+                    # would leave a hole; re-extract the partition from our start
+                    partition_end = max(partition_end, existing.covered_end)
+                    existing = None
+                else:
+                    # append directly after what is covered, even if that is before our start,
+                    # so the covered range stays contiguous
+                    partition_start = existing.covered_end + 1
+            if partition_start > partition_end:
+                continue
+
+            l.info(f'Extracting logs from {partition_start:,} to {partition_end:,}')
+            raw_logs = []
+            with profile('log_archive.extract'):
+                batches = [
+                    (i, min(partition_end, i + batch_size - 1))
+                    for i in range(partition_start, partition_end + 1, batch_size)
+                ]
+                # a few ranges per round-trip, so the node works on them concurrently
+                for i in range(0, len(batches), 10):
+                    resps = w3.provider.make_request_batch([
+                        ('eth_getLogs', [{'fromBlock': hex(s), 'toBlock': hex(e)}])
+                        for s, e in batches[i : i + 10]
+                    ])
+                    for resp in resps:
+                        if 'error' in resp:
+                            raise Exception(f'Could not get logs: {resp["error"]}')
+                        raw_logs.extend(self._filter_raw(resp['result']))
+
+            arrays = _encode(raw_logs, partition_start, partition_end)
+            if existing is not None:
+                arrays = _concat(self._load(partition_id), arrays)
+            self._write(partition_id, arrays)
+
+    def _filter_raw(self, raw_logs: typing.List[dict]) -> typing.Iterator[dict]:
+        for log in raw_logs:
+            if log.get('removed', False):
+                continue
+            if self.addresses is not None and to_checksum_address(log['address']) not in self.addresses:
+                continue
+            if self.topics is not None and (len(log['topics']) == 0 or bytes.fromhex(log['topics'][0][2:]) not in self.topics):
+                continue
+            yield log
+
+    def _fname(self, partition_id: int) -> str:
+        return os.path.join(self.directory, f'logs_{partition_id:06d}.npz')
+
+    def _covered(self, partition_id: int) -> typing.Optional[typing.Tuple[int, int]]:
+        partition = self._partitions.get(partition_id, None)
+        if partition is not None and partition.covered_end == (partition_id + 1) * BLOCKS_PER_PARTITION - 1:
+            return partition.covered_start, partition.covered_end
+        fname = self._fname(partition_id)
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname) as f:
+            return tuple(int(x) for x in f['covered'])
+
+    def _load(self, partition_id: int) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+        fname = self._fname(partition_id)
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname) as f:
+            return {k: f[k] for k in _COLUMNS}
+
+    def _partition(self, partition_id: int) -> typing.Optional[_Partition]:
+        with self._lock:
+            ret = self._partitions.get(partition_id, None)
+            if ret is not None and ret.covered_end == (partition_id + 1) * BLOCKS_PER_PARTITION - 1:
+                return ret
+
+            # not cached, or only partially covered (and may since have been appended to)
+            with profile('log_archive.load'):
+                arrays = self._load(partition_id)
+                if arrays is None:
+                    return None
+                ret = _Partition(arrays)
+            self._partitions[partition_id] = ret
+            return ret
+
+    def _write(self, partition_id: int, arrays: typing.Dict[str, np.ndarray]):
+        with self._lock:
+            self._partitions.pop(partition_id, None)
+        _write_atomic(
+            self.directory,
+            self._fname(partition_id),
+            lambda f: np.savez_compressed(f, **arrays),
+            suffix='.npz.tmp'
+        )
+
+
+def _write_atomic(directory: str, fname: str, write: typing.Callable[[typing.BinaryIO], None], suffix: str):
+    fd, tmp_fname = tempfile.mkstemp(dir=directory, suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            write(fout)
+        os.chmod(tmp_fname, 0o644)
+        os.replace(tmp_fname, fname)
+    except:
+        os.unlink(tmp_fname)
+        raise
+
+
+def _intern(values: typing.List[bytes]) -> typing.Tuple[np.ndarray, typing.List[bytes]]:
+    """
+    Replace each value with its index into a table of the distinct values
+    """
+    table = {}
+    idxs = np.fromiter((table.setdefault(v, len(table)) for v in values), dtype=np.uint32, count=len(values))
+    return idxs, list(table.keys())
+
+
+def _table(values: typing.List[bytes], width: int) -> np.ndarray:
+    return np.frombuffer(b''.join(values), dtype=np.uint8).reshape(len(values), width)
+
+
+def _encode(raw_logs: typing.List[dict], covered_start: int, covered_end: int) -> typing.Dict[str, np.ndarray]:
+    """
+    Encode raw (json) eth_getLogs results into partition columns
+    """
+    raw_logs = sorted(raw_logs, key=lambda x: (int(x['blockNumber'], 16), int(x['logIndex'], 16)))
+
+    address_idx, addresses = _intern([bytes.fromhex(x['address'][2:]) for x in raw_logs])
+    tx_hash_idx, tx_hashes = _intern([bytes.fromhex(x['transactionHash'][2:]) for x in raw_logs])
+
+    topic_idx = np.zeros((len(raw_logs), 4), dtype=np.uint32)
+    n_topics = np.zeros(len(raw_logs), dtype=np.uint8)
+    topics = {}
+    for i, log in enumerate(raw_logs):
+        n_topics[i] = len(log['topics'])
+        for j, t in enumerate(log['topics']):
+            topic_idx[i, j] = topics.setdefault(bytes.fromhex(t[2:]), len(topics))
+
+    datas = [bytes.fromhex(x['data'][2:]) for x in raw_logs]
+    data_offsets = np.zeros(len(datas) + 1, dtype=np.uint64)
+    np.cumsum([len(d) for d in datas], out=data_offsets[1:])
+
+    block_hashes = {}
+    for log in raw_logs:
+        block_hashes[int(log['blockNumber'], 16)] = bytes.fromhex(log['blockHash'][2:])
+
+    return {
+        'covered': np.array([covered_start, covered_end], dtype=np.uint64),
+        'block': np.array([int(x['blockNumber'], 16) for x in raw_logs], dtype=np.uint32),
+        'tx_index': np.array([int(x['transactionIndex'], 16) for x in raw_logs], dtype=np.uint32),
+        'log_index': np.array([int(x['logIndex'], 16) for x in raw_logs], dtype=np.uint32),
+        'tx_hash_idx': tx_hash_idx,
+        'address_idx': address_idx,
+        'n_topics': n_topics,
+        'topic_idx': topic_idx,
+        'data_offsets': data_offsets,
+        'data': np.frombuffer(b''.join(datas), dtype=np.uint8),
+        'addresses': _table(addresses, 20),
+        'topics': _table(list(topics.keys()), 32),
+        'tx_hashes': _table(tx_hashes, 32),
+        'block_numbers': np.array(list(block_hashes.keys()), dtype=np.uint32),
+        'block_hashes': _table(list(block_hashes.values()), 32),
+    }
+
+
+def _concat(a: typing.Dict[str, np.ndarray], b: typing.Dict[str, np.ndarray]) -> typing.Dict[str, np.ndarray]:
+    """
+    Append partition columns `b` (which must directly follow `a`) to `a`
+    """
+    assert int(a['covered'][1]) + 1 == int(b['covered'][0])
+    return {
+        'covered': np.array([a['covered'][0], b['covered'][1]], dtype=np.uint64),
+        'block': np.concatenate([a['block'], b['block']]),
+        'tx_index': np.concatenate([a['tx_index'], b['tx_index']]),
+        'log_index': np.concatenate([a['log_index'], b['log_index']]),
+        'tx_hash_idx': np.concatenate([a['tx_hash_idx'], b['tx_hash_idx'] + len(a['tx_hashes'])]),
+        'address_idx': np.concatenate([a['address_idx'], b['address_idx'] + len(a['addresses'])]),
+        'n_topics': np.concatenate([a['n_topics'], b['n_topics']]),
+        'topic_idx': np.concatenate([a['topic_idx'], b['topic_idx'] + len(a['topics'])]),
+        'data_offsets': np.concatenate([a['data_offsets'], b['data_offsets'][1:] + a['data_offsets'][-1]]),
+        'data': np.concatenate([a['data'], b['data']]),
+        # tables may now hold duplicates, which is harmless
+        'addresses': np.concatenate([a['addresses'], b['addresses']]),
+        'topics': np.concatenate([a['topics'], b['topics']]),
+        'tx_hashes': np.concatenate([a['tx_hashes'], b['tx_hashes']]),
+        'block_numbers': np.concatenate([a['block_numbers'], b['block_numbers']]),
+        'block_hashes': np.concatenate([a['block_hashes'], b['block_hashes']]),
+    }
+
+
+_default_archive: typing.Optional[LogArchive] = None
+_default_archive_lock = threading.Lock()
+
+
+def get_log_archive() -> typing.Optional[LogArchive]:
+    """
+    Get the shared archive at LOG_ARCHIVE_DIR (default: STORAGE_DIR/log_archive), or None
+    if no archive has been created there (see the top_of_block `archive-logs` command).
+    """
+    global _default_archive
+    with _default_archive_lock:
+        if _default_archive is None:
+            directory = log_archive_dir()
+            if directory != '' and os.path.exists(os.path.join(directory, 'meta.json')):
+                _default_archive = LogArchive(directory)
+        return _default_archive
+
+
+def log_archive_dir() -> str:
+    default_dir = os.path.join(os.getenv('STORAGE_DIR', '/mnt/goldphish'), 'log_archive')
+    return os.getenv('LOG_ARCHIVE_DIR', default_dir)
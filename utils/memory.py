@@ -0,0 +1,247 @@
+"""
+utils/memory.py
+
+Memory footprint reporting. Caches register themselves here (register_cache), as do
+on-disk spill directories (register_dir); report() estimates the size of each cache,
+broken down by the type of its entries, by measuring the deep size of a random sample
+of entries and extrapolating. Sizes, entry counts, disk usage and RSS are recorded as
+profiling gauges (see utils.profiling), so they land in the profile logs and json.
+
+maybe_report() reports every MEMORY_REPORT_SECONDS (default 600; 0 disables).
+top_allocators() lists the source lines holding the most memory, via tracemalloc;
+tracing starts on its first call (or at startup with PYTHONTRACEMALLOC=1), so it is
+called once to start and again to report. Both are served on demand by the metrics
+endpoint (see utils.metrics) at /memory.
+"""
+import collections
+import collections.abc
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import typing
+import logging
+
+import web3
+import web3.contract
+
+from . import profiling
+
+l = logging.getLogger(__name__)
+
+DEFAULT_REPORT_SECONDS = 10 * 60
+
+# entries of each type whose deep size is measured, per cache
+SAMPLE_SIZE = 50
+
+# stop walking an entry's references after this many objects (the size is then an underestimate)
+MAX_OBJECTS_PER_ENTRY = 100_000
+
+# shared by everything that references them, so not attributed to any one entry
+_NOT_OWNED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    web3.Web3,
+    web3.contract.Contract,
+)
+
+_caches: typing.Dict[str, typing.Callable[[], typing.Optional[typing.Collection]]] = {}
+_dirs: typing.Dict[str, typing.Callable[[], typing.Optional[str]]] = {}
+_last_report: float = time.time()
+_report_lock = threading.Lock()
+
+
+def register_cache(name: str, fn: typing.Callable[[], typing.Optional[typing.Collection]]):
+    """
+    Register a cache; fn() returns the container (a mapping, whose values are measured,
+    or any other collection), or None once it is gone
+    """
+    _caches[name] = fn
+
+
+def register_dir(name: str, fn: typing.Callable[[], typing.Optional[str]]):
+    """
+    Register a directory whose disk usage is reported; fn() returns its path, or None once it is gone
+    """
+    _dirs[name] = fn
+
+
+def deep_sizeof(obj: typing.Any, max_objects: int = MAX_OBJECTS_PER_ENTRY) -> int:
+    """
+    Bytes used by obj and everything it (transitively) references, counting each object once
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while len(stack) > 0 and len(seen) < max_objects:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _NOT_OWNED):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+
+        if isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(o)
+        if hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+        for cls in type(o).__mro__:
+            slots = cls.__dict__.get('__slots__', ())
+            for slot in ((slots,) if isinstance(slots, str) else slots):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total
+
+
+def estimate(container: typing.Collection) -> typing.Dict[str, typing.Tuple[int, int]]:
+    """
+    Estimate the bytes held by the container's entries, by type of entry; returns
+    {type name: (number of entries, estimated bytes)}
+    """
+    if isinstance(container, collections.abc.Mapping):
+        entries = list(container.values())
+        keys = list(container.keys())
+    else:
+        entries = list(container)
+        keys = []
+
+    by_type: typing.Dict[str, typing.List[typing.Any]] = {}
+    for e in entries:
+        by_type.setdefault(type(e).__name__, []).append(e)
+
+    ret = {}
+    for type_name, es in by_type.items():
+        sample = random.sample(es, min(SAMPLE_SIZE, len(es)))
+        mean = sum(deep_sizeof(e) for e in sample) / len(sample)
+        ret[type_name] = (len(es), int(mean * len(es)))
+
+    # the container itself, and its keys
+    overhead = sys.getsizeof(container)
+    if len(keys) > 0:
+        sample = random.sample(keys, min(SAMPLE_SIZE, len(keys)))
+        overhead += int(sum(deep_sizeof(k) for k in sample) / len(sample) * len(keys))
+    ret['(container)'] = (len(keys) or len(entries), overhead)
+    return ret
+
+
+def disk_usage(path: str) -> int:
+    total = 0
+    for dirpath, _, fnames in os.walk(path):
+        for fname in fnames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fname))
+            except FileNotFoundError:
+                # compacted away
+                pass
+    return total
+
+
+def rss_bytes() -> int:
+    """
+    Resident set size of this process (the peak, where the current one is not available)
+    """
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (FileNotFoundError, ValueError):
+        # ru_maxrss is in kilobytes on linux but bytes on macos
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def report() -> typing.Dict[str, float]:
+    """
+    Measure every registered cache and directory, and RSS; sets (and returns) the memory gauges
+    """
+    global _last_report
+    with _report_lock, profiling.profile('memory.report'):
+        gauges = {'memory.rss_bytes': rss_bytes()}
+        totals = {}
+        for name, fn in sorted(list(_caches.items())):
+            container = fn()
+            if container is None:
+                continue
+            try:
+                estimated = estimate(container)
+            except RuntimeError:
+                # changed size while being copied (by another thread); try next time
+                l.warning(f'Could not measure {name}')
+                continue
+            for type_name, (n, n_bytes) in estimated.items():
+                gauges[f'memory.{name}.{type_name}.count'] = n
+                gauges[f'memory.{name}.{type_name}.bytes'] = n_bytes
+            totals[name] = sum(n_bytes for _, n_bytes in estimated.values())
+            gauges[f'memory.{name}.bytes'] = totals[name]
+
+        for name, fn in sorted(list(_dirs.items())):
+            path = fn()
+            if path is None:
+                continue
+            totals[name + '(disk)'] = disk_usage(path)
+            gauges[f'memory.{name}.disk_bytes'] = totals[name + '(disk)']
+
+        # caches that are gone are no longer reported
+        profiling.clear_gauges('memory.')
+        for k, v in gauges.items():
+            profiling.set_gauge(k, v)
+        _last_report = time.time()
+
+    summary = ' '.join(f'{k}={v / (1024 * 1024):,.1f}MiB' for k, v in sorted(totals.items()))
+    l.debug(f'memory rss={gauges["memory.rss_bytes"] / (1024 * 1024):,.1f}MiB {summary}')
+    return gauges
+
+
+def maybe_report():
+    """
+    Report if MEMORY_REPORT_SECONDS have passed since the last report
+    """
+    interval = float(os.getenv('MEMORY_REPORT_SECONDS', DEFAULT_REPORT_SECONDS))
+    if interval <= 0 or time.time() < _last_report + interval:
+        return
+    report()
+
+
+def top_allocators(n: int = 25) -> typing.List[typing.Tuple[str, int, int]]:
+    """
+    The n source lines that allocated the most memory still held, as (file:line, bytes, blocks);
+    starts tracing (and returns an empty list) if it was not started yet
+    """
+    if not tracemalloc.is_tracing():
+        l.info('Started tracemalloc; allocations are attributed from now on')
+        tracemalloc.start()
+        return []
+
+    snap = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    ret = []
+    for stat in snap.statistics('lineno')[:n]:
+        frame = stat.traceback[0]
+        ret.append((f'{frame.filename}:{frame.lineno}', stat.size, stat.count))
+    for where, size, count in ret:
+        l.debug(f'alloc where="{where}" bytes={size} blocks={count}')
+    return ret
+
+
+def render() -> str:
+    """
+    A fresh report and the top allocators, as text (for the metrics endpoint)
+    """
+    lines = [f'{k} {v}' for k, v in sorted(report().items())]
+    allocators = top_allocators()
+    if len(allocators) == 0 and tracemalloc.is_tracing():
+        lines.append('# tracemalloc started; request again for top allocators')
+    for where, size, count in allocators:
+        lines.append(f'alloc {where} bytes={size} blocks={count}')
+    return '\n'.join(lines) + '\n'
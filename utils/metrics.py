@@ -0,0 +1,143 @@
+"""
+utils/metrics.py
+
+Optional per-worker metrics endpoint: when METRICS_PORT is set, each worker serves
+its counters and gauges over HTTP in the (Prometheus) plain-text exposition format,
+so that many workers can be scraped and compared side-by-side. /memory measures
+memory use on demand (see utils.memory).
+"""
+import http.server
+import os
+import threading
+import time
+import typing
+import logging
+
+from . import memory
+from . import profiling
+
+l = logging.getLogger(__name__)
+
+# workers on the same host take the first free port starting from METRICS_PORT
+MAX_PORT_OFFSET = 256
+
+_gauges: typing.Dict[typing.Tuple[str, typing.Tuple[typing.Tuple[str, str], ...]], typing.Union[float, typing.Callable[[], float]]] = {}
+_const_labels: typing.Dict[str, str] = {}
+_start_time = time.time()
+_server: typing.Optional[http.server.ThreadingHTTPServer] = None
+
+
+def set_gauge(name: str, value: float, **labels):
+    """
+    Set the gauge `goldphish_<name>` (with the given labels) to value
+    """
+    _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+def register_gauge(name: str, fn: typing.Callable[[], float], **labels):
+    """
+    Register a gauge whose value is read by calling fn() whenever metrics are scraped
+    """
+    _gauges[(name, tuple(sorted(labels.items())))] = fn
+
+
+def render() -> str:
+    """
+    Render all metrics in the plain-text exposition format
+    """
+    lines = []
+
+    def emit(name: str, value: float, labels: typing.Iterable[typing.Tuple[str, str]] = ()):
+        all_labels = list(_const_labels.items()) + list(labels)
+        sz_labels = ','.join(f'{k}="{_escape(str(v))}"' for k, v in all_labels)
+        lines.append(f'goldphish_{name}{{{sz_labels}}} {value}')
+
+    emit('up', 1)
+    emit('uptime_seconds', f'{time.time() - _start_time:.3f}')
+
+    for name, n in sorted(profiling.get_total_counts().items()):
+        emit('events_total', n, [('name', name)])
+
+    for name, value in sorted(profiling.get_gauges().items()):
+        emit('profile_gauge', value, [('name', name)])
+
+    for method, (count, seconds, sent, received) in sorted(profiling.get_rpc_totals().items()):
+        emit('rpc_requests_total', count, [('method', method)])
+        emit('rpc_seconds_total', f'{seconds:.6f}', [('method', method)])
+        emit('rpc_bytes_sent_total', sent, [('method', method)])
+        emit('rpc_bytes_received_total', received, [('method', method)])
+
+    for (name, labels), value in sorted(list(_gauges.items()), key=lambda x: x[0]):
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                l.exception(f'Could not read gauge {name}')
+                continue
+        if value is None:
+            continue
+        emit(name, value, labels)
+
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path in ('/', '/metrics'):
+            body = render().encode('utf8')
+        elif self.path == '/memory':
+            # on demand, as measuring takes a while
+            body = memory.render().encode('utf8')
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # do not spam the job's log with scrapes
+        pass
+
+
+def start_server(port: int, host: str = '0.0.0.0', **const_labels) -> int:
+    """
+    Serve metrics on the first free port at or after `port`, in a daemon thread; returns the port.
+    Every metric is labeled with const_labels (ie, job and worker).
+    """
+    global _server
+    assert _server is None, 'metrics server already running'
+    _const_labels.update({k: str(v) for k, v in const_labels.items()})
+
+    for offset in range(MAX_PORT_OFFSET):
+        try:
+            _server = http.server.ThreadingHTTPServer((host, port + offset), _Handler)
+            break
+        except OSError:
+            continue
+    else:
+        raise Exception(f'No free port for metrics in [{port}, {port + MAX_PORT_OFFSET})')
+
+    _server.daemon_threads = True
+    t = threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True)
+    t.start()
+    ret = _server.server_address[1]
+    l.info(f'Serving metrics on http://{host}:{ret}/metrics')
+    return ret
+
+
+def maybe_start_server(**const_labels) -> typing.Optional[int]:
+    """
+    Start the metrics server if METRICS_PORT is set (and it is not already running)
+    """
+    port = os.getenv('METRICS_PORT', '')
+    if port == '' or _server is not None:
+        return None
+    return start_server(int(port), **const_labels)
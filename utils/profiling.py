@@ -1,7 +1,18 @@
 """
-Basic utils for performance profiling, mostly in units of time
+Basic utils for performance profiling, mostly in units of time (plus some event counts)
+
+Timing is recorded in spans: `with profile(name)` nests under whatever span is open
+in the same thread, so each span is identified by its path (ie, 'pricing.optimize/root_find').
+Per path we keep call counts, total and self (exclusive of child spans) time, and a
+streaming log-scale histogram of durations, from which percentiles are estimated.
+
+Measurements (`inc_measurement`) are durations timed by the caller, which may overlap
+spans (and each other); they are kept apart from the span tree, as plain totals by name.
 """
 
+import json
+import os
+import threading
 import time
 import typing
 import logging
@@ -9,12 +20,251 @@ import logging
 ENABLED = True
 PRINT_INTERVAL_SECONDS = 2 * 60
 
+# 4 histogram buckets per power of two, so percentiles are within ~20%
+_BUCKETS_PER_OCTAVE_BITS = 2
+_SUB_BUCKET_MASK = (1 << _BUCKETS_PER_OCTAVE_BITS) - 1
+
 _global_profile: typing.Dict[str, float] = {}
+_global_counts: typing.Dict[str, int] = {}
+# never reset, for export (see utils.metrics)
+_total_counts: typing.Dict[str, int] = {}
+# levels (ie, bytes used by a cache) rather than totals, so kept across intervals
+_gauges: typing.Dict[str, float] = {}
 _last_log: float = 0
 
 l = logging.getLogger(__name__)
 
 
+class SpanStats:
+    """
+    Stats of one span path; child spans hang off of `children` by name
+    """
+    count: int
+    total_ns: int
+    self_ns: int
+    max_ns: int
+    max_context: typing.Optional[typing.Dict[str, typing.Any]]
+    histogram: typing.Dict[int, int]
+    children: typing.Dict[str, 'SpanStats']
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+        self.max_context = None
+        self.histogram = {}
+        self.children = {}
+
+    def child(self, name: str) -> 'SpanStats':
+        ret = self.children.get(name, None)
+        if ret is None:
+            ret = SpanStats()
+            self.children[name] = ret
+        return ret
+
+    def clear(self):
+        """
+        Zero the stats of this span and its children (which are kept, since open spans refer to them)
+        """
+        self.count = 0
+        self.total_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+        self.max_context = None
+        self.histogram = {}
+        for c in list(self.children.values()):
+            c.clear()
+
+    def record(self, elapsed_ns: int, self_ns: int):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        self.self_ns += self_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+            self.max_context = getattr(_local, 'context', None)
+        # inlined _bucket(), this is hot
+        n_bits = elapsed_ns.bit_length()
+        if n_bits <= _BUCKETS_PER_OCTAVE_BITS:
+            bucket = elapsed_ns
+        else:
+            bucket = (n_bits << _BUCKETS_PER_OCTAVE_BITS) + ((elapsed_ns >> (n_bits - 1 - _BUCKETS_PER_OCTAVE_BITS)) & _SUB_BUCKET_MASK)
+        histogram = self.histogram
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def merge(self, other: 'SpanStats'):
+        self.count += other.count
+        self.total_ns += other.total_ns
+        self.self_ns += other.self_ns
+        if other.max_ns > self.max_ns:
+            self.max_ns = other.max_ns
+            self.max_context = other.max_context
+        for bucket, n in list(other.histogram.items()):
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + n
+
+    def percentile(self, p: float) -> int:
+        """
+        Estimated p-th percentile (0 <= p <= 100) of durations, in nanoseconds
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100
+        seen = 0
+        for bucket, n in sorted(list(self.histogram.items())):
+            seen += n
+            if seen >= target:
+                return min(_bucket_upper(bucket), self.max_ns)
+        return self.max_ns
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'count': self.count,
+            'total_seconds': self.total_ns / 1e9,
+            'self_seconds': self.self_ns / 1e9,
+            'p50_seconds': self.percentile(50) / 1e9,
+            'p99_seconds': self.percentile(99) / 1e9,
+            'max_seconds': self.max_ns / 1e9,
+            'max_context': self.max_context,
+        }
+
+
+# each thread records into its own tree of spans, so that recording needs no lock
+_thread_roots: typing.List[SpanStats] = []
+_thread_roots_lock = threading.Lock()
+_local = threading.local()
+
+
+def _bucket(ns: int) -> int:
+    n_bits = ns.bit_length()
+    if n_bits <= _BUCKETS_PER_OCTAVE_BITS:
+        return ns
+    sub = (ns >> (n_bits - 1 - _BUCKETS_PER_OCTAVE_BITS)) & _SUB_BUCKET_MASK
+    return (n_bits << _BUCKETS_PER_OCTAVE_BITS) + sub
+
+
+def _bucket_upper(bucket: int) -> int:
+    if bucket < (1 << _BUCKETS_PER_OCTAVE_BITS):
+        return bucket
+    n_bits = bucket >> _BUCKETS_PER_OCTAVE_BITS
+    if n_bits <= _BUCKETS_PER_OCTAVE_BITS:
+        return bucket
+    sub = bucket & _SUB_BUCKET_MASK
+    shift = n_bits - 1 - _BUCKETS_PER_OCTAVE_BITS
+    return (((1 << _BUCKETS_PER_OCTAVE_BITS) + sub + 1) << shift) - 1
+
+
+def _root() -> SpanStats:
+    try:
+        return _local.root
+    except AttributeError:
+        _local.root = SpanStats()
+        _local.stack = []
+        with _thread_roots_lock:
+            _thread_roots.append(_local.root)
+        return _local.root
+
+
+def span_path() -> str:
+    """
+    Path of the innermost open span in this thread ('' if there is none)
+    """
+    if not ENABLED:
+        return ''
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return ''
+    return '/'.join(cm._name for cm in stack)
+
+
+class RPCStats(SpanStats):
+    """
+    Latency stats of requests of one method made under one span, plus their size
+    """
+    bytes_sent: int
+    bytes_received: int
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        ret = super().to_json()
+        del ret['self_seconds']
+        del ret['max_context']
+        ret['bytes_sent'] = self.bytes_sent
+        ret['bytes_received'] = self.bytes_received
+        return ret
+
+
+class MeasurementStats(SpanStats):
+    """
+    Stats of one measurement; measurements are not nested, so they have no self time
+    """
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        ret = super().to_json()
+        del ret['self_seconds']
+        return ret
+
+
+# name -> stats, for the current interval
+_measurements: typing.Dict[str, MeasurementStats] = {}
+_measurements_lock = threading.Lock()
+
+
+# (span path, method) -> stats; only touched by the rpc event loop (and snapshots)
+_rpc_stats: typing.Dict[typing.Tuple[str, str], RPCStats] = {}
+
+# method -> [count, nanoseconds, bytes sent, bytes received], never reset
+_rpc_totals: typing.Dict[str, typing.List[int]] = {}
+
+
+def record_rpc(tag: str, method: str, bytes_sent: int, bytes_received: int, elapsed_ns: int):
+    """
+    Account for one request sent on behalf of span `tag`
+    """
+    if not ENABLED:
+        return
+    k = (tag, method)
+    stats = _rpc_stats.get(k, None)
+    if stats is None:
+        stats = RPCStats()
+        _rpc_stats[k] = stats
+    stats.bytes_sent += bytes_sent
+    stats.bytes_received += bytes_received
+    stats.record(elapsed_ns, elapsed_ns)
+
+    totals = _rpc_totals.get(method, None)
+    if totals is None:
+        totals = [0, 0, 0, 0]
+        _rpc_totals[method] = totals
+    totals[0] += 1
+    totals[1] += elapsed_ns
+    totals[2] += bytes_sent
+    totals[3] += bytes_received
+
+
+def get_rpc_totals() -> typing.Dict[str, typing.Tuple[int, float, int, int]]:
+    """
+    Gets, per method, (count, seconds, bytes sent, bytes received) of all requests since the process started
+    """
+    return {
+        method: (count, ns / 1e9, sent, received)
+        for method, (count, ns, sent, received) in list(_rpc_totals.items())
+    }
+
+
+def set_context(**kwargs):
+    """
+    Tag this thread's subsequent spans (ie, with the block being processed), so the
+    slowest occurrence of each span can be attributed
+    """
+    if not ENABLED:
+        return
+    _local.context = kwargs
+
+
 def maybe_log():
     """
     If enough time has passed since last log, emits a new log report and clears
@@ -34,6 +284,7 @@ def maybe_log():
 def log():
     global _last_log
     now = time.time()
+    snap = snapshot()
     for k in sorted(_global_profile.keys()):
         if _last_log > 0:
             # we can compute percentage of time elapsed
@@ -44,8 +295,84 @@ def log():
             l.debug(f'profile name="{k}" seconds={_global_profile[k]}')
         _global_profile[k] = 0
 
+    for k in sorted(_global_counts.keys()):
+        l.debug(f'count name="{k}" n={_global_counts[k]}')
+        _global_counts[k] = 0
+
+    for k, v in sorted(snap['gauges'].items()):
+        l.debug(f'gauge name="{k}" value={v}')
+
+    for path, stats in sorted(snap['spans'].items()):
+        l.debug(
+            f'span path="{path}" n={stats["count"]} seconds={stats["total_seconds"]:.3f} '
+            f'self={stats["self_seconds"]:.3f} p50={stats["p50_seconds"] * 1000:.3f}ms '
+            f'p99={stats["p99_seconds"] * 1000:.3f}ms max={stats["max_seconds"] * 1000:.3f}ms '
+            f'max_context={stats["max_context"]}'
+        )
+    for name, stats in sorted(snap['measurements'].items()):
+        l.debug(
+            f'measurement name="{name}" n={stats["count"]} seconds={stats["total_seconds"]:.3f} '
+            f'p50={stats["p50_seconds"] * 1000:.3f}ms p99={stats["p99_seconds"] * 1000:.3f}ms '
+            f'max={stats["max_seconds"] * 1000:.3f}ms max_context={stats["max_context"]}'
+        )
+    for rpc in snap['rpc']:
+        l.debug(
+            f'rpc span="{rpc["span"]}" method={rpc["method"]} n={rpc["count"]} seconds={rpc["total_seconds"]:.3f} '
+            f'sent={rpc["bytes_sent"]:,}B received={rpc["bytes_received"]:,}B p50={rpc["p50_seconds"] * 1000:.3f}ms '
+            f'p99={rpc["p99_seconds"] * 1000:.3f}ms max={rpc["max_seconds"] * 1000:.3f}ms'
+        )
+    dump_json(snap)
+    _clear_spans()
+
     _last_log = now
 
+
+def snapshot() -> typing.Dict[str, typing.Any]:
+    """
+    Get the span stats for the current interval as a json-serializable dict
+    """
+    merged: typing.Dict[str, SpanStats] = {}
+    def walk(node: SpanStats, prefix: str):
+        for name, c in list(node.children.items()):
+            path = prefix + name
+            if c.count > 0:
+                if path not in merged:
+                    merged[path] = SpanStats()
+                merged[path].merge(c)
+            walk(c, path + '/')
+
+    with _thread_roots_lock:
+        for root in _thread_roots:
+            walk(root, '')
+    with _measurements_lock:
+        measurements = {name: stats.to_json() for name, stats in _measurements.items()}
+    return {
+        'pid': os.getpid(),
+        'interval_start': _last_log if _last_log > 0 else None,
+        'interval_end': time.time(),
+        'spans': {path: stats.to_json() for path, stats in merged.items()},
+        'measurements': measurements,
+        'counts': dict(_global_counts),
+        'gauges': dict(_gauges),
+        'rpc': [
+            dict(span=tag, method=method, **stats.to_json())
+            for (tag, method), stats in sorted(list(_rpc_stats.items()))
+        ],
+    }
+
+
+def dump_json(snap: typing.Dict[str, typing.Any]):
+    """
+    Append the snapshot as a json line to PROFILE_JSON_PATH, if set ('{pid}' in the path
+    is replaced by the process id)
+    """
+    path = os.getenv('PROFILE_JSON_PATH', '')
+    if path == '':
+        return
+    with open(path.replace('{pid}', str(os.getpid())), mode='a') as fout:
+        fout.write(json.dumps(snap, default=str) + '\n')
+
+
 def get_measurement(name: str) -> typing.Optional[float]:
     """
     Gets the measurement named 'name'; defaults to 0
@@ -63,39 +390,132 @@ def reset_measurement(name: str):
 
 def reset():
     _global_profile.clear()
+    _global_counts.clear()
+    _gauges.clear()
+    _clear_spans()
+
+
+def _clear_spans():
+    with _thread_roots_lock:
+        for root in _thread_roots:
+            root.clear()
+    with _measurements_lock:
+        _measurements.clear()
+    _rpc_stats.clear()
 
 def inc_measurement(name: str, elapsed: float):
     """
     increase measurement by the given amount
+
+    The time may overlap spans already recorded, so it is kept out of the span tree
+    (and does not count toward the enclosing span's child time)
     """
     if not ENABLED:
         return
     _global_profile[name] = _global_profile.get(name, 0) + elapsed
+    elapsed_ns = int(elapsed * 1e9)
+    with _measurements_lock:
+        stats = _measurements.get(name, None)
+        if stats is None:
+            stats = MeasurementStats()
+            _measurements[name] = stats
+        stats.record(elapsed_ns, 0)
+
+
+def get_count(name: str) -> int:
+    """
+    Gets the count named 'name'; defaults to 0
+    """
+    return _global_counts.get(name, 0)
+
+def inc_count(name: str, n: int = 1):
+    """
+    increase count by the given amount
+    """
+    if not ENABLED:
+        return
+    _global_counts[name] = _global_counts.get(name, 0) + n
+    _total_counts[name] = _total_counts.get(name, 0) + n
+
+
+def get_total_counts() -> typing.Dict[str, int]:
+    """
+    Gets all counts since the process started (unlike get_count, these are never reset)
+    """
+    return dict(_total_counts)
+
+
+def set_gauge(name: str, value: float):
+    """
+    Set the gauge to value; gauges are reported every interval until changed
+    """
+    if not ENABLED:
+        return
+    _gauges[name] = value
+
+
+def clear_gauges(prefix: str):
+    """
+    Remove the gauges whose names start with prefix
+    """
+    for k in [k for k in _gauges if k.startswith(prefix)]:
+        del _gauges[k]
+
+
+def get_gauges() -> typing.Dict[str, float]:
+    return dict(_gauges)
 
 
 class ProfilerContextManager:
-    _name: str
-    _start: float
+    __slots__ = ('_name', '_node', '_stack', '_start', '_child_ns')
 
     def __init__(self, name: str) -> None:
         self._name = name
         self._start = None
 
     def __enter__(self) -> None:
-        if not ENABLED:
-            return
-        self._start = time.time()
+        try:
+            stack = _local.stack
+        except AttributeError:
+            _root()
+            stack = _local.stack
+        parent = stack[-1]._node if stack else _local.root
+        node = parent.children.get(self._name, None)
+        if node is None:
+            node = parent.child(self._name)
+        self._node = node
+        self._stack = stack
+        self._child_ns = 0
+        stack.append(self)
+        self._start = time.perf_counter_ns()
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        elapsed_ns = time.perf_counter_ns() - self._start
+        stack = self._stack
+        stack.pop()
+        if stack:
+            stack[-1]._child_ns += elapsed_ns
+
+        _global_profile[self._name] = _global_profile.get(self._name, 0) + elapsed_ns / 1e9
+        self._node.record(elapsed_ns, elapsed_ns - self._child_ns)
+
+
+class _NullContextManager:
+
+    def __enter__(self) -> None:
+        pass
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
-        if not ENABLED:
-            return
-        elapsed = time.time() - self._start
-        _global_profile[self._name] = _global_profile.get(self._name, 0) + elapsed
+        pass
+
 
+_NULL_CONTEXT_MANAGER = _NullContextManager()
 
-def profile(name: str) -> ProfilerContextManager:
+
+def profile(name: str) -> typing.Union[ProfilerContextManager, _NullContextManager]:
     """
     Returns a context manager profiling functionality
     """
+    if not ENABLED:
+        return _NULL_CONTEXT_MANAGER
     return ProfilerContextManager(name)
-
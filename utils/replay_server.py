@@ -0,0 +1,105 @@
+"""
+utils/replay_server.py
+
+Websocket JSON-RPC server which stands in for a node by serving responses from
+recordings made with RPC_RECORD_PATH (see utils/rpc_recording.py), with
+configurable injected latency.
+
+    python3 -m utils.replay_server --port 8546 --latency-ms 5 /tmp/run.jsonl.gz
+    WEB3_HOST=ws://127.0.0.1:8546 RPC_CACHE_PATH= python3 -m backtest.top_of_block ...
+"""
+import argparse
+import asyncio
+import json
+import random
+import typing
+import zlib
+import logging
+
+import websockets
+import websockets.exceptions
+
+from .rpc_recording import RecordedResponses
+
+l = logging.getLogger(__name__)
+
+
+class ReplayServer:
+    """
+    A request gets the recorded responses to identical requests (same method and params)
+    in the order they were recorded; once those run out, the last one is repeated.
+    Requests that were never recorded get a JSON-RPC error.
+
+    Each response is delayed by `latency` plus up to `jitter` seconds. The jitter is
+    derived from the request and how many times it has been seen, so a given run
+    sees the same delays every time regardless of scheduling.
+    """
+    latency: float
+    jitter: float
+    responses: RecordedResponses
+
+    def __init__(self, recording_paths: typing.Sequence[str], latency: float = 0.0, jitter: float = 0.0) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.responses = RecordedResponses(recording_paths)
+
+    async def serve(self, host: str, port: int):
+        async with websockets.serve(self._handle, host, port, max_size=1024 * 1024 * 1024):
+            l.info(f'Replaying on ws://{host}:{port}')
+            await asyncio.Future()
+
+    async def _handle(self, ws: websockets.WebSocketServerProtocol, path: str = None):
+        try:
+            async for message in ws:
+                # answer concurrently, so that pipelined requests are not serialized
+                asyncio.ensure_future(self._respond(ws, message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _respond(self, ws: websockets.WebSocketServerProtocol, message: str):
+        request = json.loads(message)
+        if isinstance(request, list):
+            responses = [self._lookup(r) for r in request]
+            delay = max([d for _, d in responses], default=0.0)
+            payload = [r for r, _ in responses]
+        else:
+            payload, delay = self._lookup(request)
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await ws.send(json.dumps(payload))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def _lookup(self, request: dict) -> typing.Tuple[dict, float]:
+        ret, key, n_seen = self.responses.respond(request)
+
+        delay = self.latency
+        if self.jitter > 0:
+            delay += random.Random(zlib.crc32(f'{n_seen}:{key}'.encode('utf8'))).uniform(0, self.jitter)
+        return ret, delay
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded JSON-RPC responses over websocket')
+    parser.add_argument('recordings', nargs='+', help='Recording files made with RPC_RECORD_PATH')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8546)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Maximum (deterministic) random delay added on top of latency')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    server = ReplayServer(args.recordings, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        l.info(f'Served {server.responses.n_served:,} recorded responses, {server.responses.n_not_recorded:,} requests were not recorded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+utils/rpc_cache.py
+
+On-disk cache of JSON-RPC responses that can never change (ie, queries against
+finalized historical blocks), shared by all processes on the host.
+"""
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import typing
+import zlib
+import logging
+
+from . import metrics
+from .profiling import get_total_counts, inc_count
+
+l = logging.getLogger(__name__)
+
+# blocks at least this far behind the head are treated as final
+CONFIRMATIONS = 64
+
+# methods evaluated at a block -> index of the block parameter
+_AT_BLOCK_METHODS = {
+    'eth_getStorageAt': 2,
+    'eth_call': 1,
+    'eth_getBalance': 1,
+    'eth_getCode': 1,
+}
+
+
+def _parse_block(block: typing.Any) -> typing.Optional[int]:
+    """
+    Parse a numeric block identifier, or None if it is a tag like 'latest'
+    """
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+    return None
+
+
+def block_of_request(method: str, params: typing.Any) -> typing.Optional[int]:
+    """
+    For a request whose response is fixed once the given block is final, get that block;
+    None if the request is not cacheable (or cacheability depends on the response).
+    """
+    if method in _AT_BLOCK_METHODS:
+        idx = _AT_BLOCK_METHODS[method]
+        if len(params) <= idx:
+            return None
+        return _parse_block(params[idx])
+
+    if method in ('eth_getBlockByNumber', 'eth_getBlockReceipts'):
+        return _parse_block(params[0])
+
+    if method == 'eth_getLogs':
+        filter_params = params[0]
+        if 'blockHash' in filter_params:
+            # no way to tell whether that block is final
+            return None
+        from_block = _parse_block(filter_params.get('fromBlock', None))
+        to_block = _parse_block(filter_params.get('toBlock', None))
+        if from_block is None or to_block is None:
+            return None
+        return to_block
+
+    return None
+
+
+def block_of_response(method: str, response: typing.Any) -> typing.Optional[int]:
+    """
+    For requests keyed only by hash (ie, receipts), get the block the response was included in
+    """
+    if method == 'eth_getTransactionReceipt':
+        result = response.get('result', None)
+        if result is None:
+            # not (yet) mined
+            return None
+        return _parse_block(result.get('blockNumber', None))
+    return None
+
+
+class RPCCache:
+    """
+    Response cache backed by sqlite in WAL mode, which allows many concurrent readers
+    across processes alongside one writer at a time.
+
+    Reads go through a per-thread connection. Writes (and access-time bumps) are queued
+    and committed in batches by a background thread, which also evicts least-recently-used
+    entries once the cache grows beyond max_bytes.
+    """
+    path: str
+    max_bytes: int
+
+    def __init__(self, path: str, max_bytes: int = 20 * (1024 ** 3)) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._queue = queue.Queue(maxsize=10_000)
+
+        conn = self._connect()
+        conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS responses (
+                key BLOB PRIMARY KEY NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access INTEGER NOT NULL
+            )
+            '''
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+        conn.commit()
+
+        t = threading.Thread(target=self._write_forever, name='rpc-cache-writer', daemon=True)
+        t.start()
+
+        metrics.register_gauge('rpc_cache_hit_ratio', _hit_ratio)
+        metrics.register_gauge('rpc_cache_write_queue_depth', self._queue.qsize)
+
+    def get(self, method: str, params: typing.Any) -> typing.Optional[typing.Any]:
+        """
+        Get the cached result for the request, or None if not cached
+        """
+        key = _key(method, params)
+        row = self._connect().execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            inc_count('rpc_cache.miss')
+            return None
+        inc_count('rpc_cache.hit')
+        self._enqueue(('touch', key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, method: str, params: typing.Any, result: typing.Any):
+        value = zlib.compress(json.dumps(result, separators=(',', ':')).encode('ascii'))
+        self._enqueue(('put', _key(method, params), value))
+
+    def _enqueue(self, item: tuple):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # the cache is best-effort, do not make the caller wait for disk
+            inc_count('rpc_cache.dropped_writes')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write_forever(self):
+        conn = self._connect()
+        n_since_evict_check = 0
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 1_000:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            now = int(time.time())
+            puts = []
+            touches = []
+            for item in batch:
+                if item[0] == 'put':
+                    _, key, value = item
+                    puts.append((key, value, len(value), now))
+                else:
+                    _, key = item
+                    touches.append((now, key))
+            try:
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)', puts)
+                    conn.executemany('UPDATE responses SET last_access = ? WHERE key = ?', touches)
+            except sqlite3.OperationalError:
+                l.exception('Could not write to rpc cache')
+                continue
+
+            n_since_evict_check += len(puts)
+            if n_since_evict_check >= 10_000:
+                n_since_evict_check = 0
+                self._maybe_evict(conn)
+
+    def _maybe_evict(self, conn: sqlite3.Connection):
+        (total,) = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total <= self.max_bytes:
+            return
+
+        # evict down to 90% so we are not doing this on every check
+        target = int(self.max_bytes * 0.9)
+        l.debug(f'Evicting from rpc cache, size={total:,} bytes target={target:,} bytes')
+        while total > target:
+            with conn:
+                rows = conn.execute('SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 1000').fetchall()
+                if len(rows) == 0:
+                    break
+                conn.executemany('DELETE FROM responses WHERE key = ?', [(k,) for k, _ in rows])
+            total -= sum(size for _, size in rows)
+            inc_count('rpc_cache.evicted', len(rows))
+
+
+def _hit_ratio() -> typing.Optional[float]:
+    counts = get_total_counts()
+    hits = counts.get('rpc_cache.hit', 0)
+    total = hits + counts.get('rpc_cache.miss', 0)
+    if total == 0:
+        return None
+    return hits / total
+
+
+def _key(method: str, params: typing.Any) -> bytes:
+    return hashlib.sha256(json.dumps([method, params], sort_keys=True, separators=(',', ':')).encode('ascii')).digest()
+
+
+def open_default_cache() -> typing.Optional[RPCCache]:
+    """
+    Open the cache at RPC_CACHE_PATH (default: STORAGE_DIR/rpc_cache.sqlite3); set it to
+    an empty string to disable caching. Size is bounded by RPC_CACHE_MAX_GB (default 20).
+    """
+    default_path = os.path.join(os.getenv('STORAGE_DIR', '/mnt/goldphish'), 'rpc_cache.sqlite3')
+    path = os.getenv('RPC_CACHE_PATH', default_path)
+    if path == '':
+        return None
+    if not os.path.isdir(os.path.dirname(path) or '.'):
+        l.warning(f'Not caching rpc responses, directory for {path} does not exist')
+        return None
+    max_bytes = int(float(os.getenv('RPC_CACHE_MAX_GB', '20')) * (1024 ** 3))
+    return RPCCache(path, max_bytes)
@@ -0,0 +1,185 @@
+"""
+utils/rpc_recording.py
+
+Records every JSON-RPC request/response pair of a run to a (gzipped, json-lines)
+file, which can later stand in for a node: over websocket with utils/replay_server.py,
+or in-process with ReplayProvider.
+"""
+import atexit
+import collections
+import concurrent.futures
+import gzip
+import json
+import os
+import queue
+import threading
+import typing
+import logging
+
+import web3.types
+from web3.providers.base import JSONBaseProvider
+
+from .rpc_cache import CONFIRMATIONS
+
+l = logging.getLogger(__name__)
+
+ERROR_NOT_RECORDED = -32001
+
+
+def request_key(method: str, params: typing.Any) -> str:
+    """
+    Canonical form of a request, for matching replayed requests to recorded ones
+    """
+    return json.dumps([method, params], sort_keys=True, separators=(',', ':'))
+
+
+class RPCRecorder:
+    """
+    Appends one line per request, {"method", "params", "response"}, where response
+    has either a "result" or an "error". Lines are written by a background thread
+    so that recording does not stall the event loop.
+    """
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._queue = queue.Queue()
+        self._fout = gzip.open(path, mode='at', compresslevel=5)
+        t = threading.Thread(target=self._write_forever, name='rpc-recorder', daemon=True)
+        t.start()
+        atexit.register(self.close)
+        l.info(f'Recording rpc requests to {path}')
+
+    def record(self, method: str, params: typing.Any, response: web3.types.RPCResponse):
+        self._queue.put((method, params, response))
+
+    def flush(self):
+        """
+        Wait until everything recorded so far is written out
+        """
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._fout.close()
+
+    def _write_forever(self):
+        while True:
+            method, params, response = self._queue.get()
+            line = {'method': method, 'params': params, 'response': {k: v for k, v in response.items() if k in ('result', 'error')}}
+            self._fout.write(json.dumps(line, separators=(',', ':')) + '\n')
+            if self._queue.empty():
+                self._fout.flush()
+            self._queue.task_done()
+
+
+def read_recording(path: str) -> typing.Iterator[typing.Tuple[str, typing.Any, web3.types.RPCResponse]]:
+    """
+    Yields (method, params, response) for each recorded request, in order
+    """
+    with gzip.open(path, mode='rt') as fin:
+        try:
+            for line in fin:
+                rec = json.loads(line)
+                yield rec['method'], rec['params'], rec['response']
+        except (EOFError, json.JSONDecodeError):
+            # the recording process was killed mid-write
+            l.warning(f'Recording {path} is truncated')
+
+
+def open_default_recorder() -> typing.Optional[RPCRecorder]:
+    """
+    Open a recorder at RPC_RECORD_PATH, if it is set; '{pid}' in the path is replaced
+    by the process id, so that worker processes do not write over each other
+    """
+    path = os.getenv('RPC_RECORD_PATH', '')
+    if path == '':
+        return None
+    return RPCRecorder(path.replace('{pid}', str(os.getpid())))
+
+
+class RecordedResponses:
+    """
+    Recorded responses, by request. A request gets the recorded responses to identical
+    requests (same method and params) in the order they were recorded; once those run
+    out, the last one is repeated.
+    """
+    n_served: int
+    n_not_recorded: int
+
+    def __init__(self, recording_paths: typing.Sequence[str]) -> None:
+        self.n_served = 0
+        self.n_not_recorded = 0
+        self._responses: typing.Dict[str, typing.List[dict]] = collections.defaultdict(list)
+        self._n_seen: typing.Dict[str, int] = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+        n_loaded = 0
+        for path in recording_paths:
+            for method, params, response in read_recording(path):
+                self._responses[request_key(method, params)].append(response)
+                n_loaded += 1
+        l.info(f'Loaded {n_loaded:,} recorded responses to {len(self._responses):,} distinct requests')
+
+    def next(self, key: str) -> typing.Tuple[typing.Optional[dict], int]:
+        """
+        Returns the next response to the request with the given key (or None if it was
+        never recorded), and how many times the request was seen before
+        """
+        with self._lock:
+            n_seen = self._n_seen[key]
+            self._n_seen[key] += 1
+            recorded = self._responses.get(key, None)
+            if recorded is None:
+                self.n_not_recorded += 1
+                return None, n_seen
+            self.n_served += 1
+            return recorded[min(n_seen, len(recorded) - 1)], n_seen
+
+    def respond(self, request: dict) -> typing.Tuple[dict, str, int]:
+        """
+        Answer a JSON-RPC request; returns (response, request key, times seen before)
+        """
+        key = request_key(request['method'], request.get('params', []))
+        recorded, n_seen = self.next(key)
+
+        ret = {'jsonrpc': '2.0', 'id': request.get('id', None)}
+        if recorded is None:
+            l.warning(f'Request not in recording: {key[:200]}')
+            ret['error'] = {'code': ERROR_NOT_RECORDED, 'message': 'request not in recording'}
+        else:
+            ret.update(recorded)
+        return ret, key, n_seen
+
+
+class ReplayProvider(JSONBaseProvider):
+    """
+    Serves requests in-process from recordings, with the request methods of
+    utils.RetryingProvider, so that recorded runs (and benchmarks) need no node at all.
+    """
+    responses: RecordedResponses
+
+    def __init__(self, recording_paths: typing.Sequence[str]) -> None:
+        super().__init__()
+        self.responses = RecordedResponses(recording_paths)
+
+    def isConnected(self) -> bool:
+        return True
+
+    def make_request(self, method, params) -> web3.types.RPCResponse:
+        ret, _, _ = self.responses.respond({'method': method, 'params': params, 'id': 0})
+        return ret
+
+    def make_request_batch(self, requests: typing.Sequence[typing.Tuple[str, typing.Any]]) -> typing.List[web3.types.RPCResponse]:
+        return [self.make_request(method, params) for method, params in requests]
+
+    def submit_request(self, method, params) -> 'concurrent.futures.Future[web3.types.RPCResponse]':
+        ret = concurrent.futures.Future()
+        ret.set_result(self.make_request(method, params))
+        return ret
+
+    def get_finalized_block(self) -> int:
+        resp = self.make_request('eth_blockNumber', [])
+        if 'error' in resp:
+            raise Exception('eth_blockNumber was not recorded')
+        return int(resp['result'], 16) - CONFIRMATIONS
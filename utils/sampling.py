@@ -0,0 +1,116 @@
+"""
+utils/sampling.py
+
+On-demand diagnostics for running workers, driven by signals:
+
+    kill -USR1 <pid>    dump the stacks of all threads
+    kill -USR2 <pid>    sample all thread stacks for SAMPLE_SECONDS (default 30)
+
+Output goes to the logs directory under STORAGE_DIR; samples are written as
+collapsed stacks (one `frame;frame;frame count` line per distinct stack), which
+flamegraph.pl and speedscope read directly.
+"""
+import collections
+import datetime
+import faulthandler
+import os
+import signal
+import sys
+import threading
+import time
+import typing
+import logging
+
+l = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SECONDS = 30
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.005
+
+_file_prefix: typing.Optional[str] = None
+_stack_dump_file: typing.Optional[typing.TextIO] = None
+_sampler_lock = threading.Lock()
+_sampler: typing.Optional[threading.Thread] = None
+
+_repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def install_signal_handlers(logdir: str, name: str):
+    """
+    Install the SIGUSR1 (stack dump) and SIGUSR2 (sampler) handlers; output files
+    are prefixed with `logdir/name`. Must be called from the main thread.
+    """
+    global _file_prefix, _stack_dump_file
+    if threading.current_thread() is not threading.main_thread():
+        l.warning('Not installing diagnostic signal handlers outside of the main thread')
+        return
+
+    _file_prefix = os.path.join(logdir, name)
+
+    # faulthandler dumps from within the C signal handler, so it works even when
+    # the main thread is stuck in a blocking call and cannot run python handlers
+    _stack_dump_file = open(_file_prefix + '.stacks.txt', mode='a')
+    faulthandler.register(signal.SIGUSR1, file=_stack_dump_file, all_threads=True)
+
+    signal.signal(signal.SIGUSR2, _on_sigusr2)
+
+
+def _on_sigusr2(signum, frame):
+    duration = float(os.getenv('SAMPLE_SECONDS', DEFAULT_SAMPLE_SECONDS))
+    start_sampler(duration)
+
+
+def start_sampler(duration: float, interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS) -> bool:
+    """
+    Sample all threads' stacks every `interval` seconds for `duration` seconds, in a
+    background thread, then write them out. Returns False if a sampler is already running.
+    """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is not None and _sampler.is_alive():
+            l.warning('Sampler already running')
+            return False
+        _sampler = threading.Thread(target=_sample, args=(duration, interval), name='stack-sampler', daemon=True)
+        _sampler.start()
+    return True
+
+
+def _sample(duration: float, interval: float):
+    l.info(f'Sampling stacks for {duration:.1f} seconds')
+    counts: typing.Counter[str] = collections.Counter()
+    me = threading.get_ident()
+    n_samples = 0
+    t_end = time.monotonic() + duration
+    while time.monotonic() < t_end:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            counts[collapse(names.get(ident, str(ident)), frame)] += 1
+        n_samples += 1
+        time.sleep(interval)
+
+    fname = (_file_prefix or os.path.join('/tmp', f'sampler_{os.getpid()}')) + \
+        f'_{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")}.folded'
+    with open(fname, mode='w') as fout:
+        for stack, n in counts.most_common():
+            fout.write(f'{stack} {n}\n')
+    l.info(f'Wrote {n_samples:,} stack samples to {fname}')
+
+
+def collapse(thread_name: str, frame) -> str:
+    """
+    Collapse the stack ending at `frame` into 'thread;file:function;...', outermost call first
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        fname = code.co_filename
+        if fname.startswith(_repo_root):
+            fname = os.path.relpath(fname, _repo_root)
+        else:
+            fname = os.path.basename(fname)
+        frames.append(f'{fname}:{code.co_name}')
+        frame = frame.f_back
+    frames.append(thread_name)
+    # ';' separates frames and the final ' ' separates the count
+    return ';'.join(reversed(frames)).replace(' ', '_')